@@ -0,0 +1,91 @@
+"""The encrypted attachment store: write throughput, dedupe, and reading back.
+
+``hash only`` is what an import did before the store existed (one pass of
+sha256 over the file); ``store`` hashes, encrypts and writes the chunks in
+the same pass, and ``store again`` is the same file imported a second time,
+when every chunk is already there. ``read`` decrypts the whole file back;
+``seek + 64 KB`` is one random read, as a Range request or a video player
+makes, which only decrypts the chunk it lands in.
+
+    python benchmarks/attachment_store.py --mb 512
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import attachments
+import db
+import evidence_store
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def read_all(source):
+    while source.read(attachments.CHUNK_SIZE):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attachment store write and read throughput.')
+    parser.add_argument('--mb', type=int, default=256, help='size of the test file')
+    parser.add_argument('--seeks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    folder = tempfile.mkdtemp()
+    file_path = os.path.join(folder, 'evidence.bin')
+    rng = random.Random(args.seed)
+    with open(file_path, 'wb') as f:
+        for _ in range(args.mb):
+            f.write(rng.randbytes(1 << 20))
+    conn = db.connect(password, os.path.join(folder, 'attachments.db'))
+    db.init_schema(conn)
+    files_store = attachments.store(conn)
+
+    result = {'mb': args.mb}
+    stored = []
+    for name, fn in (('hash only', lambda: evidence_store.hash_file(file_path)),
+                     ('store', lambda: stored.append(files_store.write(file_path))),
+                     ('store again', lambda: files_store.write(file_path))):
+        seconds = timed(fn)
+        result[name] = {'mb_per_s': round(args.mb / seconds, 1)}
+        print(f"{name:<16}{result[name]['mb_per_s']:>10} MB/s")
+    sha256, size, chunk_ids = stored[0]
+    attachments.save(conn, sha256, size, chunk_ids)
+    conn.commit()
+
+    with attachments.reader(conn, sha256) as source:
+        seconds = timed(lambda: read_all(source))
+    result['read'] = {'mb_per_s': round(args.mb / seconds, 1)}
+    print(f"{'read':<16}{result['read']['mb_per_s']:>10} MB/s")
+    times = []
+    with attachments.reader(conn, sha256) as source:
+        for _ in range(args.seeks):
+            offset = rng.randrange(size - 65536)
+            start = time.perf_counter()
+            source.seek(offset)
+            source.read(65536)
+            times.append((time.perf_counter() - start) * 1000)
+    result['seek + 64 KB'] = {'median_ms': round(statistics.median(times), 2), 'max_ms': round(max(times), 2)}
+    print(f"{'seek + 64 KB':<16}{result['seek + 64 KB']['median_ms']:>10} ms median"
+          f"{result['seek + 64 KB']['max_ms']:>10} ms max")
+    conn.close()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
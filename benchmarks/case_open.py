@@ -0,0 +1,97 @@
+"""Opening a case: the key derivation per connection, and a small case next to a huge one.
+
+``connect`` times db.connect on an existing database with the derived key
+cached (every open after the first in a session) and without it (SQLCipher
+running its KDF, as every open did before). With the sqlite3 stand-in used
+in some test setups there is no KDF and both are the same.
+
+``first page`` opens a connection and loads the first timeline page and
+search results of a small case, the way the app does after a case is
+picked, with the small case in the same file as a --rows case (``shared``)
+or in a file of its own (``separate``).
+
+    python benchmarks/case_open.py --rows 200000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import pages
+import synthetic_case
+
+QUERY = 'visitation'
+
+
+def time_connect(password, path, opens, cached):
+    times = []
+    for _ in range(opens):
+        if not cached:
+            db._raw_keys.clear()
+        start = time.perf_counter()
+        conn = db.connect(password, path)
+        times.append((time.perf_counter() - start) * 1000)
+        conn.close()
+    return times
+
+
+def time_first_page(password, path, case_id, opens):
+    times = []
+    for _ in range(opens):
+        start = time.perf_counter()
+        conn = db.connect(password, path)
+        pages.timeline_page(conn, case_id)
+        pages.search_page(conn, case_id, QUERY)
+        times.append((time.perf_counter() - start) * 1000)
+        conn.close()
+    return times
+
+
+def make_db(password, path, rows, seed, cases):
+    conn = db.connect(password, path)
+    db.init_schema(conn)
+    case_ids = synthetic_case.generate(conn, rows, seed, cases)
+    conn.close()
+    return case_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Case open time with and without the cached key derivation, and '
+                                                 'for a small case in a shared or separate database file.')
+    parser.add_argument('--rows', type=int, default=100000, help='size of the big case')
+    parser.add_argument('--opens', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    folder = tempfile.mkdtemp()
+    shared = os.path.join(folder, 'shared.db')
+    # The second of two generated cases gets a tenth of the first one's rows.
+    small_id = make_db(password, shared, args.rows * 11 // 10, args.seed, 2)[1]
+    separate = os.path.join(folder, 'separate.db')
+    separate_id = make_db(password, separate, args.rows // 10, args.seed, 1)[0]
+
+    result = {'rows': args.rows, 'opens': args.opens}
+    # Derive and cache both keys up front, as the first open in a session does.
+    db.connect(password, shared).close()
+    db.connect(password, separate).close()
+    # The KDF runs last: it empties the key cache.
+    for name, times in (('connect, key cached', time_connect(password, shared, args.opens, True)),
+                        ('first page, shared', time_first_page(password, shared, small_id, args.opens)),
+                        ('first page, separate', time_first_page(password, separate, separate_id, args.opens)),
+                        ('connect, KDF', time_connect(password, shared, args.opens, False))):
+        result[name] = {'median_ms': round(statistics.median(times), 2), 'max_ms': round(max(times), 2)}
+        print(f"{name:<24}{result[name]['median_ms']:>10} ms median{result[name]['max_ms']:>10} ms max")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
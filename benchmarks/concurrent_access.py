@@ -0,0 +1,148 @@
+"""Read latency while an import writes: one shared connection vs the connection pool.
+
+A writer thread adds text messages in transactions of --batch rows (as an
+import does) while --readers threads search and page through the timeline.
+``shared`` is the app's model, one connection behind a lock; ``pool`` is
+db.ConnectionPool, one writer plus pooled WAL readers, as used by the
+service layer and its HTTP API.
+
+    python benchmarks/concurrent_access.py --rows 100000 --readers 4
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import contacts
+import db
+import pages
+import service
+import synthetic_case
+
+QUERIES = ['visitation', 'caseworker', 'reunification services', 'supervised visit*', 'missed OR cancelled']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Shared:
+    # One connection for everything, as CaseManagerApp.conn.
+    def __init__(self, password, path):
+        self.conn = db.connect(password, path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self.lock:
+            yield self.conn
+            self.conn.commit()
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.lock:
+            yield self.conn
+
+    def close(self):
+        self.conn.close()
+
+
+def run(access, case_id, args):
+    stop = threading.Event()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def reader(n):
+        rng = random.Random(n)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with access.read() as conn:
+                    if rng.random() < 0.5:
+                        pages.search_page(conn, case_id, rng.choice(QUERIES))
+                    else:
+                        pages.timeline_page(conn, case_id)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+            stop.wait(args.think_ms / 1000)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    try:
+        for _ in range(args.batches):
+            with access.write() as conn:
+                resolver = contacts.ContactResolver(conn, case_id)
+                for _ in range(args.batch):
+                    service.add_text_message(conn, case_id, synthetic_case.when(rng)[0], synthetic_case.name(rng),
+                                             synthetic_case.name(rng), synthetic_case.text(rng, 30), resolver)
+        write_s = time.perf_counter() - start
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return {
+        'rows_per_s': round(args.batches * args.batch / write_s),
+        'reads': len(latencies),
+        'reads_per_s': round(len(latencies) / write_s),
+        'read_p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'read_p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'read_max_ms': round(max(latencies), 2) if latencies else None,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search and timeline latency during an import, shared '
+                                                 'connection vs connection pool.')
+    parser.add_argument('--rows', type=int, default=20000, help='size of the synthetic case')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=500, help='rows per write transaction')
+    parser.add_argument('--think-ms', type=float, default=20, help="each reader's pause between requests")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', default='shared,pool')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    path = os.path.join(tempfile.mkdtemp(), 'concurrent.db')
+    conn = db.connect(password, path)
+    db.init_schema(conn)
+    case_id = synthetic_case.generate(conn, args.rows, args.seed)[0]
+    conn.close()
+
+    result = {'rows': args.rows, 'readers': args.readers, 'batch': args.batch, 'modes': {}}
+    print(f"{'mode':<10}{'rows/s':>10}{'reads/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for mode in args.modes.split(','):
+        access = Shared(password, path) if mode == 'shared' else db.ConnectionPool(password, path, args.readers)
+        try:
+            stats = run(access, case_id, args)
+        finally:
+            access.close()
+        result['modes'][mode] = stats
+        print(f"{mode:<10}{stats['rows_per_s']:>10}{stats['reads_per_s']:>10}{stats['read_p50_ms']!s:>10}"
+              f"{stats['read_p99_ms']!s:>10}{stats['read_max_ms']!s:>10}{stats['errors']:>8}")
+        if stats['first_error']:
+            print(f"  first error: {stats['first_error']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
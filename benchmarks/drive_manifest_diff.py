@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import drive_sync
+import evidence_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the local manifest diff done by Sync Cloud.')
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--size-kb', type=int, default=64)
+    parser.add_argument('--changed', type=float, default=0.01, help='share of files edited before the diff')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), os.path.join(folder, 'bench.db'))
+    db.init_schema(conn)
+    conn.cursor().execute("INSERT INTO cases (case_name, state) VALUES ('Benchmark', 'NY')")
+    paths = []
+    for n in range(args.files):
+        path = os.path.join(folder, f'file{n}.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size_kb * 1024))
+        sha256, size = evidence_store.hash_file(path)
+        drive_sync._record(conn, 1, path, f'id{n}', sha256, size, os.stat(path).st_mtime_ns)
+        paths.append(path)
+    conn.commit()
+
+    start = time.perf_counter()
+    unchanged = drive_sync.changed_files(conn, 1)
+    unchanged_ms = (time.perf_counter() - start) * 1000
+    edited = paths[::max(1, int(1 / args.changed))] if args.changed else []
+    for path in edited:
+        with open(path, 'r+b') as f:
+            f.write(b'edited')
+    start = time.perf_counter()
+    changed = drive_sync.changed_files(conn, 1)
+    changed_ms = (time.perf_counter() - start) * 1000
+    assert not unchanged and len(changed) == len(edited)
+
+    result = {'files': args.files, 'edited': len(edited), 'unchanged_diff_ms': round(unchanged_ms, 1),
+              'edited_diff_ms': round(changed_ms, 1)}
+    print(f"{args.files} files, nothing changed: {result['unchanged_diff_ms']} ms")
+    print(f"{args.files} files, {len(edited)} edited: {result['edited_diff_ms']} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import drive_sync
+from fake_drive import FakeDrive
+
+
+def make_files(folder, count, size_mb):
+    paths = []
+    for n in range(count):
+        path = os.path.join(folder, f'evidence{n}.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(int(size_mb * 1024 * 1024)))
+        paths.append(path)
+    return paths
+
+
+def run(paths, workers, args):
+    server = FakeDrive(latency=args.latency, fail_rate=args.fail_rate).start()
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    conn = db.connect(password, path)
+    db.init_schema(conn)
+    for file_path in paths:
+        drive_sync.enqueue(conn, None, file_path, os.path.basename(file_path))
+    conn.commit()
+
+    finished = threading.Event()
+    done = []
+
+    def on_update(upload_id, status, row):
+        if status != drive_sync.UPLOADING:
+            done.append(status)
+        if len(done) == len(paths):
+            finished.set()
+    client = drive_sync.DriveClient(root_url=server.url, chunk_size=args.chunk_kib * 1024)
+    engine = drive_sync.SyncEngine(lambda: db.connect(password, path), client, workers=workers, on_update=on_update)
+    start = time.perf_counter()
+    engine.start()
+    finished.wait()
+    seconds = time.perf_counter() - start
+    engine.stop(wait=True)
+    server.shutdown()
+    statuses = drive_sync.summary(conn)
+    conn.close()
+    megabytes = len(paths) * args.size_mb
+    return {'workers': workers, 'seconds': round(seconds, 2), 'mb_per_s': round(megabytes / seconds, 1),
+            'failures_injected': server.failures, 'statuses': statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive sync throughput against a local fake Drive server.')
+    parser.add_argument('--files', type=int, default=12)
+    parser.add_argument('--size-mb', type=float, default=20)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--chunk-kib', type=int, default=drive_sync.CHUNK_SIZE // 1024)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the server waits per chunk')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of chunks dropped half way')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    paths = make_files(tempfile.mkdtemp(), args.files, args.size_mb)
+    results = [run(paths, int(workers), args) for workers in args.workers.split(',')]
+    print(f"{'workers':>8}{'seconds':>10}{'MB/s':>8}{'dropped':>9}  statuses")
+    for result in results:
+        print(f"{result['workers']:>8}{result['seconds']:>10}{result['mb_per_s']:>8}"
+              f"{result['failures_injected']:>9}  {result['statuses']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'files': args.files, 'size_mb': args.size_mb, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""A small in-memory stand-in for the Drive v3 upload API.
+
+Implements just what drive_sync.DriveClient uses: the appProperties sha256
+and folder queries, folder creation, copies, downloads, and resumable uploads (new
+files and in-place updates) with 308/Range replies. Latency and dropped
+chunks can be injected to exercise resumption.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDrive(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, fail_rate=0.0, seed=0):
+        super().__init__(address, Handler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.files = {}
+        self.failures = 0
+
+    def add_file(self, name, data, parent=None):
+        """Store a file as if someone else uploaded it through the Drive UI."""
+        file_id = f'fake-{uuid.uuid4().hex[:12]}'
+        with self.lock:
+            self.files[file_id] = {'name': name, 'parents': [parent] if parent else [], 'appProperties': {}}
+            self._set_content(file_id, data)
+        return file_id
+
+    def _set_content(self, file_id, data):
+        meta = self.files[file_id]
+        meta['data'] = bytes(data)
+        meta['md5Checksum'] = hashlib.md5(data).hexdigest()
+        # Millisecond RFC 3339 times, as Drive returns them.
+        meta['modifiedTime'] = datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec='milliseconds').replace('+00:00', 'Z')
+
+    def public(self, file_id, fields=('id', 'name', 'mimeType', 'md5Checksum', 'modifiedTime')):
+        meta = dict(self.files[file_id], id=file_id)
+        meta.setdefault('mimeType', 'application/octet-stream')
+        return {field: meta[field] for field in fields if field in meta}
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def should_fail(self):
+        with self.lock:
+            if self.fail_rate and self.rng.random() < self.fail_rate:
+                self.failures += 1
+                return True
+        return False
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.startswith('/drive/v3/files/') and params.get('alt') == ['media']:
+            with self.server.lock:
+                meta = self.server.files.get(url.path.rsplit('/', 1)[-1])
+            if meta is None:
+                return self._reply(404, {'error': 'not found'})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(meta['data'])))
+            self.end_headers()
+            return self.wfile.write(meta['data'])
+        if url.path != '/drive/v3/files':
+            return self._reply(404, {'error': 'not found'})
+        query = params.get('q', [''])[0]
+        sha256 = re.search(r"key='sha256' and value='(\w+)'", query)
+        parent = re.search(r"'([\w-]+)' in parents", query)
+        after = re.search(r"modifiedTime > '([^']+)'", query)
+        with self.server.lock:
+            files = [self.server.public(file_id) for file_id, meta in self.server.files.items()
+                     if (not sha256 or meta['appProperties'].get('sha256') == sha256.group(1))
+                     and (not parent or parent.group(1) in meta.get('parents', []))
+                     and (not after or meta.get('modifiedTime', '') > after.group(1))]
+        self._reply(200, {'files': files})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        metadata = json.loads(self._body() or b'{}')
+        if url.path == '/drive/v3/files':
+            file_id = f'fake-{uuid.uuid4().hex[:12]}'
+            with self.server.lock:
+                self.server.files[file_id] = dict(metadata, appProperties={})
+            return self._reply(200, {'id': file_id})
+        copied = re.fullmatch(r'/drive/v3/files/([\w-]+)/copy', url.path)
+        if copied:
+            file_id = f'fake-{uuid.uuid4().hex[:12]}'
+            with self.server.lock:
+                source = self.server.files.get(copied.group(1))
+                if source is None:
+                    return self._reply(404, {'error': 'file not found'})
+                self.server.files[file_id] = dict(source, **metadata)
+                self.server._set_content(file_id, source['data'])
+                body = self.server.public(file_id, ('id', 'md5Checksum', 'modifiedTime'))
+            return self._reply(200, body)
+        self._start_session(url, metadata, None)
+
+    def do_PATCH(self):
+        url = urlparse(self.path)
+        metadata = json.loads(self._body() or b'{}')
+        file_id = url.path.rsplit('/', 1)[-1]
+        with self.server.lock:
+            exists = file_id in self.server.files
+        if not exists:
+            return self._reply(404, {'error': 'file not found'})
+        self._start_session(url, metadata, file_id)
+
+    def _start_session(self, url, metadata, file_id):
+        resumable = parse_qs(url.query).get('uploadType') == ['resumable']
+        if not url.path.startswith('/upload/drive/v3/files') or not resumable:
+            return self._reply(400, {'error': 'only resumable uploads are supported'})
+        session_id = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.sessions[session_id] = {'metadata': metadata, 'data': bytearray(), 'file_id': file_id,
+                                                'size': int(self.headers['X-Upload-Content-Length'])}
+        self._reply(200, headers={'Location': f'{self.server.url}/upload/session/{session_id}'})
+
+    def do_PUT(self):
+        session_id = self.path.rsplit('/', 1)[-1]
+        data = self._body()
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            session = self.server.sessions.get(session_id)
+        if session is None:
+            return self._reply(404, {'error': 'upload session not found'})
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)', self.headers.get('Content-Range', ''))
+        if match and data:
+            if self.server.should_fail():
+                # Drop the connection with part of the chunk stored, like a network cut.
+                session['data'].extend(data[:len(data) // 2] if int(match.group(1)) == len(session['data']) else b'')
+                self.close_connection = True
+                return self._reply(503, {'error': 'backend error'})
+            if int(match.group(1)) == len(session['data']):
+                session['data'].extend(data)
+        if len(session['data']) >= session['size']:
+            with self.server.lock:
+                file_id = session['file_id'] or f'fake-{session_id[:12]}'
+                meta = self.server.files.setdefault(file_id, {'parents': []})
+                meta.update(session['metadata'])
+                self.server._set_content(file_id, session['data'])
+                body = self.server.public(file_id, ('id', 'md5Checksum', 'modifiedTime'))
+            return self._reply(200, body)
+        headers = {'Range': f"bytes=0-{len(session['data']) - 1}"} if session['data'] else {}
+        self._reply(308, headers=headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the fake Drive server.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each chunk')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of chunks answered with 503')
+    args = parser.parse_args()
+    server = FakeDrive(('127.0.0.1', args.port), args.latency, args.fail_rate)
+    print(f'fake Drive at {server.url} (set CASE_MANAGER_DRIVE_URL)')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
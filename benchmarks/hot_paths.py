@@ -0,0 +1,288 @@
+"""Latency of the app's hot paths on a synthetic case, without the UI.
+
+Each path does what the matching CaseManagerApp method does, minus the
+widgets: search_data, generate_timeline (list and PDF), process_custom_report
+(list and PDF), contact lookup and process_text_message, and the
+process_document / process_text_image imports (extract and store). Results
+are latency percentiles per path and peak RSS, optionally saved as JSON;
+--compare exits non-zero if a path got slower than a saved run.
+
+    python benchmarks/hot_paths.py --rows 100000 --json new.json --compare baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import contacts
+import db
+import ingest
+import pages
+import pdf_pages
+import reports
+import screenshot_ocr
+import synthetic_case
+
+SEARCHES = ['visitation', 'caseworker', 'reunification services', '"court ordered"', 'supervised visit*',
+            'missed OR cancelled', 'therapy AND school', 'kinship NOT foster', 'w1', 'w15000']
+TIMELINE_PAGES = 5
+CUSTOM_REPORT = 'Documents, text messages and emails'
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def summarize(timings):
+    return {
+        'n': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def search(conn, case_id, files, args):
+    return [timed(pages.search_page, conn, case_id, query) for _ in range(args.repeat) for query in SEARCHES]
+
+
+def timeline(conn, case_id, files, args):
+    # The first page and the next few, as loaded when scrolling.
+    timings = []
+    for _ in range(args.repeat):
+        after = None
+        for _ in range(TIMELINE_PAGES):
+            start = time.perf_counter()
+            _, after = pages.timeline_page(conn, case_id, after)
+            timings.append((time.perf_counter() - start) * 1000)
+            if after is None:
+                break
+    return timings
+
+
+def timeline_pdf(conn, case_id, files, args):
+    path = os.path.join(args.workdir, 'timeline.pdf')
+    return [timed(lambda: reports.render(path, 'Case Timeline', reports.timeline_sections(conn, case_id)))
+            for _ in range(args.report_repeat)]
+
+
+def custom_report(conn, case_id, files, args):
+    # The first page of each section, as shown before the PDF is ready.
+    sections = [('documents', 'doc_id', ('doc_name', 'doc_date', 'substr(content, 1, 300)')),
+                ('text_messages', 'msg_id', ('msg_date', 'substr(content, 1, 300)')),
+                ('emails', 'email_id', ('email_date', 'subject', 'substr(content, 1, 300)'))]
+
+    def first_pages():
+        for table, id_col, columns in sections:
+            pages.dated_page(conn, table, id_col, columns, case_id)
+    return [timed(first_pages) for _ in range(args.repeat)]
+
+
+def custom_report_pdf(conn, case_id, files, args):
+    path = os.path.join(args.workdir, 'custom_report.pdf')
+    return [timed(lambda: reports.render(path, f'Custom Report: {CUSTOM_REPORT}',
+                                         reports.custom_sections(conn, case_id, CUSTOM_REPORT)))
+            for _ in range(args.report_repeat)]
+
+
+def contact_load(conn, case_id, files, args):
+    return [timed(contacts.ContactResolver, conn, case_id) for _ in range(args.repeat)]
+
+
+def contact_lookup(conn, case_id, files, args):
+    # Known names as typed, reordered and by address, plus new names; new
+    # contacts are rolled back so each run sees the same case.
+    c = conn.cursor()
+    c.execute('SELECT name, email FROM contacts WHERE case_id=? LIMIT 200', (case_id,))
+    known = c.fetchall()
+    rng = random.Random(args.seed)
+    lookups = []
+    for n, (name, email) in enumerate(known):
+        first, _, last = name.partition(' ')
+        lookups += [name, f'{last}, {first}', f'{name} <{email}>', f'New Person {n} <new{n}@example.org>']
+    rng.shuffle(lookups)
+    timings = []
+    for _ in range(args.repeat):
+        resolver = contacts.ContactResolver(conn, case_id)
+        timings += [timed(resolver.resolve, text) for text in lookups]
+        conn.rollback()
+    return timings
+
+
+def text_message(conn, case_id, files, args):
+    # process_text_message: resolve both parties, insert the message and its event, commit.
+    resolver = contacts.ContactResolver(conn, case_id)
+    c = conn.cursor()
+    rng = random.Random(args.seed)
+
+    def add():
+        sender, recipient = synthetic_case.name(rng), synthetic_case.name(rng)
+        msg_date = '2024-06-01 12:00:00'
+        sender_id, recipient_id = resolver.resolve(sender), resolver.resolve(recipient)
+        c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                  (case_id, msg_date, sender_id, recipient_id, synthetic_case.text(rng, 20), 0,
+                   db.normalize_date(msg_date)))
+        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+                  (case_id, msg_date, f'Text message from {sender} to {recipient}', 'Text Message',
+                   db.normalize_date(msg_date)))
+        conn.commit()
+    return [timed(add) for _ in range(args.repeat * 10)]
+
+
+def document(conn, case_id, files, args):
+    # process_document as the ingest queue runs it: pages over a process pool, then stored.
+    c = conn.cursor()
+
+    def add(file_path, executor):
+        result = ingest.extract_document({'file_path': file_path}, executor)
+        c.execute('INSERT INTO documents VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                  (case_id, os.path.basename(file_path), file_path, result['content'], '2024-06-01', 'Reports',
+                   '2024-06-01'))
+        pdf_pages.store_pages(conn, case_id, c.lastrowid, result.get('pages', []))
+        conn.commit()
+    with ProcessPoolExecutor() as executor:
+        return [timed(add, file_path, executor) for file_path in files['pdf']]
+
+
+def text_image(conn, case_id, files, args):
+    # process_text_image: OCR into bubbles, then one row per message.
+    resolver = contacts.ContactResolver(conn, case_id)
+    c = conn.cursor()
+
+    def add(file_path):
+        result = ingest.extract_text_image({'file_path': file_path, 'date': '2024-06-01'})
+        me_id, contact_id = resolver.resolve(screenshot_ocr.ME), resolver.resolve(result['contact'])
+        for msg_date, sender, content in screenshot_ocr.messages(result, '2024-06-01'):
+            sent = sender == screenshot_ocr.ME
+            c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                      (case_id, msg_date, me_id if sent else contact_id, contact_id if sent else me_id, content, 1,
+                       db.normalize_date(msg_date)))
+        conn.commit()
+    return [timed(add, file_path) for file_path in files['screenshot']]
+
+
+PATHS = {
+    'search': search,
+    'timeline': timeline,
+    'timeline_pdf': timeline_pdf,
+    'custom_report': custom_report,
+    'custom_report_pdf': custom_report_pdf,
+    'contact_load': contact_load,
+    'contact_lookup': contact_lookup,
+    'text_message': text_message,
+    'document': document,
+    'text_image': text_image,
+}
+# Paths that need the sample files.
+FILE_PATHS = {'document', 'text_image'}
+
+
+def compare(result, baseline, threshold):
+    """Print each path's p50/p95 against a saved run; returns the paths slower by more than threshold."""
+    slower = []
+    print(f"\n{'path':<20}{'p50 before':>12}{'p50 now':>10}{'p95 before':>12}{'p95 now':>10}")
+    for name, now in result['paths'].items():
+        before = baseline.get('paths', {}).get(name)
+        if not before or 'p50_ms' not in before or 'p50_ms' not in now:
+            continue
+        flag = ''
+        if now['p50_ms'] > before['p50_ms'] * threshold or now['p95_ms'] > before['p95_ms'] * threshold:
+            slower.append(name)
+            flag = '  SLOWER'
+        print(f"{name:<20}{before['p50_ms']:>12}{now['p50_ms']:>10}{before['p95_ms']:>12}{now['p95_ms']:>10}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency percentiles and peak memory of the app hot paths.')
+    parser.add_argument('--rows', type=int, default=100000, help='size of the synthetic case (e.g. 1000, 1000000)')
+    parser.add_argument('--cases', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='use this database (its first case) instead of generating one; '
+                                     'the import paths add rows to it')
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma-separated subset of: ' + ', '.join(PATHS))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--report-repeat', type=int, default=1, help='runs of the PDF reports')
+    parser.add_argument('--pdfs', type=int, default=4)
+    parser.add_argument('--screenshots', type=int, default=8)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='a previous --json result to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slower than this ratio of the --compare run counts as a regression')
+    args = parser.parse_args()
+    names = [name.strip() for name in args.paths.split(',') if name.strip()]
+    unknown = set(names) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown path(s): {', '.join(sorted(unknown))}")
+    args.workdir = tempfile.mkdtemp()
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    conn = db.connect(password, args.db or os.path.join(args.workdir, 'bench.db'))
+    db.init_schema(conn)
+    result = {'rows': args.rows, 'cases': args.cases, 'seed': args.seed, 'db': args.db, 'paths': {}}
+    if args.db:
+        c = conn.cursor()
+        c.execute('SELECT MIN(case_id) FROM cases')
+        case_id = c.fetchone()[0]
+        result['rows'] = None
+    else:
+        start = time.perf_counter()
+        case_id = synthetic_case.generate(conn, args.rows, args.seed, args.cases)[0]
+        result['generate_s'] = round(time.perf_counter() - start, 1)
+        print(f"Generated {args.rows} rows in {result['generate_s']} s")
+    files = None
+    if FILE_PATHS & set(names):
+        files = synthetic_case.make_files(os.path.join(args.workdir, 'files'), args.seed, pdfs=args.pdfs,
+                                          screenshots=args.screenshots, wavs=0)
+
+    print(f"{'path':<20}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak MB':>10}")
+    for name in names:
+        try:
+            timings = PATHS[name](conn, case_id, files, args)
+        except (ImportError, OSError) as e:
+            # Without an OCR or PDF library (or the tesseract program) the rest still runs.
+            result['paths'][name] = {'skipped': str(e)}
+            print(f'{name:<20}skipped: {e}')
+            continue
+        except Exception as e:
+            result['paths'][name] = {'failed': repr(e)}
+            print(f'{name:<20}failed: {e!r}')
+            continue
+        summary = dict(summarize(timings), peak_rss_mb=peak_rss_mb())
+        result['paths'][name] = summary
+        print(f"{name:<20}{summary['n']:>6}{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}"
+              f"{summary['max_ms']:>10}{summary['peak_rss_mb']:>10}")
+    result['peak_rss_mb'] = peak_rss_mb()
+    conn.close()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(result, json.load(f), args.threshold)
+        if slower:
+            print(f"\nSlower than {args.compare} by more than {args.threshold}x: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
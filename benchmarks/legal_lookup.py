@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import legal_resources
+import search_index
+
+
+class LegalSite(ThreadingHTTPServer):
+    """A search page linking to a state's statutes and forms, served with ETags.
+
+    latency is added to every response, as a slow government site would.
+    """
+    daemon_threads = True
+
+    def __init__(self, pages, latency=0.0):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.latency = latency
+        self.pages = {}
+        self.requests = {200: 0, 304: 0}
+        self.lock = threading.Lock()
+        for path, title, text in pages:
+            self.set_page(path, title, text)
+
+    def set_page(self, path, title, text):
+        body = f'<html><head><title>{title}</title></head><body><p>{text}</p></body></html>'.encode()
+        self.pages[path] = (body, '"' + hashlib.md5(body).hexdigest() + '"')
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def search_page(self):
+        links = ''.join(f'<a href="/url?q={quote(self.url + path, safe="")}&amp;sa=U">{path}</a>'
+                        for path in self.pages)
+        return f'<html><body>{links}</body></html>'.encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        if self.path.startswith('/search'):
+            body, etag = server.search_page(), None
+        elif self.path in server.pages:
+            body, etag = server.pages[self.path]
+        else:
+            self.send_error(404)
+            return
+        status = 304 if etag and self.headers.get('If-None-Match') == etag else 200
+        with server.lock:
+            server.requests[status] += 1
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Legal resource lookups: first fetch, cached lookups and '
+                                                 'conditional refreshes against a local server.')
+    parser.add_argument('--pages', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=150, help='added to every server response')
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=legal_resources.WORKERS)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    legal_resources.MAX_RESULTS = args.pages
+    text = ' '.join(['The court shall hold a permanency hearing within twelve months of removal.'] * 200)
+    site = LegalSite([(f'/statutes/title-{n}/chapter-{n}.html', f'Chapter {n}: Child Protection', text)
+                      for n in range(args.pages)], latency=args.latency_ms / 1000)
+    threading.Thread(target=site.serve_forever, daemon=True).start()
+
+    path = os.path.join(tempfile.mkdtemp(), 'legal.db')
+    password = os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark')
+    conn = db.connect(password, path)
+    db.init_schema(conn)
+    library = legal_resources.LegalLibrary(lambda: db.connect(password, path), workers=args.workers,
+                                           search_url=site.url + '/search')
+    result = {'pages': args.pages, 'latency_ms': args.latency_ms, 'workers': args.workers}
+
+    start = time.perf_counter()
+    result['pages_fetched'] = library.refresh('ohio').result()
+    result['first_refresh_s'] = round(time.perf_counter() - start, 3)
+
+    times = []
+    for _ in range(args.lookups):
+        start = time.perf_counter()
+        legal_resources.needs_refresh(conn, 'ohio')
+        legal_resources.cached(conn, 'ohio')
+        times.append((time.perf_counter() - start) * 1000)
+    result['cached_lookup_ms_p50'] = round(statistics.median(times), 3)
+    result['cached_lookup_ms_p99'] = round(percentile(times, 99), 3)
+
+    start = time.perf_counter()
+    hits = search_index.search(conn, 1, 'permanency hearing')
+    result['search_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    result['search_hits'] = len(hits)
+
+    before = dict(site.requests)
+    site.set_page('/statutes/title-0/chapter-0.html', 'Chapter 0: Child Protection', text + ' Amended.')
+    start = time.perf_counter()
+    result['pages_changed'] = library.refresh('ohio', force=True).result()
+    result['conditional_refresh_s'] = round(time.perf_counter() - start, 3)
+    result['refresh_not_modified'] = site.requests[304] - before[304]
+    result['refresh_full'] = site.requests[200] - before[200]
+    library.close()
+
+    print(f"First refresh: {result['pages_fetched']} pages in {result['first_refresh_s']} s "
+          f"({args.latency_ms} ms per response, {args.workers} workers)")
+    print(f"Cached lookup: p50 {result['cached_lookup_ms_p50']} ms, p99 {result['cached_lookup_ms_p99']} ms; "
+          f"search {result['search_ms']} ms ({result['search_hits']} hits)")
+    print(f"Forced refresh: {result['conditional_refresh_s']} s, {result['refresh_not_modified']} not modified, "
+          f"{result['refresh_full']} full responses, {result['pages_changed']} changed")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import base64
+import email.utils
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import message_import
+
+WORDS = ('visit caseworker called mother father court hearing missed drug test therapy school placement '
+         'foster agency report supervised unsupervised late cancelled medical appointment').split()
+PEOPLE = [(f'Person {n}', f'+1555{n:07d}', f'person{n}@agency.gov') for n in range(200)]
+START = 1577836800  # 2020-01-01
+
+
+def _text(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))
+
+
+def write_sms_backup(path, count, rng, mms_every=50):
+    image = base64.b64encode(os.urandom(20000)).decode()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n<smses count=\"{count}\">\n")
+        for n in range(count):
+            name, phone, _ = rng.choice(PEOPLE)
+            date = (START + n * 60) * 1000
+            if n % mms_every:
+                f.write(f'  <sms protocol="0" address="{phone}" date="{date}" type="{rng.choice("12")}" '
+                        f'body={quoteattr(_text(rng))} contact_name="{name}" />\n')
+            else:
+                f.write(f'  <mms date="{date}" msg_box="1" address="{phone}" contact_name="{name}"><parts>'
+                        f'<part seq="0" ct="text/plain" text={quoteattr(_text(rng))} />'
+                        f'<part seq="1" ct="image/jpeg" cl="IMG_{n}.jpg" data="{image}" /></parts>'
+                        f'<addrs><addr address="{phone}" type="137" /><addr address="+15550000000" type="151" />'
+                        f'</addrs></mms>\n')
+        f.write('</smses>\n')
+
+
+def write_ios_sms(path, count, rng):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('CREATE TABLE handle (ROWID INTEGER PRIMARY KEY, id TEXT)')
+    c.execute('CREATE TABLE message (ROWID INTEGER PRIMARY KEY, text TEXT, attributedBody BLOB, date INTEGER, '
+              'is_from_me INTEGER, handle_id INTEGER)')
+    c.execute('CREATE TABLE attachment (ROWID INTEGER PRIMARY KEY, filename TEXT, mime_type TEXT, transfer_name TEXT)')
+    c.execute('CREATE TABLE message_attachment_join (message_id INTEGER, attachment_id INTEGER)')
+    c.executemany('INSERT INTO handle VALUES (?, ?)', [(n + 1, phone) for n, (_, phone, _) in enumerate(PEOPLE)])
+    c.executemany('INSERT INTO message VALUES (NULL, ?, NULL, ?, ?, ?)',
+                  [(_text(rng), (START - message_import._APPLE_EPOCH + n * 60) * 10 ** 9, rng.randint(0, 1),
+                    rng.randint(1, len(PEOPLE))) for n in range(count)])
+    conn.commit()
+    conn.close()
+
+
+def write_mbox(path, count, rng):
+    with open(path, 'w', encoding='utf-8') as f:
+        for n in range(count):
+            name, _, address = rng.choice(PEOPLE)
+            date = email.utils.formatdate(START + n * 60)
+            f.write(f'From {address} {date}\nFrom: {name} <{address}>\nTo: Parent <parent@example.com>\n'
+                    f'Subject: Case update {n}\nDate: {date}\nContent-Type: text/plain; charset=utf-8\n\n'
+                    f'{_text(rng)}\n\n')
+
+
+def write_eml_folder(path, count, rng):
+    os.makedirs(path)
+    for n in range(count):
+        name, _, address = rng.choice(PEOPLE)
+        date = email.utils.formatdate(START + n * 60)
+        with open(os.path.join(path, f'{n:06d}.eml'), 'w', encoding='utf-8') as f:
+            f.write(f'From: {name} <{address}>\nTo: Parent <parent@example.com>\nSubject: Case update {n}\n'
+                    f'Date: {date}\nContent-Type: text/html; charset=utf-8\n\n<p>{_text(rng)}</p>\n')
+
+
+FORMATS = {
+    'sms_backup': ('backup.xml', write_sms_backup, 1),
+    'ios_sms': ('sms.db', write_ios_sms, 1),
+    'mbox': ('mail.mbox', write_mbox, 1),
+    # One file per message, so a tenth as many by default.
+    'eml': ('eml', write_eml_folder, 10),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import generated message archives and report messages/sec.')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    rng = random.Random(0)
+    results = []
+    for kind in args.formats.split(','):
+        name, write, divisor = FORMATS[kind]
+        count = args.messages // divisor
+        path = os.path.join(folder, name)
+        write(path, count, rng)
+        conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), os.path.join(folder, f'{kind}.db'))
+        db.init_schema(conn)
+        conn.cursor().execute("INSERT INTO cases (case_name, state) VALUES ('Benchmark', 'NY')")
+        conn.commit()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        importer = message_import.MessageImporter(conn, 1)
+        stats = importer.run(path)
+        # ru_maxrss is in KiB on Linux.
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+        again = message_import.MessageImporter(conn, 1).run(path)
+        conn.close()
+        messages = stats['texts'] + stats['emails']
+        result = {'format': kind, 'messages': messages, 'attachments': stats['attachments'],
+                  'failed': stats['failed'], 'seconds': round(stats['seconds'], 2),
+                  'messages_per_sec': round(messages / stats['seconds']), 'peak_growth_mb': round(peak, 1),
+                  'reimport_duplicates': again['duplicates']}
+        results.append(result)
+        print(f"{kind}: {messages} messages ({stats['attachments']} attachments) in {result['seconds']} s, "
+              f"{result['messages_per_sec']} messages/sec, peak RSS +{result['peak_growth_mb']} MB; "
+              f"re-import skipped {again['duplicates']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
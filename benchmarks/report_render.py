@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import reports
+
+WORDS = ('visit caseworker called mother father court hearing missed drug test therapy school placement '
+         'foster agency report supervised unsupervised late cancelled medical appointment').split()
+
+
+def seed(conn, events, rng):
+    c = conn.cursor()
+    c.execute("INSERT INTO cases (case_name, state) VALUES ('Benchmark', 'NY')")
+    rows = []
+    for n in range(events):
+        date = time.strftime('%Y-%m-%d', time.localtime(rng.randint(1420070400, 1735603200)))
+        description = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 80)))
+        rows.append((1, date, description, rng.choice(['Visit', 'Call', 'Hearing', 'Report']), date))
+    c.executemany('INSERT INTO events (case_id, event_date, description, event_type, sort_date) '
+                  'VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a large timeline PDF and report time and memory.')
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), os.path.join(folder, 'bench.db'))
+    db.init_schema(conn)
+    seed(conn, args.events, random.Random(0))
+
+    path = os.path.join(folder, 'timeline.pdf')
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rendered = reports.render(path, 'Case Timeline', reports.timeline_sections(conn, 1))
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux; the growth of the peak is what rendering added.
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+    result = {'events': args.events, 'pages': rendered.pages, 'seconds': round(seconds, 2),
+              'ms_per_page': round(seconds * 1000 / rendered.pages, 2), 'peak_growth_mb': round(peak / 2 ** 20, 1),
+              'pdf_mb': round(os.path.getsize(path) / 2 ** 20, 1)}
+    print(f"{args.events} events -> {rendered.pages} pages in {result['seconds']} s "
+          f"({result['ms_per_page']} ms/page), peak RSS +{result['peak_growth_mb']} MB, file {result['pdf_mb']} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+import db
+import pages
+
+FRAME_BUDGET = 1 / 60
+
+
+def seed(conn, rows, rng):
+    c = conn.cursor()
+    c.execute("INSERT INTO cases (case_name, state) VALUES ('Benchmark', 'NY')")
+    data = []
+    for n in range(rows):
+        date = time.strftime('%Y-%m-%d', time.localtime(rng.randint(1420070400, 1735603200)))
+        data.append((1, date, f'Event {n} at the agency office with the caseworker', 'Visit', date))
+    c.executemany('INSERT INTO events (case_id, event_date, description, event_type, sort_date) '
+                  'VALUES (?, ?, ?, ?, ?)', data)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scroll a paged timeline list to the end and time every frame.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--speed', type=float, default=20000, help='scroll speed in pixels per second')
+    parser.add_argument('--seconds', type=float, default=300, help='stop scrolling after this long')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), os.path.join(folder, 'bench.db'))
+    db.init_schema(conn)
+    seed(conn, args.rows, random.Random(0))
+
+    from kivy.app import App
+    from kivy.clock import Clock
+
+    import result_list
+
+    fetch_times = []
+
+    def fetch(after):
+        start = time.perf_counter()
+        rows, after = pages.timeline_page(conn, 1, after)
+        fetch_times.append(time.perf_counter() - start)
+        return [{'text': f'{row[1]}: {row[2]} - {row[3]}'} for row in rows], after
+
+    class ScrollApp(App):
+        def build(self):
+            self.frames = []
+            self.started = time.perf_counter()
+            self.view = result_list.ResultList()
+            self.view.show(fetch)
+            Clock.schedule_once(lambda dt: Clock.schedule_interval(self.step, 0), 0.5)
+            return self.view
+
+        def step(self, dt):
+            self.frames.append(dt)
+            view = self.view
+            scrollable = view._scrollable()
+            if not scrollable:
+                return
+            top = (1 - view.scroll_y) * scrollable + args.speed * dt
+            if (view.fetch is None and top >= scrollable) or time.perf_counter() - self.started > args.seconds:
+                self.stop()
+                return False
+            view.scroll_y = max(0, 1 - top / scrollable)
+
+    app = ScrollApp()
+    app.run()
+    frames = sorted(app.frames[1:])
+    result = {
+        'rows': args.rows,
+        'rows_loaded': len(app.view.rows),
+        'frames': len(frames),
+        'frame_p50_ms': round(statistics.median(frames) * 1000, 1),
+        'frame_p99_ms': round(frames[int(len(frames) * 0.99)] * 1000, 1),
+        'frames_over_budget_pct': round(100 * sum(f > FRAME_BUDGET * 1.5 for f in frames) / len(frames), 2),
+        'fetches': len(fetch_times),
+        'fetch_max_ms': round(max(fetch_times) * 1000, 2),
+        'row_widgets': len(app.view.layout.children),
+    }
+    print(f"{result['rows_loaded']} of {args.rows} rows, {result['frames']} frames: p50 {result['frame_p50_ms']} ms, "
+          f"p99 {result['frame_p99_ms']} ms, {result['frames_over_budget_pct']}% over 25 ms")
+    print(f"{result['fetches']} page fetches, slowest {result['fetch_max_ms']} ms; "
+          f"{result['row_widgets']} row widgets")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
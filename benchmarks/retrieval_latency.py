@@ -0,0 +1,133 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import retrieval
+
+MOTIONS = [
+    'Motion to Oppose Adoption',
+    'Motion for Concurrent Planning Review',
+    'Motion for Relative Guardianship',
+    'Motion for Contempt',
+    'Petition for Writ of Mandamus',
+    'Motion to Restore Visitation',
+]
+
+# Case vocabulary that the motion queries look for, mixed at a low rate into
+# Zipf-distributed filler words so term frequencies resemble real evidence.
+TERMS = ('visit visitation cancelled caseworker reunification services parent foster placement relative '
+         'court ordered hearing missed medication school report compliance therapy bond home study kinship '
+         'grandparent deadline continuance plan agency supervised failed weekly transport call').split()
+FILLER = [f'w{n}' for n in range(20000)]
+# Cumulative, so rng.choices doesn't re-add 20,000 weights for every row.
+CUM_WEIGHTS = list(itertools.accumulate(1 / (n + 1) for n in range(len(FILLER))))
+TERM_RATE = 0.02
+
+
+def _text(rng, words):
+    filler = rng.choices(FILLER, cum_weights=CUM_WEIGHTS, k=words)
+    return ' '.join(rng.choice(TERMS) if rng.random() < TERM_RATE else word for word in filler)
+
+
+def _date(rng):
+    return f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+
+
+def seed(conn, rows, rng):
+    c = conn.cursor()
+    c.execute("INSERT INTO cases (case_name, state) VALUES ('Benchmark', 'NY')")
+    case_id = c.lastrowid
+    per_kind = rows // 3
+    c.executemany('INSERT INTO text_messages (case_id, msg_date, content) VALUES (?, ?, ?)',
+                  [(case_id, _date(rng), _text(rng, 25)) for _ in range(per_kind)])
+    c.executemany("INSERT INTO emails (case_id, email_date, subject, content) VALUES (?, ?, 'Update', ?)",
+                  [(case_id, _date(rng), _text(rng, 120)) for _ in range(per_kind)])
+    c.executemany("INSERT INTO documents (case_id, doc_name, doc_date, content) VALUES (?, 'report.pdf', ?, ?)",
+                  [(case_id, _date(rng), _text(rng, 600)) for _ in range(rows - 2 * per_kind)])
+    conn.commit()
+    return case_id
+
+
+def check_sources(conn, rng, messages=5000):
+    """Whether a document still ranks when thousands of texts match too.
+
+    A fresh case gets one document about visitation and ``messages`` texts
+    that each mention a visit once, more than retrieval.RANKED_ROWS. Capping
+    the matches across all sources at once dropped the document.
+    """
+    c = conn.cursor()
+    c.execute("INSERT INTO cases (case_name, state) VALUES ('Sources check', 'NY')")
+    case_id = c.lastrowid
+    def filler(words):
+        return ' '.join(rng.choices(FILLER, cum_weights=CUM_WEIGHTS, k=words))
+
+    c.execute("INSERT INTO documents (case_id, doc_name, doc_date, content) VALUES (?, 'visits.pdf', ?, ?)",
+              (case_id, _date(rng), ' '.join(filler(30) + ' visitation' for _ in range(5))))
+    doc_id = c.lastrowid
+    c.executemany('INSERT INTO text_messages (case_id, msg_date, content) VALUES (?, ?, ?)',
+                  [(case_id, _date(rng), filler(20) + ' visit') for _ in range(messages)])
+    conn.commit()
+    refs = [passage.ref for passage in retrieval.retrieve(conn, case_id, 'Motion for visitation')]
+    return f'D{doc_id}' in refs
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(conn, case_id, repeat):
+    timings = []
+    for _ in range(repeat):
+        for motion in MOTIONS:
+            start = time.perf_counter()
+            retrieval.retrieve(conn, case_id, motion)
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'queries': len(timings),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of motion evidence retrieval.')
+    parser.add_argument('--rows', type=int, default=100000, help='synthetic evidence rows to seed')
+    parser.add_argument('--case-id', type=int, help='benchmark an existing case in --db instead of seeding one')
+    parser.add_argument('--db', help='database file (default: a temporary one)')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), path)
+    db.init_schema(conn)
+    case_id = args.case_id
+    if case_id is None:
+        start = time.perf_counter()
+        case_id = seed(conn, args.rows, random.Random(0))
+        print(f'seeded {args.rows} rows in {time.perf_counter() - start:.1f}s')
+    result = run(conn, case_id, args.repeat)
+    result['rows'] = args.rows if args.case_id is None else None
+    print(f"{result['queries']} queries: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+          f"max {result['max_ms']} ms")
+    result['sources_check'] = check_sources(conn, random.Random(1))
+    print('sources check:', 'ok' if result['sources_check'] else 'FAILED, a document was crowded out by texts')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    conn.close()
+    if not result['sources_check']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+import ingest
+import search_index
+
+CASES = 5
+CONTACTS_PER_CASE = 400
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%B %d, %Y', '%b %d %Y %H:%M']
+
+# Share of --rows per table; document_pages gets two rows per document.
+SHARES = {'events': 0.4, 'text_messages': 0.3, 'emails': 0.15, 'documents': 0.05}
+
+
+def _date(rng):
+    value = time.localtime(rng.randint(1577836800, 1735603200))
+    return time.strftime(rng.choice(DATE_FORMATS), value)
+
+
+def seed(conn, rows, rng):
+    c = conn.cursor()
+    c.executemany('INSERT INTO cases (case_name, state) VALUES (?, ?)', [(f'Case {n}', 'NY') for n in range(CASES)])
+    c.executemany('INSERT INTO contacts (case_id, name, role) VALUES (?, ?, ?)',
+                  [(case_id, f'Person {n}', 'Unknown') for case_id in range(1, CASES + 1)
+                   for n in range(CONTACTS_PER_CASE)])
+    contacts = CASES * CONTACTS_PER_CASE
+    c.executemany('INSERT INTO events (case_id, event_date, description, event_type) VALUES (?, ?, ?, ?)',
+                  [(rng.randint(1, CASES), _date(rng), f'Event {n}', 'Visit')
+                   for n in range(int(rows * SHARES['events']))])
+    c.executemany('INSERT INTO text_messages (case_id, msg_date, sender_id, recipient_id, content, is_image) '
+                  'VALUES (?, ?, ?, ?, ?, 0)',
+                  [(rng.randint(1, CASES), _date(rng), rng.randint(1, contacts), rng.randint(1, contacts),
+                    f'Message {n} about the visit') for n in range(int(rows * SHARES['text_messages']))])
+    c.executemany('INSERT INTO emails (case_id, email_date, sender_id, recipient_id, subject, content, is_image) '
+                  'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                  [(rng.randint(1, CASES), _date(rng), rng.randint(1, contacts), rng.randint(1, contacts),
+                    f'Subject {n}', f'Email {n} about services') for n in range(int(rows * SHARES['emails']))])
+    documents = int(rows * SHARES['documents'])
+    c.executemany('INSERT INTO documents (case_id, doc_name, content, doc_date, category) VALUES (?, ?, ?, ?, ?)',
+                  [(rng.randint(1, CASES), f'doc{n}.pdf', f'Report {n}', _date(rng), 'Reports')
+                   for n in range(documents)])
+    for page_no in (1, 2):
+        c.execute('INSERT INTO document_pages (case_id, doc_id, page_no, content, ocr) '
+                  'SELECT case_id, doc_id, ?, content, 0 FROM documents', (page_no,))
+    conn.commit()
+
+
+def _time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 2)
+
+
+def run_queries(conn, migrated, repeat):
+    c = conn.cursor()
+    order = 'sort_date, event_id' if migrated else 'event_date'
+    msg_order = 'sort_date, msg_id' if migrated else 'msg_date'
+
+    def timeline():
+        c.execute(f'SELECT event_date, description, event_type FROM events WHERE case_id=? ORDER BY {order}', (1,))
+        c.fetchall()
+
+    def contact_lookups():
+        for n in range(200):
+            c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (f'Person {n}', 1))
+            c.fetchone()
+
+    def messages_by_date():
+        c.execute(f'SELECT msg_date, content FROM text_messages WHERE case_id=? ORDER BY {msg_order} LIMIT 500', (1,))
+        c.fetchall()
+
+    def document_pages():
+        for doc_id in range(1, 201):
+            c.execute('SELECT 1 FROM document_pages WHERE doc_id=? LIMIT 1', (doc_id * 7,))
+            c.fetchone()
+
+    def ingest_resume():
+        c.execute('SELECT job_id FROM ingest_jobs WHERE status IN (?, ?) ORDER BY job_id',
+                  (ingest.QUEUED, ingest.RUNNING))
+        c.fetchall()
+
+    return {
+        'timeline': _time(timeline, repeat),
+        'contact_lookup_x200': _time(contact_lookups, repeat),
+        'messages_by_date_500': _time(messages_by_date, repeat),
+        'page_lookup_x200': _time(document_pages, repeat),
+        'ingest_resume': _time(ingest_resume, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query times before and after the schema migrations.')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), path)
+    db.create_tables(conn)
+    start = time.perf_counter()
+    seed(conn, args.rows, random.Random(0))
+    search_index.ensure_index(conn)
+    conn.commit()
+    print(f'seeded {args.rows} rows in {time.perf_counter() - start:.1f}s')
+    before = run_queries(conn, False, args.repeat)
+    start = time.perf_counter()
+    version = db.migrate(conn)
+    migrate_seconds = round(time.perf_counter() - start, 1)
+    print(f'migrated to version {version} in {migrate_seconds}s')
+    after = run_queries(conn, True, args.repeat)
+    print(f"{'query':<24}{'before ms':>12}{'after ms':>12}")
+    for name in before:
+        print(f'{name:<24}{before[name]:>12}{after[name]:>12}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'migrate_seconds': migrate_seconds, 'before': before, 'after': after},
+                      f, indent=2)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
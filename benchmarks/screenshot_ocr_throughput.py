@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import screenshot_ocr
+
+WORDS = ('visit caseworker called mother father court hearing missed drug test therapy school placement '
+         'foster agency report supervised unsupervised late cancelled medical appointment pickup tonight').split()
+NAMES = ('Jane Smith', 'Robert Lee', 'Maria Garcia', 'Caseworker Brown')
+WIDTH, HEIGHT = 1170, 2532  # an iPhone screenshot
+
+
+def render(path, rng, dark):
+    """Draw a chat screenshot and return its (sent, text) messages."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default(size=44)
+    small = ImageFont.load_default(size=34)
+    background, ink = ((0, 0, 0), (255, 255, 255)) if dark else ((255, 255, 255), (0, 0, 0))
+    received = (38, 38, 40) if dark else (233, 233, 235)
+    image = Image.new('RGB', (WIDTH, HEIGHT), background)
+    draw = ImageDraw.Draw(image)
+    title = rng.choice(NAMES)
+    draw.text((WIDTH / 2, 220), title, font=font, fill=ink, anchor='mm')
+    messages = []
+    y = 380
+    while True:
+        if rng.random() < 0.25:
+            draw.text((WIDTH / 2, y + 20), f'Today {rng.randint(1, 12)}:{rng.randint(0, 59):02d} PM', font=small,
+                      fill=(140, 140, 140), anchor='mm')
+            y += 90
+        sent = rng.random() < 0.5
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 18))]
+        lines = []
+        for word in words:
+            if lines and draw.textlength(f'{lines[-1]} {word}', font=font) < WIDTH * 0.62:
+                lines[-1] += f' {word}'
+            else:
+                lines.append(word)
+        height = 62 * len(lines) + 36
+        if y + height > HEIGHT - 200:
+            break
+        width = max(draw.textlength(line, font=font) for line in lines) + 64
+        left = WIDTH - width - 36 if sent else 36
+        draw.rounded_rectangle((left, y, left + width, y + height), 40,
+                               fill=(11, 132, 254) if sent else received)
+        for n, line in enumerate(lines):
+            draw.text((left + 32, y + 18 + 62 * n), line, font=font, fill=(255, 255, 255) if sent else ink)
+        messages.append((sent, ' '.join(words)))
+        y += height + 30
+    image.save(path)
+    return messages
+
+
+def _words(text):
+    return re.sub(r'[^a-z ]+', '', text.lower()).split()
+
+
+def score(expected, result):
+    # A message counts if a bubble on the right side has exactly its words.
+    found = {(sender == screenshot_ocr.ME, tuple(_words(content))) for _, sender, content in result['messages']}
+    return sum((sent, tuple(_words(text))) in found for sent, text in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR generated chat screenshots and report images/sec and accuracy.')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--baseline', type=int, default=20,
+                        help='also OCR this many full-size images one at a time with image_to_string')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    rng = random.Random(0)
+    expected = {}
+    for n in range(args.images):
+        path = os.path.join(folder, f'Screenshot_{n:05d}.png')
+        expected[path] = render(path, rng, dark=n % 3 == 0)
+    paths = sorted(expected)
+
+    start = time.perf_counter()
+    for path in paths[:20]:
+        screenshot_ocr.preprocess(screenshot_ocr.open_image(path))
+    preprocess_ms = (time.perf_counter() - start) / min(20, len(paths)) * 1000
+
+    result = {'images': len(paths), 'preprocess_ms': round(preprocess_ms, 1)}
+    if args.baseline:
+        import pytesseract
+        from PIL import Image
+
+        start = time.perf_counter()
+        for path in paths[:args.baseline]:
+            with Image.open(path) as image:
+                pytesseract.image_to_string(image)
+        result['baseline_images_per_sec'] = round(min(args.baseline, len(paths)) / (time.perf_counter() - start), 2)
+
+    start = time.perf_counter()
+    correct = total = failed = 0
+    for path, extracted in screenshot_ocr.extract_batch(paths, args.workers):
+        total += len(expected[path])
+        if isinstance(extracted, Exception):
+            failed += 1
+            continue
+        correct += score(expected[path], extracted)
+    seconds = time.perf_counter() - start
+    result.update({'workers': args.workers or os.cpu_count(), 'seconds': round(seconds, 2),
+                   'images_per_sec': round(len(paths) / seconds, 2), 'failed': failed,
+                   'messages': total, 'messages_correct_pct': round(100 * correct / max(total, 1), 1)})
+    print(f"{len(paths)} screenshots in {result['seconds']} s on {result['workers']} workers: "
+          f"{result['images_per_sec']} images/sec ({result['preprocess_ms']} ms preprocessing each)")
+    if args.baseline:
+        print(f"Baseline (full size, image_to_string, one process): {result['baseline_images_per_sec']} images/sec")
+    print(f"{correct} of {total} messages split out with the right sender and text "
+          f"({result['messages_correct_pct']}%), {failed} images failed")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+FIRST_FRAME_ENV = 'CASE_MANAGER_EXIT_AFTER_FIRST_FRAME'
+FIRST_FRAME_MARKER = 'first frame'
+
+
+def drop_caches():
+    # Linux only and needs root; makes the next run a true cold start.
+    subprocess.run(['sync'], check=True)
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def import_times(python, module):
+    """Return (total ms, {direct import: cumulative ms}) for importing module.
+
+    -X importtime prints children before their parent, indented two spaces
+    per level, so the direct imports are the level-1 lines just before the
+    module's own level-0 line.
+    """
+    result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'], cwd=SRC,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == module:
+                return int(cumulative) / 1000, children
+            children = {}
+    raise RuntimeError(f'{module} not found in -X importtime output')
+
+
+def first_frame(python, timeout=120):
+    env = dict(os.environ, **{FIRST_FRAME_ENV: '1'})
+    start = time.perf_counter()
+    process = subprocess.Popen([python, 'case_manager.py'], cwd=SRC, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stderr:
+            if line.strip() == FIRST_FRAME_MARKER:
+                return time.perf_counter() - start
+            if time.perf_counter() - start > timeout:
+                break
+    finally:
+        process.kill()
+        process.wait()
+    raise RuntimeError('the app exited before drawing its first frame')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and time to first frame of the app.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--python', default=sys.executable)
+    parser.add_argument('--module', default='case_manager')
+    parser.add_argument('--top', type=int, default=15, help='how many of the slowest imports to list')
+    parser.add_argument('--cold', action='store_true', help='drop the OS page cache before each run (root)')
+    parser.add_argument('--no-window', action='store_true', help='only measure imports')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    totals, frames, modules = [], [], {}
+    for _ in range(args.runs):
+        if args.cold:
+            drop_caches()
+        total, children = import_times(args.python, args.module)
+        totals.append(total)
+        for name, ms in children.items():
+            modules.setdefault(name, []).append(ms)
+        if not args.no_window:
+            if args.cold:
+                drop_caches()
+            frames.append(first_frame(args.python))
+
+    result = {
+        'runs': args.runs,
+        'cold': args.cold,
+        'import_ms': round(statistics.median(totals), 1),
+        'first_frame_s': round(statistics.median(frames), 3) if frames else None,
+        'slowest_imports_ms': {name: round(statistics.median(ms), 1) for name, ms in
+                               sorted(modules.items(), key=lambda item: -statistics.median(item[1]))[:args.top]},
+    }
+    print(f"import {args.module}: {result['import_ms']} ms (median of {args.runs})")
+    if frames:
+        print(f"time to first frame: {result['first_frame_s']} s")
+    for name, ms in result['slowest_imports_ms'].items():
+        print(f'  {ms:>9.1f} ms  {name}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
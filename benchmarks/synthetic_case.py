@@ -0,0 +1,284 @@
+"""Reproducible synthetic cases for the benchmarks.
+
+generate() fills every table of the version 0 schema (plus document pages)
+for one or more cases with dated, searchable text. make_files() writes
+sample evidence to import: PDFs (some scanned, with no text layer), chat
+screenshots and WAV recordings. The same seed always gives the same case.
+
+    python benchmarks/synthetic_case.py case.db --rows 100000 --files samples/
+"""
+import argparse
+import datetime
+import itertools
+import math
+import os
+import random
+import struct
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import db
+
+# Share of rows per table; each document also gets PAGES_PER_DOCUMENT pages.
+SHARES = {
+    'text_messages': 0.40,
+    'events': 0.25,
+    'emails': 0.12,
+    'documents': 0.04,
+    'calendar_events': 0.04,
+    'audio_recordings': 0.02,
+    'pre_case_context': 0.02,
+    'contacts': 0.03,
+}
+PAGES_PER_DOCUMENT = 2
+MAX_CONTACTS_PER_CASE = 5000
+BATCH_SIZE = 10000
+START = datetime.datetime(2022, 1, 1)
+SPAN_DAYS = 3 * 365
+
+FIRST = ('Jane Maria Robert James Linda Michael Sarah David Karen Joseph Lisa Daniel Nancy Thomas Betty Mark '
+         'Sandra Paul Ashley Steven').split()
+LAST = ('Smith Johnson Garcia Brown Lee Miller Davis Wilson Moore Taylor Anderson Thomas Jackson White Harris '
+        'Martin Thompson Young King Wright').split()
+ROLES = ('Caseworker', 'Supervisor', 'Foster Parent', 'Attorney', 'Guardian ad Litem', 'Therapist', 'Relative',
+         'Unknown')
+EVENT_TYPES = ('Visit', 'Hearing', 'Text Message', 'Email', 'Document', 'Phone Call', 'Service')
+CATEGORIES = ('Court Orders', 'Case Plans', 'Reports', 'Medical', 'School', 'Correspondence')
+# Case vocabulary mixed at a low rate into Zipf-distributed filler, so search
+# terms have realistic frequencies.
+TERMS = ('visit visitation cancelled caseworker reunification services parent foster placement relative '
+         'court ordered hearing missed medication school report compliance therapy bond home study kinship '
+         'grandparent deadline continuance plan agency supervised failed weekly transport call').split()
+FILLER = [f'w{n}' for n in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (n + 1) for n in range(len(FILLER))))
+TERM_RATE = 0.05
+
+
+def text(rng, words):
+    filler = rng.choices(FILLER, cum_weights=CUM_WEIGHTS, k=words)
+    return ' '.join(rng.choice(TERMS) if rng.random() < TERM_RATE else word for word in filler)
+
+
+def name(rng):
+    return f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+
+
+def when(rng, with_time=False):
+    """(as typed, sort_date): mostly ISO, sometimes the free-text forms people enter."""
+    value = START + datetime.timedelta(days=rng.randrange(SPAN_DAYS), seconds=rng.randrange(86400))
+    sort_date = value.strftime('%Y-%m-%d %H:%M:%S' if with_time else '%Y-%m-%d')
+    roll = rng.random()
+    if roll < 0.1:
+        return value.strftime('%m/%d/%Y'), value.strftime('%Y-%m-%d')
+    if roll < 0.15:
+        return value.strftime('%B %d, %Y'), value.strftime('%Y-%m-%d')
+    return sort_date, sort_date
+
+
+def counts(rows):
+    return {table: max(1, int(rows * share)) for table, share in SHARES.items()}
+
+
+def _insert(c, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            c.executemany(sql, batch)
+            batch = []
+    if batch:
+        c.executemany(sql, batch)
+
+
+def generate(conn, rows, seed=0, cases=1):
+    """Fill the tables with about ``rows`` rows over ``cases`` cases; returns the case ids.
+
+    The first case gets most of the rows (others are a tenth of its size),
+    so benchmarks on it see the full volume with other cases present.
+    """
+    rng = random.Random(seed)
+    c = conn.cursor()
+    c.executemany('INSERT INTO cases (case_name, state) VALUES (?, ?)',
+                  [(f'Synthetic Case {n + 1}', 'NY') for n in range(cases)])
+    c.execute('SELECT case_id FROM cases ORDER BY case_id DESC LIMIT ?', (cases,))
+    case_ids = sorted(row[0] for row in c.fetchall())
+    weights = [10] + [1] * (cases - 1)
+    sizes = counts(rows)
+
+    def pick():
+        return rng.choices(case_ids, weights)[0]
+
+    contacts = {}
+    per_case = {case_id: 0 for case_id in case_ids}
+    for _ in range(sizes['contacts']):
+        case_id = pick()
+        if per_case[case_id] < MAX_CONTACTS_PER_CASE:
+            per_case[case_id] += 1
+            contact = name(rng)
+            user = contact.lower().replace(' ', '.')
+            c.execute('INSERT INTO contacts (case_id, name, email, phone, role) VALUES (?, ?, ?, ?, ?)',
+                      (case_id, contact, f'{user}{rng.randrange(100)}@example.com',
+                       f'555{rng.randrange(10 ** 7):07d}', rng.choice(ROLES)))
+            contacts.setdefault(case_id, []).append(c.lastrowid)
+
+    def people(case_id):
+        ids = contacts.get(case_id) or [None]
+        return rng.choice(ids), rng.choice(ids)
+
+    def messages():
+        for _ in range(sizes['text_messages']):
+            case_id = pick()
+            date, sort_date = when(rng, with_time=True)
+            yield (case_id, date, *people(case_id), text(rng, rng.randint(4, 40)), 0, sort_date)
+    _insert(c, 'INSERT INTO text_messages (case_id, msg_date, sender_id, recipient_id, content, is_image, '
+               'sort_date) VALUES (?, ?, ?, ?, ?, ?, ?)', messages())
+
+    def emails():
+        for _ in range(sizes['emails']):
+            case_id = pick()
+            date, sort_date = when(rng, with_time=True)
+            yield (case_id, date, *people(case_id), text(rng, rng.randint(3, 8)), text(rng, rng.randint(40, 300)),
+                   0, sort_date)
+    _insert(c, 'INSERT INTO emails (case_id, email_date, sender_id, recipient_id, subject, content, is_image, '
+               'sort_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', emails())
+
+    def events():
+        for _ in range(sizes['events']):
+            date, sort_date = when(rng)
+            yield pick(), date, text(rng, rng.randint(4, 20)), rng.choice(EVENT_TYPES), sort_date
+    _insert(c, 'INSERT INTO events (case_id, event_date, description, event_type, sort_date) '
+               'VALUES (?, ?, ?, ?, ?)', events())
+
+    def calendar():
+        for _ in range(sizes['calendar_events']):
+            date, sort_date = when(rng, with_time=True)
+            yield pick(), date, text(rng, rng.randint(2, 6)), text(rng, rng.randint(5, 30)), sort_date
+    _insert(c, 'INSERT INTO calendar_events (case_id, event_date, title, description, sort_date) '
+               'VALUES (?, ?, ?, ?, ?)', calendar())
+
+    def context():
+        for _ in range(sizes['pre_case_context']):
+            date, sort_date = when(rng)
+            yield pick(), text(rng, rng.randint(20, 200)), date, sort_date
+    _insert(c, 'INSERT INTO pre_case_context (case_id, description, context_date, sort_date) VALUES (?, ?, ?, ?)',
+            context())
+
+    def audio():
+        for n in range(sizes['audio_recordings']):
+            date, sort_date = when(rng)
+            yield pick(), f'call_{n:06d}.m4a', f'audio/call_{n:06d}.m4a', text(rng, rng.randint(100, 1500)), \
+                date, sort_date
+    _insert(c, 'INSERT INTO audio_recordings (case_id, audio_name, file_path, transcription, audio_date, '
+               'sort_date) VALUES (?, ?, ?, ?, ?, ?)', audio())
+
+    # Documents and their pages are written together, as ingestion does.
+    for n in range(sizes['documents']):
+        case_id = pick()
+        date, sort_date = when(rng)
+        pages = [text(rng, rng.randint(150, 500)) for _ in range(PAGES_PER_DOCUMENT)]
+        c.execute('INSERT INTO documents (case_id, doc_name, file_path, content, doc_date, category, sort_date) '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  (case_id, f'document_{n:06d}.pdf', f'documents/document_{n:06d}.pdf', ' '.join(pages), date,
+                   rng.choice(CATEGORIES), sort_date))
+        doc_id = c.lastrowid
+        c.executemany('INSERT INTO document_pages (case_id, doc_id, page_no, content, ocr) VALUES (?, ?, ?, ?, ?)',
+                      [(case_id, doc_id, page_no, page, int(rng.random() < 0.2))
+                       for page_no, page in enumerate(pages, 1)])
+        if n % BATCH_SIZE == BATCH_SIZE - 1:
+            conn.commit()
+    conn.commit()
+    return case_ids
+
+
+def make_pdf(path, rng, pages=3, scanned=False):
+    """A letter-size PDF of case text; scanned pages are images with no text layer."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(path, pagesize=letter)
+    width, height = letter
+    for _ in range(pages):
+        lines = [text(rng, 12) for _ in range(40)]
+        if scanned:
+            from PIL import Image, ImageDraw, ImageFont
+
+            # 150 dpi, a common scanner setting.
+            image = Image.new('L', (1275, 1650), 255)
+            draw = ImageDraw.Draw(image)
+            font = ImageFont.load_default(size=24)
+            for n, line in enumerate(lines):
+                draw.text((110, 110 + n * 36), line, font=font, fill=0)
+            pdf.drawImage(ImageReader(image), 0, 0, width, height)
+        else:
+            pdf.setFont('Helvetica', 11)
+            for n, line in enumerate(lines):
+                pdf.drawString(54, height - 60 - n * 16, line)
+        pdf.showPage()
+    pdf.save()
+
+
+def make_wav(path, rng, seconds=30, rate=16000):
+    """Mono 16-bit tones broken by pauses, so recordings have somewhere to split."""
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        pitch = rng.choice((180, 220, 260))
+        frames = bytearray()
+        for n in range(seconds * rate):
+            t = n / rate
+            level = 0.3 if t % 4 < 3 else 0.0
+            frames += struct.pack('<h', int(32767 * level * math.sin(2 * math.pi * pitch * t)))
+        out.writeframes(bytes(frames))
+
+
+def make_files(folder, seed=0, pdfs=4, screenshots=4, wavs=2):
+    """Write sample evidence to folder; returns {'pdf': [...], 'screenshot': [...], 'wav': [...]}."""
+    from screenshot_ocr_throughput import render
+
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    files = {'pdf': [], 'screenshot': [], 'wav': []}
+    for n in range(pdfs):
+        path = os.path.join(folder, f'report_{n:03d}.pdf')
+        # Every fourth is a scan, to exercise OCR.
+        make_pdf(path, rng, scanned=n % 4 == 3)
+        files['pdf'].append(path)
+    for n in range(screenshots):
+        path = os.path.join(folder, f'Screenshot_{n:03d}.png')
+        render(path, rng, dark=n % 3 == 0)
+        files['screenshot'].append(path)
+    for n in range(wavs):
+        path = os.path.join(folder, f'call_{n:03d}.wav')
+        make_wav(path, rng)
+        files['wav'].append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a reproducible synthetic case database and sample files.')
+    parser.add_argument('db', help='database file to create')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cases', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--files', help='also write sample PDFs, screenshots and WAVs to this folder')
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+    conn = db.connect(os.environ.get('CASE_MANAGER_PASSWORD', 'benchmark'), args.db)
+    db.init_schema(conn)
+    start = time.perf_counter()
+    case_ids = generate(conn, args.rows, args.seed, args.cases)
+    print(f'{args.rows} rows in {len(case_ids)} case(s) written to {args.db} in {time.perf_counter() - start:.1f}s')
+    conn.close()
+    if args.files:
+        files = make_files(args.files, args.seed)
+        print(f"{sum(len(paths) for paths in files.values())} sample files written to {args.files}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import transcription
+
+
+def run(file_path, engine, workers):
+    start = time.perf_counter()
+    segments = transcription.transcribe_file(file_path, engine=engine, workers=workers)
+    elapsed = time.perf_counter() - start
+    duration = segments[-1].end if segments else 0.0
+    rtf = elapsed / duration if duration else float('nan')
+    return {
+        'engine': engine,
+        'workers': workers,
+        'audio_seconds': round(duration, 2),
+        'wall_seconds': round(elapsed, 2),
+        'chunks': len(segments),
+        # < 1.0 means faster than real time; per-core normalizes for the pool size.
+        'rtf': round(rtf, 4),
+        'rtf_per_core': round(rtf * workers, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Real-time factor of the chunked transcription pipeline.')
+    parser.add_argument('file')
+    parser.add_argument('--engine', default=transcription.engine_name(), choices=sorted(transcription.ENGINES))
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts to try')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    results = []
+    for workers in [int(w) for w in args.workers.split(',')]:
+        result = run(args.file, args.engine, workers)
+        results.append(result)
+        print(f"{result['engine']:8} workers={workers:<3} audio={result['audio_seconds']:>8}s "
+              f"wall={result['wall_seconds']:>8}s RTF={result['rtf']:<8} RTF/core={result['rtf_per_core']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
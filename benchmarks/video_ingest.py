@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import transcription
+import video
+
+
+class NullEngine:
+    # Measures decoding, splitting and thumbnails without a recognizer.
+    def transcribe(self, pcm):
+        return ''
+
+
+transcription.ENGINES['null'] = NullEngine
+
+
+def make_video(path, minutes):
+    # A small test pattern with a tone that pauses every few seconds, so the
+    # silence splitter has somewhere to cut; a keyframe every 10 seconds.
+    subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=5',
+                    '-f', 'lavfi', '-i', "aevalsrc='sin(440*2*PI*t)*lt(mod(t,12),9)':s=16000",
+                    '-t', str(minutes * 60), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50',
+                    '-c:a', 'aac', '-b:a', '32k', path], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe and thumbnail a long video; report time and peak memory.')
+    parser.add_argument('file', nargs='?', help='a video to use instead of a generated one')
+    parser.add_argument('--minutes', type=float, default=180, help='length of the generated video')
+    parser.add_argument('--engine', default='null', choices=sorted(transcription.ENGINES))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    file_path = args.file
+    if not file_path:
+        file_path = os.path.join(tempfile.mkdtemp(), 'visit.mp4')
+        make_video(file_path, args.minutes)
+    start = time.perf_counter()
+    extracted = video.extract(file_path, engine=args.engine, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux; children are the ffmpeg processes.
+    result = {
+        'file': file_path,
+        'engine': args.engine,
+        'video_seconds': round(extracted['duration'], 1),
+        'wall_seconds': round(elapsed, 2),
+        'rtf': round(elapsed / extracted['duration'], 5) if extracted['duration'] else None,
+        'segments': len(extracted['segments']),
+        'thumbnails': len(extracted['thumbnails']),
+        'thumbnail_kb': round(sum(len(image) for _, image in extracted['thumbnails']) * 3 / 4 / 1024, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_ffmpeg_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    print(f"{result['video_seconds']} s of video in {result['wall_seconds']} s (RTF {result['rtf']}, "
+          f"engine {args.engine}): {result['segments']} segments, {result['thumbnails']} thumbnails "
+          f"({result['thumbnail_kb']} KB)")
+    print(f"Peak RSS {result['peak_rss_mb']} MB, ffmpeg {result['peak_ffmpeg_rss_mb']} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
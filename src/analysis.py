@@ -0,0 +1,261 @@
+import datetime
+import hashlib
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from llm import DEFAULT_MODEL
+
+CHUNK_TOKENS = 6000
+REDUCE_TOKENS = 12000
+WORKERS = 4
+
+# Bump when the map prompt changes so cached chunk results are not reused.
+MAP_VERSION = 1
+
+Item = namedtuple('Item', 'ref date party text')
+Chunk = namedtuple('Chunk', 'refs text')
+
+MAP_PROMPT = '''You are reviewing evidence from a child welfare case. Each item starts with a header
+[ref | date | party]. Find statements by the agency, caseworkers, GAL, foster parents, opposing
+party or judge that are inconsistent with each other or with the evidence, and anything that
+appears to be untrue.
+Reply with JSON only: {{"findings": [{{"party": "...", "statement": "...", "contradiction": "...",
+"sources": ["ref", ...]}}]}}. Use the refs from the headers. Reply {{"findings": []}} if nothing is found.
+
+Evidence:
+{evidence}'''
+
+REDUCE_PROMPT = '''Below are findings about possible lies and inconsistencies in a child welfare case,
+grouped by party, each citing evidence refs (D = document, M = text message, E = email,
+A = audio recording, V = video recording). Merge duplicates, keep the citations, and write a report with one
+section per party listing each contradiction and the evidence that shows it.
+
+{findings}'''
+
+_SOURCES = [
+    ('D', '''SELECT doc_id, doc_date, doc_name, content FROM documents WHERE case_id=? ORDER BY doc_id'''),
+    ('M', '''SELECT m.msg_id, m.msg_date, s.name, m.content FROM text_messages m
+             LEFT JOIN contacts s ON s.contact_id = m.sender_id WHERE m.case_id=? ORDER BY m.msg_id'''),
+    ('E', '''SELECT e.email_id, e.email_date, s.name, COALESCE(e.subject, '') || ': ' || COALESCE(e.content, '')
+             FROM emails e LEFT JOIN contacts s ON s.contact_id = e.sender_id WHERE e.case_id=? ORDER BY e.email_id'''),
+    ('A', '''SELECT audio_id, audio_date, audio_name, transcription FROM audio_recordings WHERE case_id=?
+             ORDER BY audio_id'''),
+    ('V', '''SELECT video_id, video_date, video_name, transcription FROM videos WHERE case_id=? ORDER BY video_id'''),
+]
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except ImportError:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def ensure_schema(conn):
+    conn.cursor().execute('''CREATE TABLE IF NOT EXISTS analysis_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT,
+        result TEXT,
+        created_at TEXT
+    )''')
+
+
+def load_evidence(conn, case_id):
+    c = conn.cursor()
+    for prefix, sql in _SOURCES:
+        c.execute(sql, (case_id,))
+        group = [Item(f'{prefix}{row[0]}', row[1] or '', row[2] or '', row[3] or '') for row in c.fetchall()]
+        yield [item for item in group if item.text.strip()]
+
+
+def _split_text(text, max_tokens):
+    # Split on paragraph, then line, then word boundaries until pieces fit.
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    for sep in ('\n\n', '\n', ' '):
+        parts = text.split(sep)
+        if len(parts) > 1:
+            break
+    else:
+        size = max_tokens * 4
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    pieces, current = [], ''
+    for part in parts:
+        candidate = f'{current}{sep}{part}' if current else part
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.extend(_split_text(current, max_tokens))
+            current = part
+        else:
+            current = candidate
+    if current:
+        pieces.extend(_split_text(current, max_tokens))
+    return pieces
+
+
+def chunk_evidence(groups, max_tokens=CHUNK_TOKENS):
+    """Pack evidence items into chunks of at most max_tokens.
+
+    Each source type is packed separately in id order, so new evidence only
+    changes the last chunk of its type and earlier chunks stay cached.
+    """
+    chunks = []
+    for group in groups:
+        refs, parts, tokens = [], [], 0
+        for item in group:
+            header = f'[{item.ref} | {item.date} | {item.party}]'
+            pieces = _split_text(item.text, max_tokens - count_tokens(header) - 16)
+            for n, piece in enumerate(pieces):
+                label = header if len(pieces) == 1 else f'{header} (part {n + 1}/{len(pieces)})'
+                block = f'{label}\n{piece}'
+                size = count_tokens(block)
+                if parts and tokens + size > max_tokens:
+                    chunks.append(Chunk(refs, '\n\n'.join(parts)))
+                    refs, parts, tokens = [], [], 0
+                parts.append(block)
+                if item.ref not in refs:
+                    refs.append(item.ref)
+                tokens += size
+        if parts:
+            chunks.append(Chunk(refs, '\n\n'.join(parts)))
+    return chunks
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f'{model}\0{MAP_VERSION}\0{text}'.encode('utf-8')).hexdigest()
+
+
+def _cached(conn, keys):
+    c = conn.cursor()
+    found = {}
+    for key in keys:
+        c.execute('SELECT result FROM analysis_cache WHERE cache_key=?', (key,))
+        row = c.fetchone()
+        if row:
+            found[key] = json.loads(row[0])
+    return found
+
+
+def _complete(client, model, prompt, json_mode=False, on_token=None, use_cache=True):
+    # client is the shared llm.LLMClient; this blocks only the calling worker thread.
+    return client.complete(prompt, model=model, json_mode=json_mode, on_token=on_token, use_cache=use_cache)
+
+
+def _parse_findings(text):
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        # Some OpenAI-compatible servers wrap JSON in prose or code fences.
+        start, end = (text or '').find('{'), (text or '').rfind('}')
+        try:
+            data = json.loads(text[start:end + 1]) if start != -1 else {}
+        except ValueError:
+            data = {}
+    findings = data.get('findings', []) if isinstance(data, dict) else []
+    return [f for f in findings if isinstance(f, dict)]
+
+
+def map_chunk(client, model, chunk):
+    # The parsed findings are kept in analysis_cache, so the raw reply isn't also put in llm_cache.
+    return _parse_findings(_complete(client, model, MAP_PROMPT.format(evidence=chunk.text), json_mode=True,
+                                     use_cache=False))
+
+
+def merge_findings(results):
+    """Group findings by party (case-insensitive) and drop exact duplicates."""
+    parties = {}
+    for findings in results:
+        for finding in findings:
+            party = str(finding.get('party') or 'Unknown').strip()
+            key = party.lower()
+            entry = parties.setdefault(key, {'party': party, 'findings': [], 'seen': set()})
+            statement = str(finding.get('statement', '')).strip()
+            contradiction = str(finding.get('contradiction', '')).strip()
+            if (statement.lower(), contradiction.lower()) in entry['seen']:
+                continue
+            entry['seen'].add((statement.lower(), contradiction.lower()))
+            entry['findings'].append({'statement': statement, 'contradiction': contradiction,
+                                      'sources': [str(s) for s in finding.get('sources', [])]})
+    return {entry['party']: entry['findings'] for entry in parties.values()}
+
+
+def format_findings(merged):
+    lines = []
+    for party, findings in sorted(merged.items()):
+        lines.append(f'{party}:')
+        for f in findings:
+            sources = ', '.join(f['sources'])
+            lines.append(f"- {f['statement']} -- {f['contradiction']} [{sources}]")
+        lines.append('')
+    return '\n'.join(lines).strip()
+
+
+def reduce_findings(client, model, merged, max_tokens=REDUCE_TOKENS, on_token=None):
+    """Write the final report, reducing party by party if everything won't fit in one prompt."""
+    text = format_findings(merged)
+    if not text:
+        report = 'No inconsistencies found in the evidence.'
+        if on_token:
+            on_token(report)
+        return report
+    if count_tokens(text) <= max_tokens:
+        return _complete(client, model, REDUCE_PROMPT.format(findings=text), on_token=on_token)
+    sections = []
+    for party in sorted(merged):
+        for piece in _split_text(format_findings({party: merged[party]}), max_tokens):
+            if sections and on_token:
+                on_token('\n\n')
+            sections.append(_complete(client, model, REDUCE_PROMPT.format(findings=piece),
+                                      on_token=_section_tokens(on_token, sections)))
+    return '\n\n'.join(sections)
+
+
+def _section_tokens(on_token, sections):
+    # None (a retry) makes the listener clear the whole report; put back the
+    # sections already written so only the one being retried starts over.
+    if not on_token or not sections:
+        return on_token
+
+    def section_token(token):
+        on_token(token)
+        if token is None:
+            on_token('\n\n'.join(sections) + '\n\n')
+    return section_token
+
+
+def detect_lies(conn, case_id, client, model=DEFAULT_MODEL, max_tokens=CHUNK_TOKENS, workers=WORKERS,
+                progress=None, on_token=None):
+    """Map-reduce lie detection over a whole case.
+
+    Chunks whose result is already in analysis_cache are not sent again. The
+    map calls run on up to ``workers`` threads; conn is only used from the
+    calling thread. The final report is streamed to ``on_token``.
+    """
+    chunks = chunk_evidence(load_evidence(conn, case_id), max_tokens)
+    keys = [cache_key(model, chunk.text) for chunk in chunks]
+    results = _cached(conn, keys)
+    todo = [(key, chunk) for key, chunk in zip(keys, chunks) if key not in results]
+    if progress:
+        progress(len(results), len(chunks))
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis') as pool:
+            futures = [(key, pool.submit(map_chunk, client, model, chunk)) for key, chunk in todo]
+            c = conn.cursor()
+            now = datetime.datetime.now().isoformat(timespec='seconds')
+            for key, future in futures:
+                results[key] = future.result()
+                c.execute('INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?)',
+                          (key, model, json.dumps(results[key]), now))
+                conn.commit()
+                if progress:
+                    progress(len(results), len(chunks))
+    merged = merge_findings(results[key] for key in keys)
+    return reduce_findings(client, model, merged, on_token=on_token)
@@ -0,0 +1,278 @@
+"""Local HTTP API over service.CaseService, for scripts and a second client.
+
+    python src/service.py serve --port 8765
+
+Requests and responses are JSON. Every request needs the header
+``Authorization: Bearer <token>``; the token is printed at startup unless
+given with --token or CASE_MANAGER_API_TOKEN. Requests are handled on their
+own threads, so searches and reports are answered while an import writes.
+
+    GET  /cases
+    POST /cases                              {"case_name", "state", "separate"}; separate (optional)
+                                             gives the case a database file of its own
+    GET  /cases/<id>/search?q=...&offset=N   ranked hits and the next offset
+    GET  /cases/<id>/timeline?after=<next>   a page of events and the next token
+    GET  /cases/<id>/calendar?after=<next>
+    GET  /cases/<id>/records/<source>/<source id>
+                                             label, title, date and body of one of the case's hits
+                                             or events
+    POST /cases/<id>/<kind>                  add a row; kind is one of ADDERS
+    POST /cases/<id>/imports                 {"file_path", "kind", "name", "date", "category"}; all but
+                                             file_path optional; returns the job id
+    GET  /cases/<id>/imports                 job counts by status
+    POST /cases/<id>/imports/cancel          cancel the case's unfinished imports
+    GET  /cases/<id>/records/<source>/<source id>/file
+                                             the file the row was imported from, decrypted from the
+                                             attachment store as it's sent; supports Range requests
+    GET  /cases/<id>/imports/<job id>
+    GET  /jobs/<id>                          a job of a case in the main database
+    POST /cases/<id>/reports                 {"report": "timeline" or "custom", "report_type"}; written
+                                             to reports.report_path
+"""
+import hmac
+import json
+import mimetypes
+import os
+import re
+import secrets
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import attachments
+import db
+import pages
+import reports
+import search_index
+
+TOKEN_ENV = 'CASE_MANAGER_API_TOKEN'
+MAX_BODY = 1024 * 1024
+
+# POST /cases/<id>/<kind>: (CaseService method, fields in argument order)
+ADDERS = {
+    'contacts': ('add_contact', ('name', 'email', 'phone', 'role')),
+    'text_messages': ('add_text_message', ('msg_date', 'sender', 'recipient', 'content')),
+    'emails': ('add_email', ('email_date', 'sender', 'recipient', 'subject', 'content')),
+    'events': ('add_event', ('event_date', 'description', 'event_type')),
+    'calendar_events': ('add_calendar_event', ('event_date', 'title', 'description')),
+    'pre_case_context': ('add_pre_case_context', ('context_date', 'description')),
+}
+
+
+# A route's result that is sent as the file itself rather than JSON.
+File = namedtuple('File', 'source name')
+
+
+class NotFound(Exception):
+    pass
+
+
+class APIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=8765, token=None):
+        super().__init__((host, port), Handler)
+        self.service = service
+        self.token = token or os.environ.get(TOKEN_ENV) or secrets.token_urlsafe(24)
+        # Two reports of one case would write the same file.
+        self.report_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+
+def serve(service, host='127.0.0.1', port=8765, token=None):
+    server = APIServer(service, host, port, token)
+    print(f'Serving {server.url} (token: {server.token})', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _page_token(value):
+    # Timeline and calendar tokens go out as JSON lists and come back in the query string.
+    return tuple(json.loads(value)) if value else None
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        expected = f'Bearer {self.server.token}'
+        if not hmac.compare_digest(self.headers.get('Authorization', ''), expected):
+            self._send(401, {'error': 'Missing or wrong API token.'})
+            return
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            body = self._body() if method == 'POST' else {}
+            result = self._route(method, url.path.rstrip('/'), query, body)
+            if isinstance(result, File):
+                self._stream(result)
+            else:
+                self._send(200, result)
+        except NotFound as e:
+            self._send(404, {'error': str(e) or 'Not found.'})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except db.sqlcipher.OperationalError as e:
+            # Mostly search syntax; a busy database past its timeout lands here too.
+            self._send(400, {'error': f'Invalid request: {e}'})
+        except Exception as e:
+            self._send(500, {'error': str(e) or type(e).__name__})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ValueError('Request body too large.')
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError('Expected a JSON object.')
+        return body
+
+    def _send(self, status, result):
+        data = json.dumps(result, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, result):
+        # Decrypts one chunk at a time, so a seek in a long video costs one chunk.
+        with result.source as source:
+            start, end = 0, source.size - 1
+            requested = self.headers.get('Range')
+            if requested:
+                match = re.fullmatch(r'bytes=(\d*)-(\d*)', requested.strip())
+                if not match or not (match[1] or match[2]):
+                    raise ValueError(f'Unsupported Range: {requested}')
+                if match[1]:
+                    start = int(match[1])
+                    end = min(int(match[2]), end) if match[2] else end
+                else:
+                    start = max(source.size - int(match[2]), 0)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{source.size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+            self.send_response(206 if requested else 200)
+            self.send_header('Content-Type', mimetypes.guess_type(result.name or '')[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            if requested:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{source.size}')
+            self.end_headers()
+            source.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    data = source.read(min(remaining, attachments.CHUNK_SIZE))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+            except (attachments.StoreError, OSError):
+                # Too late for an error response: the headers are out. Drop the connection instead.
+                self.close_connection = True
+
+    def _route(self, method, path, query, body):
+        service = self.server.service
+        if path == '/cases':
+            if method == 'POST':
+                return {'case_id': service.create_case(body.get('case_name'), body.get('state'),
+                                                       bool(body.get('separate')))}
+            return [dict(zip(('case_id', 'case_name', 'state', 'db_path'), row)) for row in service.cases()]
+        match = re.fullmatch(r'/jobs/(\d+)', path)
+        if match and method == 'GET':
+            return self._job(int(match[1]))
+        match = re.fullmatch(r'/cases/(\d+)/([\w/]+)', path)
+        if not match:
+            raise NotFound()
+        return self._case_route(method, int(match[1]), match[2], query, body)
+
+    def _case_route(self, method, case_id, action, query, body):
+        service = self.server.service
+        limit = min(int(query.get('limit', pages.PAGE_SIZE)), pages.PAGE_SIZE)
+        if method == 'GET' and action == 'search':
+            if not query.get('q'):
+                raise ValueError('Enter a search query.')
+            hits, offset = service.search(case_id, query['q'], int(query.get('offset', 0)), limit)
+            return {'hits': [hit._asdict() for hit in hits], 'next': offset}
+        if method == 'GET' and action in ('timeline', 'calendar'):
+            fetch = service.timeline if action == 'timeline' else service.calendar
+            rows, after = fetch(case_id, _page_token(query.get('after')), limit)
+            return {'rows': [dict(zip(('id', 'date', 'type' if action == 'timeline' else 'title', 'description'), row))
+                             for row in rows], 'next': json.dumps(after) if after else None}
+        match = re.fullmatch(r'records/(\w+)/(\d+)', action)
+        if match and method == 'GET':
+            return self._record(case_id, match[1], int(match[2]))
+        match = re.fullmatch(r'records/(\w+)/(\d+)/file', action)
+        if match and method == 'GET':
+            found = service.attachment(case_id, match[1], int(match[2]))
+            if not found:
+                raise NotFound('No stored file for this item.')
+            return File(*found)
+        match = re.fullmatch(r'imports/(\d+)', action)
+        if match and method == 'GET':
+            return self._job(int(match[1]), case_id)
+        if action == 'imports':
+            if method == 'POST':
+                return {'job_id': service.submit(case_id, body['file_path'], body.get('kind'), body.get('name'),
+                                                 body.get('date'), body.get('category'))}
+            return service.job_counts(case_id)
+        if method == 'POST' and action == 'imports/cancel':
+            return {'cancelled': service.cancel_case(case_id)}
+        if method == 'POST' and action == 'reports':
+            return self._report(case_id, body)
+        if method == 'POST' and action in ADDERS:
+            name, fields = ADDERS[action]
+            return {'id': getattr(service, name)(case_id, *(body.get(field) or '' for field in fields))}
+        raise NotFound()
+
+    def _record(self, case_id, source, source_id):
+        if source not in pages.RECORDS and source not in search_index.SOURCE_LABELS:
+            raise NotFound(f'No such source: {source}')
+        record = self.server.service.record(case_id, source, source_id)
+        if not record:
+            raise NotFound('This item no longer exists.')
+        return dict(zip(('label', 'title', 'date', 'body'), record))
+
+    def _job(self, job_id, case_id=None):
+        job = self.server.service.job(job_id, case_id)
+        if not job or (case_id is not None and job[1] != case_id):
+            raise NotFound('No such job.')
+        return dict(zip(('job_id', 'case_id', 'kind', 'status', 'error'), job))
+
+    def _report(self, case_id, body):
+        # Paths are chosen here, never by the client.
+        service = self.server.service
+        with self.server.report_lock:
+            return self._render(service, case_id, body)
+
+    def _render(self, service, case_id, body):
+        if body.get('report') == 'timeline':
+            path = reports.report_path(case_id, reports.TIMELINE_PDF)
+            rendered = service.timeline_report(case_id, path)
+        elif body.get('report') == 'custom':
+            if not body.get('report_type'):
+                raise ValueError('report_type is required.')
+            path = reports.report_path(case_id, reports.CUSTOM_REPORT_PDF)
+            rendered = service.custom_report(case_id, body['report_type'], path)
+        else:
+            raise ValueError('report must be "timeline" or "custom".')
+        return {'path': os.path.abspath(path), 'pages': rendered.pages, 'lines': rendered.lines}
@@ -0,0 +1,381 @@
+"""Encrypted, content-addressed copies of evidence files, kept next to the database.
+
+Imported files are split into CHUNK_SIZE chunks. Each chunk is encrypted
+with AES-GCM and written to its own file, named by a keyed hash of its
+content, so a file imported twice (or into two cases) is stored once and a
+chunk can't be swapped for another without failing to decrypt. The chunk
+list of each file is kept in the database under the file's sha256, the
+same key as evidence_files, and the encryption key is a random one kept in
+the (SQLCipher-encrypted) database.
+
+A case keeps working when the original files are moved or deleted: reader()
+returns a seekable file object that decrypts one chunk at a time, so a
+2 GB video is streamed or uploaded in constant memory.
+
+Chunks are written before the rows that list them are committed; an
+import that fails or is cancelled leaves orphans, which gc() deletes.
+
+    python src/attachments.py gc
+    python src/attachments.py backfill
+    python src/attachments.py export <sha256> out.pdf
+"""
+import datetime
+import hashlib
+import hmac
+import io
+import os
+import threading
+
+# Per chunk: the unit of deduplication and of decryption on a seek.
+CHUNK_SIZE = 1 << 20
+KEY_BYTES = 32
+NONCE_BYTES = 12
+# gc() leaves chunk files this recent alone: an import may be about to commit them.
+GC_GRACE_S = 3600
+
+
+class StoreError(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS attachments (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER,
+        chunk_size INTEGER,
+        created_at TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS attachment_chunks (
+        sha256 TEXT,
+        seq INTEGER,
+        chunk_id TEXT,
+        PRIMARY KEY(sha256, seq),
+        FOREIGN KEY(sha256) REFERENCES attachments(sha256)
+    )''')
+    # AES key then HMAC key. Made with the schema so it's committed before any chunk uses it.
+    c.execute('CREATE TABLE IF NOT EXISTS attachment_keys (key_id INTEGER PRIMARY KEY, key BLOB)')
+    c.execute('INSERT OR IGNORE INTO attachment_keys VALUES (1, ?)', (os.urandom(2 * KEY_BYTES),))
+
+
+def store_dir(conn):
+    """case_manager.db keeps its chunks in case_manager.attachments/."""
+    c = conn.cursor()
+    c.execute('PRAGMA database_list')
+    path = next(row[2] for row in c.fetchall() if row[1] == 'main')
+    if not path:
+        raise StoreError('An in-memory database has no attachment store.')
+    return os.path.splitext(path)[0] + '.attachments'
+
+
+def stored_path(conn, sha256, extension=''):
+    """The path that stands for a stored file with no copy on disk (an MMS picture inside a backup).
+
+    Used as its evidence_files.first_path and Drive upload path: nothing is
+    ever written there, so uploads and exports read the store, and it is
+    unique per content. The extension ('.jpg') tells the file type.
+    """
+    return os.path.join(store_dir(conn), sha256 + extension.lower())
+
+
+def store(conn):
+    c = conn.cursor()
+    c.execute('SELECT key FROM attachment_keys WHERE key_id=1')
+    return Store(store_dir(conn), bytes(c.fetchone()[0]))
+
+
+class Store:
+    """The chunk files of one database; safe to use from several threads."""
+
+    def __init__(self, path, key):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.path = path
+        self.cipher = AESGCM(key[:KEY_BYTES])
+        self.mac_key = key[KEY_BYTES:]
+
+    def chunk_path(self, chunk_id):
+        return os.path.join(self.path, chunk_id[:2], chunk_id)
+
+    def write(self, file_path, cancelled=None, chunk_size=CHUNK_SIZE):
+        """Store a file's chunks; returns (sha256, size, chunk ids) to save().
+
+        Reads the file once, so it replaces evidence_store.hash_file for
+        imports. cancelled is a threading.Event checked between chunks.
+        """
+        with open(file_path, 'rb') as f:
+            return self.write_stream(f, cancelled, chunk_size)
+
+    def write_stream(self, f, cancelled=None, chunk_size=CHUNK_SIZE):
+        """write() from a binary file object, e.g. io.BytesIO of an attachment in a message backup."""
+        h = hashlib.sha256()
+        size = 0
+        chunk_ids = []
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled('Cancelled.')
+            data = f.read(chunk_size)
+            if not data:
+                break
+            h.update(data)
+            size += len(data)
+            chunk_ids.append(self._put(data))
+        return h.hexdigest(), size, chunk_ids
+
+    def _put(self, data):
+        digest = hmac.new(self.mac_key, data, hashlib.sha256).digest()
+        chunk_id = digest.hex()
+        path = self.chunk_path(chunk_id)
+        try:
+            # Already stored. Touched so a gc() running now counts it as new.
+            os.utime(path)
+            return chunk_id
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        with open(partial, 'wb') as f:
+            # The nonce comes from the content's MAC, so it never repeats for different content.
+            f.write(self.cipher.encrypt(digest[:NONCE_BYTES], data, digest))
+            f.flush()
+            # The original may be deleted once the import is done.
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        return chunk_id
+
+    def read_chunk(self, chunk_id):
+        from cryptography.exceptions import InvalidTag
+
+        digest = bytes.fromhex(chunk_id)
+        try:
+            with open(self.chunk_path(chunk_id), 'rb') as f:
+                return self.cipher.decrypt(digest[:NONCE_BYTES], f.read(), digest)
+        except FileNotFoundError:
+            raise StoreError(f'Chunk {chunk_id[:16]} is missing from {self.path}') from None
+        except InvalidTag:
+            raise StoreError(f'Chunk {chunk_id[:16]} is damaged') from None
+
+
+class Reader(io.RawIOBase):
+    """A stored file, read-only and seekable; only the chunk being read is decrypted."""
+
+    def __init__(self, store, size, chunk_size, chunk_ids):
+        super().__init__()
+        self.store = store
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_ids = chunk_ids
+        self.pos = 0
+        self.current = (None, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self.pos = offset
+        return offset
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+        seq, start = divmod(self.pos, self.chunk_size)
+        if self.current[0] != seq:
+            self.current = (seq, self.store.read_chunk(self.chunk_ids[seq]))
+        data = self.current[1]
+        n = min(len(b), len(data) - start)
+        b[:n] = data[start:start + n]
+        self.pos += n
+        return n
+
+    def read(self, size=-1):
+        # RawIOBase.read stops at a chunk boundary; callers such as the Drive
+        # uploader expect the full size unless the file ends first.
+        if size is None or size < 0:
+            size = max(self.size - self.pos, 0)
+        buf = bytearray(min(size, max(self.size - self.pos, 0)))
+        view = memoryview(buf)
+        filled = 0
+        while filled < len(buf):
+            n = self.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        return bytes(buf[:filled])
+
+
+def save(conn, sha256, size, chunk_ids, chunk_size=CHUNK_SIZE):
+    """Record a file written by Store.write; the caller commits.
+
+    Its chunks are touched again first. An import can take longer than
+    GC_GRACE_S between writing its first chunk and saving, and gc() only
+    spares chunk files that are listed or recent. StoreError is raised if
+    gc() deleted one already.
+    """
+    c = conn.cursor()
+    c.execute('INSERT OR IGNORE INTO attachments VALUES (?, ?, ?, ?)',
+              (sha256, size, chunk_size, datetime.datetime.now().isoformat(timespec='seconds')))
+    if c.rowcount:
+        path = store_dir(conn)
+        for chunk_id in set(chunk_ids):
+            try:
+                os.utime(os.path.join(path, chunk_id[:2], chunk_id))
+            except FileNotFoundError:
+                raise StoreError(f'Chunk {chunk_id[:16]} was removed before {sha256[:16]} was saved; '
+                                 f'import the file again.') from None
+        c.executemany('INSERT INTO attachment_chunks VALUES (?, ?, ?)',
+                      [(sha256, seq, chunk_id) for seq, chunk_id in enumerate(chunk_ids)])
+
+
+def stored(conn, sha256):
+    c = conn.cursor()
+    c.execute('SELECT 1 FROM attachments WHERE sha256=?', (sha256,))
+    return c.fetchone() is not None
+
+
+def put(conn, file_path, cancelled=None):
+    """Store a file and record it; returns (sha256, size). The caller commits."""
+    sha256, size, chunk_ids = store(conn).write(file_path, cancelled)
+    save(conn, sha256, size, chunk_ids)
+    return sha256, size
+
+
+def reader(conn, sha256):
+    """A Reader over a stored file, or None if it isn't stored."""
+    c = conn.cursor()
+    c.execute('SELECT size, chunk_size FROM attachments WHERE sha256=?', (sha256,))
+    row = c.fetchone()
+    if not row:
+        return None
+    c.execute('SELECT chunk_id FROM attachment_chunks WHERE sha256=? ORDER BY seq', (sha256,))
+    return Reader(store(conn), row[0], row[1], [chunk_id for chunk_id, in c.fetchall()])
+
+
+def source_file(conn, case_id, source, source_id):
+    """(sha256, original path) of the stored file a case's row was imported from, or None."""
+    c = conn.cursor()
+    c.execute('SELECT l.sha256, e.first_path FROM evidence_links l '
+              'JOIN attachments a ON a.sha256 = l.sha256 JOIN evidence_files e ON e.sha256 = l.sha256 '
+              'WHERE l.case_id=? AND l.source=? AND l.source_id=? LIMIT 1', (case_id, source, source_id))
+    return c.fetchone()
+
+
+def gc(conn, grace=GC_GRACE_S):
+    """Delete chunk files no stored file lists; returns (files deleted, bytes freed).
+
+    Files newer than grace seconds are kept. Chunks of imports not committed
+    yet are touched by every write that uses them and again by save(), so
+    a long import keeps them recent until they are listed.
+    """
+    path = store_dir(conn)
+    c = conn.cursor()
+    c.execute('SELECT DISTINCT chunk_id FROM attachment_chunks')
+    used = {chunk_id for chunk_id, in c.fetchall()}
+    cutoff = datetime.datetime.now().timestamp() - grace
+    deleted = freed = 0
+    if not os.path.isdir(path):
+        return deleted, freed
+    for prefix in os.scandir(path):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            if entry.name in used:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            deleted += 1
+            freed += stat.st_size
+    return deleted, freed
+
+
+def backfill(conn, progress=None):
+    """Store files imported before the attachment store, from where they were first imported.
+
+    Returns (stored, missing): files copied in, and files no longer at that
+    path or changed since. Commits after each file.
+    """
+    c = conn.cursor()
+    c.execute('SELECT e.sha256, e.first_path FROM evidence_files e LEFT JOIN attachments a ON a.sha256 = e.sha256 '
+              'WHERE a.sha256 IS NULL ORDER BY e.created_at')
+    rows = c.fetchall()
+    files = store(conn)
+    copied = missing = 0
+    for done, (sha256, file_path) in enumerate(rows, 1):
+        try:
+            written, size, chunk_ids = files.write(file_path)
+        except OSError:
+            written = None
+        if written == sha256:
+            save(conn, sha256, size, chunk_ids)
+            conn.commit()
+            copied += 1
+        else:
+            missing += 1
+        if progress:
+            progress(done, len(rows))
+    return copied, missing
+
+
+def main(argv=None):
+    import argparse
+    import getpass
+
+    import db
+
+    parser = argparse.ArgumentParser(description="Maintain a database's encrypted attachment store.")
+    parser.add_argument('--db', default=db.DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('gc', help='delete chunks no stored file uses')
+    command.add_argument('--grace-minutes', type=float, default=GC_GRACE_S / 60,
+                         help='keep chunks written this recently')
+    commands.add_parser('backfill', help='store files imported before the attachment store existed')
+    command = commands.add_parser('export', help='write a stored file out, decrypted')
+    command.add_argument('sha256')
+    command.add_argument('out')
+    args = parser.parse_args(argv)
+    password = os.environ.get('CASE_MANAGER_PASSWORD') or getpass.getpass('Database password: ')
+    conn = db.connect(password, args.db)
+    try:
+        db.init_schema(conn)
+        if args.command == 'gc':
+            deleted, freed = gc(conn, args.grace_minutes * 60)
+            print(f'Deleted {deleted} chunk(s), {freed / 1e6:.1f} MB.')
+        elif args.command == 'backfill':
+            copied, missing = backfill(conn, lambda done, total: print(f'\r{done}/{total}', end='', flush=True))
+            print(f'\nStored {copied} file(s); {missing} no longer at their original path or changed since.')
+        else:
+            source = reader(conn, args.sha256)
+            if source is None:
+                raise SystemExit(f'Error: {args.sha256} is not stored.')
+            with source, open(args.out, 'wb') as f:
+                while True:
+                    data = source.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+import argparse
+import datetime
+import getpass
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import contacts
+import db
+import attachments
+import evidence_store
+import ingest
+import pdf_pages
+import screenshot_ocr
+import transcription
+
+DOCUMENT_EXTS = ('.pdf', '.docx', '.txt')
+AUDIO_EXTS = ('.mp3', '.wav', '.m4a', '.amr', '.aac', '.ogg', '.3gp')
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.heic', '.heif')
+
+BATCH_SIZE = 500
+
+# 2024-01-05, 2024_01_05, 20240105 (Screenshot_20240105-101010.png, IMG_20240105_...)
+_FILENAME_DATE = re.compile(r'(?<!\d)(20\d{2}|19\d{2})[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])(?!\d)')
+_EXIF_DATETIME_ORIGINAL = 36867
+_EXIF_DATETIME = 306
+_EXIF_IFD = 0x8769
+
+
+def classify(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in DOCUMENT_EXTS:
+        return 'document'
+    if ext in AUDIO_EXTS:
+        return 'audio'
+    if ext in IMAGE_EXTS:
+        return 'text_image'
+    return None
+
+
+def walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            file_path = os.path.join(dirpath, name)
+            kind = classify(file_path)
+            if kind:
+                yield file_path, kind
+
+
+def _date_from_filename(file_path):
+    match = _FILENAME_DATE.search(os.path.basename(file_path))
+    if match:
+        try:
+            return datetime.date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            return None
+    return None
+
+
+def _date_from_exif(file_path):
+    from PIL import Image
+
+    screenshot_ocr.register_heif(file_path)
+    with Image.open(file_path) as image:
+        exif = image.getexif()
+        value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(_EXIF_DATETIME)
+    if value:
+        return value[:10].replace(':', '-')
+    return None
+
+
+def _date_from_pdf(file_path):
+    import PyPDF2
+
+    with open(file_path, 'rb') as f:
+        info = PyPDF2.PdfReader(f).metadata
+        value = info.get('/CreationDate') if info else None
+    match = re.match(r'D:(\d{4})(\d{2})(\d{2})', str(value or ''))
+    if match:
+        return '-'.join(match.groups())
+    return None
+
+
+def infer_date(file_path, kind):
+    date = None
+    try:
+        if kind == 'text_image':
+            date = _date_from_exif(file_path)
+        elif file_path.lower().endswith('.pdf'):
+            date = _date_from_pdf(file_path)
+    except Exception:
+        date = None
+    date = date or _date_from_filename(file_path)
+    if not date:
+        date = datetime.date.fromtimestamp(os.path.getmtime(file_path)).isoformat()
+    return date
+
+
+_EXTRACTORS = {
+    'document': ingest.extract_document,
+    'audio': ingest.extract_audio,
+    'text_image': ingest.extract_text_image,
+}
+
+
+def extract_file(file_path, kind):
+    # Runs in a worker; returns everything needed to build the rows.
+    date = infer_date(file_path, kind)
+    result = _EXTRACTORS[kind]({'file_path': file_path, 'date': date})
+    result['date'] = date
+    return result
+
+
+class BulkImporter:
+    """Walk a folder and import every supported file into one case.
+
+    Files are hashed first: content already in the case is skipped before
+    it's copied into the attachment store, and content seen before reuses its
+    cached extraction. The rest is extracted on a process pool (audio goes to
+    threads because recognition is network-bound) and rows are written with
+    executemany in transactions of ``batch_size`` files.
+    """
+
+    def __init__(self, conn, case_id, batch_size=BATCH_SIZE, workers=None, io_workers=4,
+                 on_file=None, progress=None):
+        self.conn = conn
+        self.case_id = case_id
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.io_workers = io_workers
+        self.on_file = on_file
+        self.progress = progress
+        self.contacts = None
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self.batch = {'documents': [], 'audio_recordings': [], 'text_messages': [], 'events': []}
+        self.batch_files = []
+
+    def run(self, root):
+        files = list(walk(root))
+        stats = {'files': 0, 'bytes': 0, 'failed': 0, 'duplicates': 0, 'cached': 0, 'kinds': {}, 'errors': []}
+        start = time.perf_counter()
+        seen = set()
+        done_count = 0
+        # Only files that aren't in the case yet are copied into the attachment store.
+        files_store = attachments.store(self.conn)
+        with ProcessPoolExecutor(max_workers=self.workers) as cpu_pool, \
+                ThreadPoolExecutor(max_workers=self.io_workers) as io_pool:
+            pending = {}
+            queue = iter(files)
+            # Keep a bounded window in flight so 5,000 files don't all sit in memory.
+            window = (self.workers + self.io_workers) * 4
+            while True:
+                for file_path, kind in queue:
+                    pending[io_pool.submit(evidence_store.hash_file, file_path)] = ('hash', file_path, kind, None)
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, file_path, kind, digest = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        stats['failed'] += 1
+                        stats['errors'].append((file_path, str(e)))
+                    else:
+                        if stage == 'hash':
+                            sha256, size = value
+                            cached = evidence_store.lookup(self.conn, sha256, self.case_id)
+                            if sha256 in seen or (cached and cached.linked):
+                                stats['duplicates'] += 1
+                            elif not attachments.stored(self.conn, sha256):
+                                seen.add(sha256)
+                                pending[io_pool.submit(files_store.write, file_path)] = ('store', file_path, kind, None)
+                                continue
+                            else:
+                                # Stored for another case already; there's nothing to copy.
+                                seen.add(sha256)
+                                stage, value = 'store', (sha256, size, [])
+                        if stage == 'store':
+                            cached = evidence_store.lookup(self.conn, value[0], self.case_id)
+                            if cached and cached.extracted is not None and ingest.is_current(kind, cached.extracted):
+                                result = dict(cached.extracted, date=infer_date(file_path, kind))
+                                self._add(file_path, kind, result, value, stats)
+                                stats['cached'] += 1
+                            else:
+                                pool = io_pool if kind == 'audio' else cpu_pool
+                                pending[pool.submit(extract_file, file_path, kind)] = \
+                                    ('extract', file_path, kind, value)
+                                continue
+                        elif stage == 'extract':
+                            self._add(file_path, kind, value, digest, stats)
+                    done_count += 1
+                    if len(self.batch_files) >= self.batch_size:
+                        self.flush()
+                    if self.progress:
+                        self.progress(done_count, len(files))
+        self.flush()
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def _add(self, file_path, kind, result, stored, stats):
+        # stored: (sha256, size, chunk ids) from attachments.Store.write; no chunk
+        # ids when the content was already stored.
+        sha256, size, chunk_ids = stored
+        name = os.path.basename(file_path)
+        date = result.pop('date')
+        rows = 1
+        sort_date = db.normalize_date(date)
+        if kind == 'document':
+            table = 'documents'
+            category = os.path.basename(os.path.dirname(file_path)) or 'Bulk Import'
+            self.batch[table].append((self.case_id, name, file_path, result['content'], date, category, sort_date))
+            self.batch['events'].append((self.case_id, date, f"Added document: {name}", 'Document', sort_date))
+        elif kind == 'audio':
+            table = 'audio_recordings'
+            self.batch[table].append((self.case_id, name, file_path, result['transcription'], date, sort_date))
+            self.batch['events'].append((self.case_id, date, f"Added audio: {name}", 'Audio', sort_date))
+        else:
+            # One row per message bubble in the screenshot.
+            table = 'text_messages'
+            if self.contacts is None:
+                self.contacts = contacts.ContactResolver(self.conn, self.case_id)
+            me_id = self.contacts.resolve(screenshot_ocr.ME)
+            contact_id = self.contacts.resolve(result['contact'])
+            messages = screenshot_ocr.messages(result, date)
+            for msg_date, sender, content in messages:
+                sent = sender == screenshot_ocr.ME
+                self.batch[table].append((self.case_id, msg_date, me_id if sent else contact_id,
+                                          contact_id if sent else me_id, content, 1, db.normalize_date(msg_date)))
+            rows = len(messages)
+            self.batch['events'].append((self.case_id, messages[0][0], f"Text message image from {result['contact']}",
+                                         'Text Message', db.normalize_date(messages[0][0])))
+        self.batch_files.append((file_path, name, kind, table, result, sha256, size, rows, chunk_ids))
+        stats['files'] += 1
+        stats['bytes'] += size
+        stats['kinds'][kind] = stats['kinds'].get(kind, 0) + 1
+
+    def _inserted_ids(self, table, count):
+        # AUTOINCREMENT ids are contiguous inside our write transaction, so the
+        # rows executemany just inserted end at the table's current sequence.
+        if not count:
+            return iter(())
+        c = self.conn.cursor()
+        c.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,))
+        last = c.fetchone()[0]
+        return iter(range(last - count + 1, last + 1))
+
+    def flush(self):
+        if not self.batch_files:
+            return
+        c = self.conn.cursor()
+        c.executemany('INSERT INTO documents VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)', self.batch['documents'])
+        ids = {'documents': self._inserted_ids('documents', len(self.batch['documents']))}
+        c.executemany('INSERT INTO audio_recordings VALUES (NULL, ?, ?, ?, ?, ?, ?)', self.batch['audio_recordings'])
+        ids['audio_recordings'] = self._inserted_ids('audio_recordings', len(self.batch['audio_recordings']))
+        c.executemany('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)', self.batch['text_messages'])
+        ids['text_messages'] = self._inserted_ids('text_messages', len(self.batch['text_messages']))
+        c.executemany('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)', self.batch['events'])
+        for file_path, name, kind, table, result, sha256, size, rows, chunk_ids in self.batch_files:
+            # A screenshot's messages are linked through the first of them.
+            source_id = next(ids[table])
+            for _ in range(rows - 1):
+                next(ids[table])
+            if table == 'audio_recordings':
+                transcription.store_segments(self.conn, source_id, result.get('segments', []))
+            elif table == 'documents':
+                pdf_pages.store_pages(self.conn, self.case_id, source_id, result.get('pages', []))
+            attachments.save(self.conn, sha256, size, chunk_ids)
+            evidence_store.remember(self.conn, sha256, size, kind, result, file_path)
+            evidence_store.link(self.conn, sha256, self.case_id, table, source_id)
+        self.conn.commit()
+        if self.on_file:
+            for file_path, name, kind, table, result, sha256, size, rows, chunk_ids in self.batch_files:
+                self.on_file(file_path, name, sha256)
+        self._reset_batch()
+
+
+def format_stats(stats):
+    seconds = max(stats['seconds'], 1e-9)
+    megabytes = stats['bytes'] / (1024 * 1024)
+    kinds = ', '.join(f"{count} {kind}" for kind, count in sorted(stats['kinds'].items())) or 'none'
+    return (f"Imported {stats['files']} files ({megabytes:.1f} MB) in {seconds:.1f}s: "
+            f"{stats['files'] / seconds:.1f} files/sec, {megabytes / seconds:.2f} MB/sec. "
+            f"By type: {kinds}. Reused cached extraction: {stats['cached']}. "
+            f"Duplicates skipped: {stats['duplicates']}. Failed: {stats['failed']}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import a folder of evidence into a case.')
+    parser.add_argument('folder')
+    parser.add_argument('--case-id', type=int, required=True)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    password = os.environ.get('CASE_MANAGER_PASSWORD') or getpass.getpass('Database password: ')
+    conn = db.connect(password, args.db)
+    db.init_schema(conn)
+
+    def progress(done, total):
+        print(f"\r{done}/{total} files", end='', file=sys.stderr)
+
+    importer = BulkImporter(conn, args.case_id, batch_size=args.batch_size, workers=args.workers,
+                            progress=progress)
+    stats = importer.run(args.folder)
+    print(file=sys.stderr)
+    for file_path, error in stats['errors']:
+        print(f"Failed: {file_path}: {error}", file=sys.stderr)
+    print(format_stats(stats))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,137 +1,143 @@
 import kivy
 kivy.require('2.3.0')
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.popup import Popup
 from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelItem
-from kivy.uix.scrollview import ScrollView
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.filechooser import FileChooserIconView
-import sqlite3
-import pysqlcipher3.dbapi2 as sqlcipher
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import quote
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-import PyPDF2
-from docx import Document
-import pytesseract
-from PIL import Image
-from dateutil.parser import parse
-import speech_recognition as sr
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.http import MediaFileUpload
+from kivy.utils import escape_markup
 import os
 import pickle
-import datetime
-import openai
-import ffmpeg
-import moviepy.editor as mpe
-import json
+import shutil
+import sys
+import threading
+import search_index
+import ingest
+import attachments
+import db
+import diagnostics
+import evidence_store
+import video
+import analysis
+import llm
+import retrieval
+import bulk_import
+import contacts
+import message_import
+import drive_sync
+import legal_resources
+import reports
+import pages
+import result_list
+import service
+
+# Set by benchmarks/startup_time.py: print when the first frame is drawn, then quit.
+FIRST_FRAME_ENV = 'CASE_MANAGER_EXIT_AFTER_FIRST_FRAME'
+# "Save a Copy" writes stored evidence files here.
+EXPORT_DIR = 'exports'
 
 class CaseManagerApp(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # main_conn lists the cases; conn is the database of the open case, the same
+        # connection unless the case has a file of its own (at db_path).
+        self.main_conn = None
         self.conn = None
+        self.db_path = None
         self.current_case_id = None
         self.state = None
         self.api_key = None
         self.creds = None
+        self.ingest = None
+        self.db_password = None
+        self.llm = None
+        self.sync = None
+        self.legal = None
+        self.contacts = None
+        # Database files whose attachment store was cleaned up this session.
+        self.collected = set()
+        diagnostics.configure_from_env()
 
-    def init_db(self, password):
-        self.conn = sqlcipher.connect('case_manager.db')
-        c = self.conn.cursor()
-        c.execute(f"PRAGMA key = '{password}'")
-        c.execute('''CREATE TABLE IF NOT EXISTS cases (
-            case_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_name TEXT,
-            state TEXT
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS contacts (
-            contact_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            name TEXT,
-            email TEXT,
-            phone TEXT,
-            role TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS documents (
-            doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            doc_name TEXT,
-            file_path TEXT,
-            content TEXT,
-            doc_date TEXT,
-            category TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS audio_recordings (
-            audio_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            audio_name TEXT,
-            file_path TEXT,
-            transcription TEXT,
-            audio_date TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS text_messages (
-            msg_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            msg_date TEXT,
-            sender_id INTEGER,
-            recipient_id INTEGER,
-            content TEXT,
-            is_image INTEGER,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id),
-            FOREIGN KEY(sender_id) REFERENCES contacts(contact_id),
-            FOREIGN KEY(recipient_id) REFERENCES contacts(contact_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS emails (
-            email_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            email_date TEXT,
-            sender_id INTEGER,
-            recipient_id INTEGER,
-            subject TEXT,
-            content TEXT,
-            is_image INTEGER,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id),
-            FOREIGN KEY(sender_id) REFERENCES contacts(contact_id),
-            FOREIGN KEY(recipient_id) REFERENCES contacts(contact_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS events (
-            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            event_date TEXT,
-            description TEXT,
-            event_type TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS calendar_events (
-            cal_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            event_date TEXT,
-            title TEXT,
-            description TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS pre_case_context (
-            context_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER,
-            description TEXT,
-            context_date TEXT,
-            FOREIGN KEY(case_id) REFERENCES cases(case_id)
-        )''')
-        self.conn.commit()
+    def open_db(self, password):
+        # Once per session: later cases are opened and created on the same connection.
+        if self.main_conn:
+            return
+        self.main_conn = db.connect(password)
+        self.db_password = password
+        db.init_schema(self.main_conn)
+        self.conn = self.main_conn
+        self.db_path = db.DB_PATH
+        self.collect_attachments(db.DB_PATH)
+
+    def collect_attachments(self, path):
+        # Chunks left by imports that failed or were cancelled; once per database per session.
+        if path in self.collected:
+            return
+        self.collected.add(path)
+        password = self.db_password
+
+        def run():
+            conn = db.connect(password, path)
+            try:
+                deleted, freed = attachments.gc(conn)
+                if deleted:
+                    print(f'Removed {deleted} unused attachment chunk(s), {freed / 1e6:.1f} MB')
+            except Exception as e:
+                print(f'Attachment cleanup failed: {e}')
+            finally:
+                conn.close()
+        threading.Thread(target=run, daemon=True).start()
+
+    def switch_db(self, path):
+        # The background engines hold connections to the current case's database.
+        if self.ingest:
+            self.ingest.shutdown()
+            self.ingest = None
+        if self.sync:
+            self.sync.stop()
+            self.sync = None
+        if self.conn is not self.main_conn:
+            self.conn.close()
+        if path == db.DB_PATH:
+            self.conn = self.main_conn
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Its key is derived on the first open of the session only; see db.connect.
+            self.conn = db.connect(self.db_password, path)
+        self.db_path = path
+
+    def use_case(self, case_id):
+        case = service.get_case(self.main_conn, case_id)
+        path = service.case_db(db.DB_PATH, case)
+        if path != self.db_path:
+            self.switch_db(path)
+            if path != db.DB_PATH:
+                # A new file gets its tables; one from an older version, the migrations since.
+                service.init_case_db(self.conn, *case[:3])
+                self.collect_attachments(path)
+        self.current_case_id = case_id
+        self.state = case[2]
+        self.contacts = contacts.ContactResolver(self.conn, case_id)
+        if self.creds is None:
+            self.creds = self.setup_google_drive()
+        self.start_sync()
+        self.start_ingest()
+        if self.api_key:
+            self.start_llm()
+        self.show_calendar()
+
+    # Drive, OCR, audio, LLM and report libraries are imported inside the features
+    # that use them so the window opens without loading them.
 
     def setup_google_drive(self):
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         SCOPES = ['https://www.googleapis.com/auth/drive.file']
         creds = None
         if os.path.exists('token.pickle'):
@@ -152,16 +158,152 @@ class CaseManagerApp(App):
         return creds
 
                    
-    def upload_to_drive(self, file_path, file_name):
-        if not self.creds:
-            self.creds = self.setup_google_drive()
-        if not self.creds:
+    def upload_to_drive(self, file_path, file_name, sha256=None):
+        # Queued in drive_outbox; the sync engine uploads it in the background
+        # and resumes it after a dropped connection or restart.
+        # Files synced before are updated in place, and only if they changed.
+        if not self.sync:
+            return
+        if drive_sync.queue_file(self.conn, self.current_case_id, file_path, file_name, sha256):
+            self.conn.commit()
+            self.sync.wake()
+
+    def upload_evidence(self, file_path, file_name, sha256):
+        # Content already on Drive (from this or another case) isn't uploaded again.
+        cached = evidence_store.lookup(self.conn, sha256)
+        if cached and cached.drive_file_id:
+            return
+        self.upload_to_drive(file_path, file_name, sha256)
+
+    def remember_drive_id(self, sha256, file_id):
+        evidence_store.set_drive_id(self.conn, sha256, file_id)
+        self.conn.commit()
+
+    def start_sync(self):
+        if self.sync or not self.creds:
+            return
+        password, path = self.db_password, self.db_path
+        # Upload workers use their own connections; updates come back through the Clock.
+        self.sync = drive_sync.SyncEngine(
+            lambda: db.connect(password, path), drive_sync.DriveClient(self.creds),
+            on_update=lambda upload_id, status, row: Clock.schedule_once(
+                lambda dt: self.on_sync_update(upload_id, status, row)))
+        # Uploads that failed last session get another try.
+        drive_sync.retry_failed(self.conn)
+        self.conn.commit()
+        self.sync.start()
+
+    def on_sync_update(self, upload_id, status, row):
+        if status in (drive_sync.DONE, drive_sync.SKIPPED):
+            if status == drive_sync.DONE:
+                print(f"Uploaded {row['name']} to Google Drive with ID: {row['drive_file_id']}")
+            if row['sha256']:
+                self.remember_drive_id(row['sha256'], row['drive_file_id'])
+        elif status == drive_sync.FAILED:
+            print(f"Upload of {row['name']} failed: {row['error']}")
+
+    def sync_cloud(self, instance):
+        if not self.sync:
+            popup = Popup(title='Error', content=Label(text='Create a case with Drive credentials first.'),
+                          size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        pull_dir = os.path.join('shared', str(self.current_case_id))
+        future = self.sync.sync_case(self.current_case_id, pull_dir)
+        future.add_done_callback(lambda f: Clock.schedule_once(lambda dt: self.finish_sync_cloud(f)))
+
+    def finish_sync_cloud(self, future):
+        try:
+            written = future.result()
+        except Exception as e:
+            popup = Popup(title='Error', content=Label(text=f'Sync failed: {e}'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        counts = drive_sync.summary(self.conn, self.current_case_id)
+        pending = counts.get(drive_sync.PENDING, 0) + counts.get(drive_sync.UPLOADING, 0)
+        text = f'{len(written)} file(s) downloaded from the shared folder.\n{pending} upload(s) in progress.'
+        if written:
+            text += f'\nSaved in {os.path.dirname(written[0])}'
+        popup = Popup(title='Sync Cloud', content=Label(text=text), size_hint=(0.8, 0.4))
+        popup.open()
+
+    def start_ingest(self):
+        if self.ingest:
             return
-        service = build('drive', 'v3', credentials=self.creds)
-        file_metadata = {'name': file_name}
-        media = MediaFileUpload(file_path)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        print(f"Uploaded {file_name} to Google Drive with ID: {file.get('id')}")
+        # Work a queue reports after switch_db shut it down is dropped: its connection may be closed.
+        queue = ingest.IngestQueue(self.conn, on_update=self.on_ingest_update,
+                                   schedule=lambda fn: Clock.schedule_once(lambda dt: queue.closed or fn()))
+        self.ingest = queue
+        # Each stored file is also queued for Drive upload.
+        service.register_handlers(self.ingest, self.conn, self.contact_resolver, self.upload_evidence)
+        # Jobs left queued or running by a previous session are picked up again.
+        self.ingest.resume()
+
+    def cancel_ingest(self, instance):
+        cancelled = self.ingest.cancel_case(self.current_case_id) if self.ingest else 0
+        popup = Popup(title='Cancel Processing', content=Label(text=f'{cancelled} file(s) cancelled.'),
+                      size_hint=(0.8, 0.3))
+        popup.open()
+
+    def on_ingest_update(self, job_id, status, error):
+        if not self.ingest:
+            return
+        counts = self.ingest.counts(self.current_case_id)
+        pending = counts.get(ingest.QUEUED, 0) + counts.get(ingest.RUNNING, 0)
+        self.ingest_status.text = (f"Processing: {pending}  Done: {counts.get(ingest.DONE, 0)}  "
+                                   f"Failed: {counts.get(ingest.FAILED, 0)}")
+        if status == ingest.DUPLICATE:
+            popup = Popup(title='Duplicate', content=Label(text='This file is already in the case.'),
+                          size_hint=(0.8, 0.3))
+            popup.open()
+        elif status == ingest.FAILED:
+            popup = Popup(title='Error', content=Label(text=f'Import failed: {error}'), size_hint=(0.8, 0.3))
+            popup.open()
+
+    def start_llm(self):
+        if self.llm:
+            return
+        password = self.db_password
+        # The response cache gets its own connection, to the main database whichever case
+        # is open; it is only used on the client's loop thread.
+        self.llm = llm.LLMClient(self.api_key, connect=lambda: db.connect(password))
+
+    def stream_to_report(self, header):
+        # Returns an on_token callback for the LLM client: tokens arrive on its
+        # loop thread and are appended to the report on the UI thread. None
+        # means a retry is starting, so the partial text is cleared.
+        self.report_output.show_text(header)
+
+        def on_token(token):
+            def update(dt):
+                if token is None:
+                    self.report_output.show_text(header)
+                else:
+                    self.report_output.append_text(token)
+            Clock.schedule_once(update)
+        return on_token
+
+    def on_start(self):
+        if os.environ.get(FIRST_FRAME_ENV):
+            Clock.schedule_once(self.report_first_frame)
+
+    def report_first_frame(self, dt):
+        print("first frame", file=sys.stderr, flush=True)
+        self.stop()
+
+    def on_stop(self):
+        if self.ingest:
+            self.ingest.shutdown()
+        if self.llm:
+            self.llm.close()
+        if self.sync:
+            self.sync.stop()
+        if self.legal:
+            self.legal.close()
+        if self.conn is not self.main_conn:
+            self.conn.close()
+        if self.main_conn:
+            self.main_conn.close()
 
     def build(self):
         self.root = TabbedPanel()
@@ -180,9 +322,15 @@ class CaseManagerApp(App):
         setup_layout.add_widget(Label(text='Database Password:'))
         self.db_password_input = TextInput(multiline=False, password=True)
         setup_layout.add_widget(self.db_password_input)
+        case_row = BoxLayout(spacing=10)
         setup_btn = Button(text='Create Case')
         setup_btn.bind(on_press=self.create_case)
-        setup_layout.add_widget(setup_btn)
+        case_row.add_widget(setup_btn)
+        self.separate_toggle = Button(text='Own file: off', size_hint_x=0.4, on_press=self.toggle_separate)
+        case_row.add_widget(self.separate_toggle)
+        setup_layout.add_widget(case_row)
+        setup_layout.add_widget(Button(text='Open Case', on_press=self.open_case))
+        setup_layout.add_widget(Button(text='Sync Cloud', on_press=self.sync_cloud))
         setup_tab.add_widget(setup_layout)
         self.root.add_widget(setup_tab)
 
@@ -190,12 +338,21 @@ class CaseManagerApp(App):
         add_data_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         add_data_layout.add_widget(Button(text='Add Document', on_press=self.add_document))
         add_data_layout.add_widget(Button(text='Add Audio', on_press=self.add_audio))
+        add_data_layout.add_widget(Button(text='Add Video', on_press=self.add_video))
         add_data_layout.add_widget(Button(text='Add Text Message', on_press=self.add_text_message))
         add_data_layout.add_widget(Button(text='Add Email', on_press=self.add_email))
         add_data_layout.add_widget(Button(text='Add Text Message Image', on_press=self.add_text_image))
+        add_data_layout.add_widget(Button(text='Bulk Import Folder', on_press=self.add_bulk_import))
+        add_data_layout.add_widget(Button(text='Import Messages', on_press=self.add_message_import))
         add_data_layout.add_widget(Button(text='Add Contact', on_press=self.add_contact))
+        add_data_layout.add_widget(Button(text='Merge Duplicate Contacts', on_press=self.merge_contacts))
         add_data_layout.add_widget(Button(text='Add Event', on_press=self.add_event))
         add_data_layout.add_widget(Button(text='Add Pre-Case Context', on_press=self.add_pre_case_context))
+        status_row = BoxLayout(size_hint_y=None, height=40)
+        self.ingest_status = Label(text='')
+        status_row.add_widget(self.ingest_status)
+        status_row.add_widget(Button(text='Cancel Processing', size_hint_x=0.3, on_press=self.cancel_ingest))
+        add_data_layout.add_widget(status_row)
         add_data_tab.add_widget(add_data_layout)
         self.root.add_widget(add_data_tab)
 
@@ -207,10 +364,8 @@ class CaseManagerApp(App):
         search_btn = Button(text='Search')
         search_btn.bind(on_press=self.search_data)
         search_layout.add_widget(search_btn)
-        self.search_results = Label(text='')
-        search_scroll = ScrollView()
-        search_scroll.add_widget(self.search_results)
-        search_layout.add_widget(search_scroll)
+        self.search_results = result_list.ResultList(on_open=self.open_source, markup=True)
+        search_layout.add_widget(self.search_results)
         search_tab.add_widget(search_layout)
         self.root.add_widget(search_tab)
 
@@ -228,10 +383,8 @@ class CaseManagerApp(App):
         add_event_btn = Button(text='Add Calendar Event')
         add_event_btn.bind(on_press=self.add_calendar_event)
         calendar_layout.add_widget(add_event_btn)
-        self.calendar_output = Label(text='')
-        calendar_scroll = ScrollView()
-        calendar_scroll.add_widget(self.calendar_output)
-        calendar_layout.add_widget(calendar_scroll)
+        self.calendar_output = result_list.ResultList(on_open=self.open_source)
+        calendar_layout.add_widget(self.calendar_output)
         calendar_tab.add_widget(calendar_layout)
         self.root.add_widget(calendar_tab)
 
@@ -243,10 +396,8 @@ class CaseManagerApp(App):
         legal_btn = Button(text='Search Legal Resources')
         legal_btn.bind(on_press=self.search_chins_resources)
         legal_layout.add_widget(legal_btn)
-        self.legal_output = Label(text='')
-        legal_scroll = ScrollView()
-        legal_scroll.add_widget(self.legal_output)
-        legal_layout.add_widget(legal_scroll)
+        self.legal_output = result_list.ResultList(on_open=self.open_source)
+        legal_layout.add_widget(self.legal_output)
         legal_tab.add_widget(legal_layout)
         self.root.add_widget(legal_tab)
 
@@ -256,13 +407,38 @@ class CaseManagerApp(App):
         reports_layout.add_widget(Button(text='Generate Custom Report', on_press=self.generate_custom_report))
         reports_layout.add_widget(Button(text='Detect Lies by All Parties', on_press=self.detect_lies_patterns))
         reports_layout.add_widget(Button(text='Draft Motion', on_press=self.draft_motion))
-        self.report_output = Label(text='')
-        report_scroll = ScrollView()
-        report_scroll.add_widget(self.report_output)
-        reports_layout.add_widget(report_scroll)
+        self.report_output = result_list.ResultList(on_open=self.open_source)
+        reports_layout.add_widget(self.report_output)
         reports_tab.add_widget(reports_layout)
         self.root.add_widget(reports_tab)
 
+        diagnostics_tab = TabbedPanelItem(text='Diagnostics')
+        diagnostics_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        controls = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        self.diagnostics_toggle = Button(on_press=self.toggle_diagnostics)
+        controls.add_widget(self.diagnostics_toggle)
+        controls.add_widget(Button(text='Refresh', on_press=lambda x: self.show_diagnostics()))
+        controls.add_widget(Button(text='Clear', on_press=self.clear_diagnostics))
+        diagnostics_layout.add_widget(controls)
+        diagnostics_layout.add_widget(Label(text='Profile operations (e.g. ingest.document, report; * for all):',
+                                            size_hint_y=None, height=30))
+        profile_row = BoxLayout(size_hint_y=None, height=40, spacing=10)
+        self.profile_input = TextInput(multiline=False)
+        profile_row.add_widget(self.profile_input)
+        self.memory_check = Button(text='Memory: off', size_hint_x=0.25, on_press=self.toggle_memory)
+        profile_row.add_widget(self.memory_check)
+        profile_row.add_widget(Button(text='Apply', size_hint_x=0.2, on_press=lambda x: self.apply_diagnostics()))
+        diagnostics_layout.add_widget(profile_row)
+        self.diagnostics_output = result_list.ResultList(on_open=self.open_diagnostic)
+        diagnostics_layout.add_widget(self.diagnostics_output)
+        diagnostics_tab.add_widget(diagnostics_layout)
+        diagnostics_tab.bind(on_press=lambda x: self.show_diagnostics())
+        self.root.add_widget(diagnostics_tab)
+        _, profile, memory = diagnostics.settings()
+        self.profile_input.text = ', '.join(profile)
+        self.memory_check.text = f"Memory: {'on' if memory else 'off'}"
+        self.update_diagnostics_toggle()
+
         about_tab = TabbedPanelItem(text='About')
         about_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         about_layout.add_widget(Label(text='Child Welfare Case Manager\nVersion 1.0\nNot legal advice.\nFor parents fighting for reunification.'))
@@ -280,15 +456,54 @@ class CaseManagerApp(App):
             popup = Popup(title='Error', content=Label(text='All fields are required.'), size_hint=(0.8, 0.3))
             popup.open()
             return
-        self.init_db(password)
-        c = self.conn.cursor()
-        c.execute('INSERT INTO cases (case_name, state) VALUES (?, ?)', (case_name, self.state))
-        self.current_case_id = c.lastrowid
-        self.conn.commit()
-        self.creds = self.setup_google_drive()
+        if not self.login(password):
+            return
+        case_id = service.create_case(self.main_conn, case_name, self.state,
+                                      separate=self.separate_toggle.text.endswith('on'))
+        self.main_conn.commit()
+        self.use_case(case_id)
         popup = Popup(title='Success', content=Label(text='Case created!'), size_hint=(0.8, 0.3))
         popup.open()
 
+    def login(self, password):
+        try:
+            self.open_db(password)
+        except db.sqlcipher.DatabaseError:
+            popup = Popup(title='Error', content=Label(text='Wrong database password.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return False
+        return True
+
+    def toggle_separate(self, instance):
+        # A case with its own database file keeps big cases from slowing small
+        # ones and can be backed up or archived on its own.
+        instance.text = 'Own file: off' if instance.text.endswith('on') else 'Own file: on'
+
+    def open_case(self, instance):
+        password = self.db_password_input.text.strip()
+        if not password:
+            popup = Popup(title='Error', content=Label(text='Enter the database password.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        if not self.login(password):
+            return
+        self.api_key = self.api_key_input.text.strip() or self.api_key
+        rows = [{'text': f"{name} ({state})" + (' - own file' if case_file else ''), 'case_id': case_id,
+                 'case_name': name} for case_id, name, state, case_file in service.list_cases(self.main_conn)]
+        if not rows:
+            rows = [{'text': 'No cases yet. Create one first.'}]
+        popup = Popup(title='Open Case', size_hint=(0.9, 0.9))
+        popup.content = result_list.ResultList(on_open=lambda row: self.finish_open_case(row, popup))
+        popup.content.show(pages.fixed(rows))
+        popup.open()
+
+    def finish_open_case(self, row, popup):
+        if 'case_id' not in row:
+            return
+        popup.dismiss()
+        self.use_case(row['case_id'])
+        self.case_name_input.text, self.state_input.text = row['case_name'], self.state
+
     def add_document(self, instance):
         content = BoxLayout(orientation='vertical')
         file_chooser = FileChooserIconView(filters=['*.pdf', '*.docx', '*.txt'])
@@ -310,32 +525,15 @@ class CaseManagerApp(App):
             popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
             popup.open()
             return
-        file_path = selection[0]
-        content = ''
-        if file_path.endswith('.pdf'):
-            with open(file_path, 'rb') as f:
-                pdf = PyPDF2.PdfReader(f)
-                content = ' '.join(page.extract_text() for page in pdf.pages)
-        elif file_path.endswith('.docx'):
-            doc = Document(file_path)
-            content = ' '.join(p.text for p in doc.paragraphs)
-        elif file_path.endswith('.txt'):
-            with open(file_path, 'r') as f:
-                content = f.read()
-        c = self.conn.cursor()
-        c.execute('INSERT INTO documents VALUES (NULL, ?, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, doc_name, file_path, content, doc_date, category))
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, docile_date, f"Added document: {doc_name}", 'Document'))
-        self.conn.commit()
-        self.upload_to_drive(file_path, doc_name)
+        self.ingest.submit(self.current_case_id, 'document', {
+            'file_path': selection[0], 'doc_name': doc_name, 'doc_date': doc_date, 'category': category})
         popup.dismiss()
-        popup = Popup(title='Success', content=Label(text='Document added!'), size_hint=(0.8, 0.3))
+        popup = Popup(title='Success', content=Label(text='Document queued for import.'), size_hint=(0.8, 0.3))
         popup.open()
 
     def add_audio(self, instance):
         content = BoxLayout(orientation='vertical')
-        file_chooser = FileChooserIconView(filters=['*.mp3', '*.wav', '*.m4a'])
+        file_chooser = FileChooserIconView(filters=['*.mp3', '*.wav', '*.m4a', '*.amr', '*.aac', '*.ogg', '*.3gp'])
         content.add_widget(file_chooser)
         audio_name = TextInput(hint_text='Audio Name', size_hint_y=None, height=50)
         content.add_widget(audio_name)
@@ -352,23 +550,35 @@ class CaseManagerApp(App):
             popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
             popup.open()
             return
-        file_path = selection[0]
-        r = sr.Recognizer()
-        with sr.AudioFile(file_path) as source:
-            audio = r.record(source)
-            try:
-                transcription = r.recognize_google(audio)
-            except:
-                transcription = 'Transcription failed.'
-        c = self.conn.cursor()
-        c.execute('INSERT INTO audio_recordings VALUES (NULL, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, audio_name, file_path, transcription, audio_date))
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, audio_date, f"Added audio: {audio_name}", 'Audio'))
-        self.conn.commit()
-        self.upload_to_drive(file_path, audio_name)
+        self.ingest.submit(self.current_case_id, 'audio', {
+            'file_path': selection[0], 'audio_name': audio_name, 'audio_date': audio_date})
+        popup.dismiss()
+        popup = Popup(title='Success', content=Label(text='Audio queued for transcription.'), size_hint=(0.8, 0.3))
+        popup.open()
+
+    def add_video(self, instance):
+        content = BoxLayout(orientation='vertical')
+        file_chooser = FileChooserIconView(filters=['*.mp4', '*.mov', '*.m4v', '*.avi', '*.mkv', '*.webm', '*.3gp'])
+        content.add_widget(file_chooser)
+        video_name = TextInput(hint_text='Video Name', size_hint_y=None, height=50)
+        content.add_widget(video_name)
+        video_date = TextInput(hint_text='Date (YYYY-MM-DD)', size_hint_y=None, height=50)
+        content.add_widget(video_date)
+        btn = Button(text='Add Video', size_hint_y=None, height=50)
+        popup = Popup(title='Add Video', content=content, size_hint=(0.9, 0.9))
+        btn.bind(on_press=lambda x: self.process_video(file_chooser.selection, video_name.text, video_date.text, popup))
+        content.add_widget(btn)
+        popup.open()
+
+    def process_video(self, selection, video_name, video_date, popup):
+        if not selection or not video_name or not video_date:
+            popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        self.ingest.submit(self.current_case_id, 'video', {
+            'file_path': selection[0], 'video_name': video_name, 'video_date': video_date})
         popup.dismiss()
-        popup = Popup(title='Success', content=Label(text='Audio added!'), size_hint=(0.8, 0.3))
+        popup = Popup(title='Success', content=Label(text='Video queued for transcription.'), size_hint=(0.8, 0.3))
         popup.open()
 
     def add_text_message(self, instance):
@@ -385,25 +595,8 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_text_message(self, msg_date, sender, recipient, content, popup):
-        c = self.conn.cursor()
-        c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (sender, self.current_case_id))
-        sender_id = c.fetchone()
-        if not sender_id:
-            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (self.current_case_id, sender, '', '', 'Unknown'))
-            sender_id = c.lastrowid
-        else:
-            sender_id = sender_id[0]
-        c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (recipient, self.current_case_id))
-        recipient_id = c.fetchone()
-        if not recipient_id:
-            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (self.current_case_id, recipient, '', '', 'Unknown'))
-            recipient_id = c.lastrowid
-        else:
-            recipient_id = recipient_id[0]
-        c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, msg_date, sender_id, recipient_id, content, 0))
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, msg_date, f"Text message from {sender} to {recipient}", 'Text Message'))
+        service.add_text_message(self.conn, self.current_case_id, msg_date, sender, recipient, content,
+                                 self.contact_resolver(self.current_case_id))
         self.conn.commit()
         popup.dismiss()
         popup = Popup(title='Success', content=Label(text='Message added!'), size_hint=(0.8, 0.3))
@@ -424,25 +617,8 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_email(self, email_date, sender, recipient, subject, content, popup):
-        c = self.conn.cursor()
-        c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (sender, self.current_case_id))
-        sender_id = c.fetchone()
-        if not sender_id:
-            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (self.current_case_id, sender, '', '', 'Unknown'))
-            sender_id = c.lastrowid
-        else:
-            sender_id = sender_id[0]
-        c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (recipient, self.current_case_id))
-        recipient_id = c.fetchone()
-        if not recipient_id:
-            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (self.current_case_id, recipient, '', '', 'Unknown'))
-            recipient_id = c.lastrowid
-        else:
-            recipient_id = recipient_id[0]
-        c.execute('INSERT INTO emails VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, email_date, sender_id, recipient_id, subject, content, 0))
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, email_date, f"Email from {sender}: {subject}", 'Email'))
+        service.add_email(self.conn, self.current_case_id, email_date, sender, recipient, subject, content,
+                          self.contact_resolver(self.current_case_id))
         self.conn.commit()
         popup.dismiss()
         popup = Popup(title='Success', content=Label(text='Email added!'), size_hint=(0.8, 0.3))
@@ -450,9 +626,10 @@ class CaseManagerApp(App):
 
     def add_text_image(self, instance):
         content = BoxLayout(orientation='vertical')
-        file_chooser = FileChooserIconView(filters=['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.gif', '*.heic'])
+        file_chooser = FileChooserIconView(filters=['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.gif', '*.heic', '*.heif'],
+                                           multiselect=True)
         content.add_widget(file_chooser)
-        btn = Button(text='Process Image', size_hint_y=None, height=50)
+        btn = Button(text='Process Images', size_hint_y=None, height=50)
         popup = Popup(title='Add Text Message Image', content=content, size_hint=(0.9, 0.9))
         btn.bind(on_press=lambda x: self.process_text_image(file_chooser.selection, popup))
         content.add_widget(btn)
@@ -463,34 +640,109 @@ class CaseManagerApp(App):
             popup = Popup(title='Error', content=Label(text='Please select an image.'), size_hint=(0.8, 0.3))
             popup.open()
             return
-        file_path = selection[0]
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        # Each screenshot is its own job, so they're OCR'd on every core at once.
+        for file_path in selection:
+            self.ingest.submit(self.current_case_id, 'text_image',
+                               {'file_path': file_path, 'date': bulk_import.infer_date(file_path, 'text_image')})
+        popup.dismiss()
+        popup = Popup(title='Success', content=Label(text=f'{len(selection)} image(s) queued for OCR.'),
+                      size_hint=(0.8, 0.3))
+        popup.open()
+
+    def add_bulk_import(self, instance):
+        content = BoxLayout(orientation='vertical')
+        file_chooser = FileChooserIconView(dirselect=True)
+        content.add_widget(file_chooser)
+        btn = Button(text='Import Folder', size_hint_y=None, height=50)
+        popup = Popup(title='Bulk Import Folder', content=content, size_hint=(0.9, 0.9))
+        btn.bind(on_press=lambda x: self.process_bulk_import(file_chooser.selection or [file_chooser.path], popup))
+        content.add_widget(btn)
+        popup.open()
+
+    def process_bulk_import(self, selection, popup):
+        folder = selection[0] if selection else None
+        if not folder or not os.path.isdir(folder):
+            popup = Popup(title='Error', content=Label(text='Please select a folder.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        popup.dismiss()
+        threading.Thread(target=self.run_bulk_import, args=(folder, self.current_case_id), daemon=True).start()
+        popup = Popup(title='Success', content=Label(text=f'Bulk import started for {folder}'), size_hint=(0.8, 0.3))
+        popup.open()
+
+    def run_bulk_import(self, folder, case_id):
+        # Runs on its own thread with its own connection; only Clock touches widgets.
+        def progress(done, total):
+            Clock.schedule_once(lambda dt: setattr(self.ingest_status, 'text', f'Bulk import: {done}/{total} files'))
+
+        def upload(file_path, name, sha256):
+            Clock.schedule_once(lambda dt: self.upload_evidence(file_path, name, sha256))
+
+        conn = db.connect(self.db_password, self.db_path)
         try:
-            lines = text.split('\n')
-            msg_date = parse(lines[0], fuzzy=True).strftime('%Y-%m-%d') if lines else 'Unknown'
-            sender = lines[1] if len(lines) > 1 else 'Unknown'
-            content = ' '.join(lines[2:]) if len(lines) > 2 else 'No content extracted'
-        except:
-            msg_date, sender, content = 'Unknown', 'Unknown', text
-        c = self.conn.cursor()
-        c.execute('SELECT contact_id FROM contacts WHERE name=? AND case_id=?', (sender, self.current_case_id))
-        sender_id = c.fetchone()
-        if not sender_id:
-            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (self.current_case_id, sender, '', '', 'Unknown'))
-            sender_id = c.lastrowid
-        else:
-            sender_id = sender_id[0]
-        c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, msg_date, sender_id, sender_id, content, 1))
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, msg_date, f"Text message image from {sender}", 'Text Message'))
-        self.conn.commit()
-        self.upload_to_drive(file_path, os.path.basename(file_path))
+            importer = bulk_import.BulkImporter(conn, case_id, on_file=upload, progress=progress)
+            message = bulk_import.format_stats(importer.run(folder))
+        except Exception as e:
+            message = f'Bulk import failed: {str(e)}'
+        finally:
+            conn.close()
+        print(message)
+        Clock.schedule_once(lambda dt: self.finish_bulk_import(message))
+
+    def add_message_import(self, instance):
+        content = BoxLayout(orientation='vertical')
+        content.add_widget(Label(text='SMS Backup & Restore .xml, iPhone sms.db, .mbox, or a folder of .eml files',
+                                 size_hint_y=None, height=40))
+        file_chooser = FileChooserIconView(dirselect=True)
+        content.add_widget(file_chooser)
+        btn = Button(text='Import', size_hint_y=None, height=50)
+        popup = Popup(title='Import Messages', content=content, size_hint=(0.9, 0.9))
+        btn.bind(on_press=lambda x: self.process_message_import(file_chooser.selection, popup))
+        content.add_widget(btn)
+        popup.open()
+
+    def process_message_import(self, selection, popup):
+        path = selection[0] if selection else None
+        if not path or (not os.path.isdir(path) and message_import.detect(path) is None):
+            popup = Popup(title='Error', content=Label(text='Please select a message backup or folder of emails.'),
+                          size_hint=(0.8, 0.3))
+            popup.open()
+            return
         popup.dismiss()
-        popup = Popup(title='Success', content=Label(text='Image processed!'), size_hint=(0.8, 0.3))
+        threading.Thread(target=self.run_message_import, args=(path, self.current_case_id), daemon=True).start()
+        popup = Popup(title='Success', content=Label(text=f'Importing messages from {os.path.basename(path)}'),
+                      size_hint=(0.8, 0.3))
         popup.open()
 
+    def run_message_import(self, path, case_id):
+        # Same threading as run_bulk_import: own connection, widgets only via Clock.
+        def progress(done):
+            Clock.schedule_once(lambda dt: setattr(self.ingest_status, 'text', f'Message import: {done} messages'))
+
+        def upload(file_path, name, sha256):
+            Clock.schedule_once(lambda dt: self.upload_evidence(file_path, name, sha256))
+
+        conn = db.connect(self.db_password, self.db_path)
+        try:
+            importer = message_import.MessageImporter(conn, case_id, on_file=upload, progress=progress)
+            message = message_import.format_stats(importer.run(path))
+        except Exception as e:
+            message = f'Message import failed: {str(e)}'
+        finally:
+            conn.close()
+        print(message)
+        Clock.schedule_once(lambda dt: self.finish_bulk_import(message, 'Message Import'))
+
+    def finish_bulk_import(self, message, title='Bulk Import'):
+        # The import added contacts on its own connection; reload them on next use.
+        self.contacts = None
+        Popup(title=title, content=Label(text=message, text_size=(500, None)), size_hint=(0.8, 0.4)).open()
+
+    def contact_resolver(self, case_id):
+        if self.contacts is None or self.contacts.case_id != case_id:
+            self.contacts = contacts.ContactResolver(self.conn, case_id)
+        return self.contacts
+
     def add_contact(self, instance):
         content = BoxLayout(orientation='vertical')
         name = TextInput(hint_text='Name', size_hint_y=None, height=50)
@@ -505,18 +757,46 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_contact(self, name, email, phone, role, popup):
-        if not name:
-            popup = Popup(title='Error', content=Label(text='Name is required.'), size_hint=(0.8, 0.3))
+        try:
+            service.add_contact(self.conn, self.current_case_id, name, email, phone, role,
+                                self.contact_resolver(self.current_case_id))
+        except ValueError as e:
+            popup = Popup(title='Error', content=Label(text=str(e)), size_hint=(0.8, 0.3))
             popup.open()
             return
-        c = self.conn.cursor()
-        c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', 
-                  (self.current_case_id, name, email, phone, role))
         self.conn.commit()
         popup.dismiss()
         popup = Popup(title='Success', content=Label(text='Contact added!'), size_hint=(0.8, 0.3))
         popup.open()
 
+    def merge_contacts(self, instance):
+        # Nothing is merged until the user has seen the groups: a wrong merge
+        # deletes a contact and moves its messages to someone else.
+        groups = contacts.find_duplicates(self.conn, self.current_case_id)
+        if not groups:
+            popup = Popup(title='Contacts', content=Label(text='No duplicate contacts found.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        content = BoxLayout(orientation='vertical')
+        listing = TextInput(text='\n'.join(contacts.describe(self.conn, group) for group in groups), readonly=True)
+        content.add_widget(Label(text=f'Merge these {len(groups)} groups? Each becomes its first contact.',
+                                 size_hint_y=None, height=50))
+        content.add_widget(listing)
+        buttons = BoxLayout(size_hint_y=None, height=50)
+        popup = Popup(title='Merge Duplicate Contacts', content=content, size_hint=(0.9, 0.9))
+        buttons.add_widget(Button(text='Merge', on_press=lambda x: self.process_merge(groups, popup)))
+        buttons.add_widget(Button(text='Cancel', on_press=lambda x: popup.dismiss()))
+        content.add_widget(buttons)
+        popup.open()
+
+    def process_merge(self, groups, popup):
+        popup.dismiss()
+        groups, removed = contacts.merge_groups(self.conn, groups)
+        self.contacts = None
+        popup = Popup(title='Contacts', content=Label(text=f'Merged {removed} duplicate contacts into {groups}.'),
+                      size_hint=(0.8, 0.3))
+        popup.open()
+
     def add_event(self, instance):
         content = BoxLayout(orientation='vertical')
         event_date = TextInput(hint_text='Date (YYYY-MM-DD)', size_hint_y=None, height=50)
@@ -530,13 +810,12 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_event(self, event_date, description, event_type, popup):
-        if not event_date or not description or not event_type:
-            popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
+        try:
+            service.add_event(self.conn, self.current_case_id, event_date, description, event_type)
+        except ValueError as e:
+            popup = Popup(title='Error', content=Label(text=str(e)), size_hint=(0.8, 0.3))
             popup.open()
             return
-        c = self.conn.cursor()
-        c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, event_date, description, event_type))
         self.conn.commit()
         popup.dismiss()
         popup = Popup(title='Success', content=Label(text='Event added!'), size_hint=(0.8, 0.3))
@@ -546,15 +825,14 @@ class CaseManagerApp(App):
         event_date = self.event_date_input.text.strip()
         title = self.event_title_input.text.strip()
         description = self.event_desc_input.text.strip()
-        if not event_date or not title or not description:
-            popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
+        try:
+            service.add_calendar_event(self.conn, self.current_case_id, event_date, title, description)
+        except ValueError as e:
+            popup = Popup(title='Error', content=Label(text=str(e)), size_hint=(0.8, 0.3))
             popup.open()
             return
-        c = self.conn.cursor()
-        c.execute('INSERT INTO calendar_events VALUES (NULL, ?, ?, ?, ?)', 
-                  (self.current_case_id, event_date, title, description))
         self.conn.commit()
-        self.calendar_output.text += f"\n{event_date}: {title} - {description}"
+        self.show_calendar()
         popup = Popup(title='Success', content=Label(text='Calendar event added!'), size_hint=(0.8, 0.3))
         popup.open()
 
@@ -570,82 +848,279 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_pre_case_context(self, context_date, description, popup):
-        if not context_date or not description:
-            popup = Popup(title='Error', content=Label(text='All fields required.'), size_hint=(0.8, 0.3))
+        try:
+            service.add_pre_case_context(self.conn, self.current_case_id, context_date, description)
+        except ValueError as e:
+            popup = Popup(title='Error', content=Label(text=str(e)), size_hint=(0.8, 0.3))
             popup.open()
             return
-        c = self.conn.cursor()
-        c.execute('INSERT INTO pre_case_context VALUES (NULL, ?, ?, ?)', 
-                  (self.current_case_id, description, context_date))
         self.conn.commit()
         popup.dismiss()
         popup = Popup(title='Success', content=Label(text='Context added!'), size_hint=(0.8, 0.3))
         popup.open()
 
     def search_data(self, instance):
-        query = self.search_query.text.lower()
+        query = self.search_query.text.strip()
         if not query:
             popup = Popup(title='Error', content=Label(text='Enter a search query.'), size_hint=(0.8, 0.3))
             popup.open()
             return
-        c = self.conn.cursor()
-        results = []
-        c.execute('SELECT doc_name, content FROM documents WHERE case_id=? AND content LIKE ?', 
-                  (self.current_case_id, f'%{query}%'))
-        results.extend([f"Document: {row[0]} - {row[1][:50]}..." for row in c.fetchall()])
-        c.execute('SELECT msg_date, content FROM text_messages WHERE case_id=? AND content LIKE ?', 
-                  (self.current_case_id, f'%{query}%'))
-        results.extend([f"Message: {row[0]} - {row[1][:50]}..." for row in c.fetchall()])
-        c.execute('SELECT email_date, subject, content FROM emails WHERE case_id=? AND content LIKE ?', 
-                  (self.current_case_id, f'%{query}%'))
-        results.extend([f"Email: {row[0]} ({row[1]}) - {row[2][:50]}..." for row in c.fetchall()])
-        c.execute('SELECT description FROM pre_case_context WHERE case_id=? AND description LIKE ?', 
-                  (self.current_case_id, f'%{query}%'))
-        results.extend([f"Pre-Case: {row[0]}" for row in c.fetchall()])
-        self.search_results.text = '\n'.join(results) if results else "No results found."
+        case_id = self.current_case_id
+
+        def hits(conn, case_id):
+            def fetch(offset):
+                found, offset = pages.search_page(conn, case_id, query, offset)
+                return [{'text': self.format_hit(hit), 'source': hit.source, 'source_id': hit.source_id}
+                        for hit in found], offset
+            return fetch
+        # The case's own evidence first, then the legal resources shared by every case.
+        fetch = pages.chain([hits(self.conn, case_id), hits(self.main_conn, search_index.SHARED_CASE_ID)])
+        try:
+            self.search_results.show(fetch)
+        except db.sqlcipher.OperationalError as e:
+            popup = Popup(title='Error', content=Label(text=f'Invalid search: {str(e)}'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
         popup = Popup(title='Success', content=Label(text='Results displayed.'), size_hint=(0.8, 0.3))
         popup.open()
 
+    def format_hit(self, hit):
+        snippet = escape_markup(hit.snippet or '').replace(search_index.HIGHLIGHT_START, '[b][color=ffd54f]')
+        snippet = snippet.replace(search_index.HIGHLIGHT_END, '[/color][/b]')
+        title = f" ({escape_markup(hit.title)})" if hit.title else ''
+        return f"{search_index.SOURCE_LABELS[hit.source]}: {escape_markup(hit.date or '')}{title} - {snippet}"
+
+    def show_calendar(self):
+        case_id = self.current_case_id
+
+        def fetch(after):
+            rows, after = pages.calendar_page(self.conn, case_id, after)
+            return [{'text': f"{row[1]}: {row[2]} - {row[3]}", 'source': 'calendar_events', 'source_id': row[0]}
+                    for row in rows], after
+        self.calendar_output.show(fetch, empty_text='No calendar events yet.')
+
+    def open_source(self, row):
+        # Rows from the result lists: evidence opens in a popup, links in the browser.
+        if 'url' in row:
+            import webbrowser
+            webbrowser.open(row['url'])
+            return
+        if 'source' not in row:
+            return
+        # Saved legal resources are kept in the main database for every case.
+        conn = self.main_conn if row['source'] == 'legal_resources' else self.conn
+        record = pages.source_record(conn, self.current_case_id, row['source'], row['source_id'])
+        if not record:
+            popup = Popup(title='Error', content=Label(text='This item no longer exists.'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        label, title, date, body = record
+        content = TextInput(text=body or '', readonly=True)
+        if row['source'] == 'videos':
+            content = self.video_preview(row['source_id'], content)
+        stored = attachments.source_file(conn, self.current_case_id, row['source'], row['source_id'])
+        if stored:
+            # From the encrypted copy made at import, so it works after the original is moved or deleted.
+            box = BoxLayout(orientation='vertical', spacing=5)
+            box.add_widget(content)
+            box.add_widget(Button(text='Save a Copy of the File', size_hint_y=None, height=50,
+                                  on_press=lambda x: self.export_attachment(*stored)))
+            content = box
+        popup = Popup(title=f"{label}: {date or ''} {title or ''}".strip(), content=content, size_hint=(0.9, 0.9))
+        popup.open()
+
+    def export_attachment(self, sha256, original_path):
+        # Decrypted a chunk at a time on a worker thread; a 2 GB video never sits in memory.
+        name = os.path.basename(original_path or '') or sha256
+        path = os.path.join(EXPORT_DIR, f'{sha256[:12]}-{name}')
+        password, db_path = self.db_password, self.db_path
+
+        def run():
+            conn = db.connect(password, db_path)
+            try:
+                os.makedirs(EXPORT_DIR, exist_ok=True)
+                with attachments.reader(conn, sha256) as source, open(path, 'wb') as f:
+                    shutil.copyfileobj(source, f, attachments.CHUNK_SIZE)
+                message = f'Saved as {path}'
+            except Exception as e:
+                message = f'Saving the file failed: {e}'
+            finally:
+                conn.close()
+            Clock.schedule_once(lambda dt: Popup(title='Save a Copy', content=Label(text=message),
+                                                 size_hint=(0.8, 0.3)).open())
+        threading.Thread(target=run, daemon=True).start()
+
+    def video_preview(self, video_id, transcript):
+        # A strip of the video's keyframes above its transcript.
+        from io import BytesIO
+
+        from kivy.core.image import Image as CoreImage
+        from kivy.uix.image import Image
+        from kivy.uix.scrollview import ScrollView
+
+        frames = video.thumbnails(self.conn, video_id)
+        if not frames:
+            return transcript
+        strip = BoxLayout(size_hint_x=None, spacing=5)
+        strip.width = len(frames) * (video.THUMBNAIL_WIDTH + 5)
+        for time, image in frames:
+            frame = BoxLayout(orientation='vertical', size_hint_x=None, width=video.THUMBNAIL_WIDTH)
+            frame.add_widget(Image(texture=CoreImage(BytesIO(image), ext='jpg').texture))
+            frame.add_widget(Label(text=video.format_time(time), size_hint_y=None, height=24))
+            strip.add_widget(frame)
+        scroller = ScrollView(do_scroll_y=False, size_hint_y=0.35)
+        scroller.add_widget(strip)
+        content = BoxLayout(orientation='vertical', spacing=5)
+        content.add_widget(scroller)
+        content.add_widget(transcript)
+        return content
+
     def search_chins_resources(self, instance):
+        # Saved resources show at once; a background refresh updates them
+        # when they're out of date, and the list again when it finishes.
         state = self.state_input_legal.text.strip()
         if not state:
             popup = Popup(title='Error', content=Label(text='Please enter a state.'), size_hint=(0.8, 0.3))
             popup.open()
             return
+        refreshing = legal_resources.needs_refresh(self.main_conn, state)
+        self.show_legal_resources(state, refreshing)
+        if refreshing:
+            self.start_legal()
+            future = self.legal.refresh(state)
+            future.add_done_callback(lambda f: Clock.schedule_once(lambda dt: self.finish_legal_refresh(state, f)))
+
+    def start_legal(self):
+        if self.legal:
+            return
+        password = self.db_password
+        self.legal = legal_resources.LegalLibrary(lambda: db.connect(password))
+
+    def show_legal_resources(self, state, refreshing=False):
+        resources = legal_resources.cached(self.main_conn, state)
+        lookup = legal_resources.last_lookup(self.main_conn, state)
+        header = f"Legal Resources for {legal_resources.normalize_state(state)}:"
+        if refreshing:
+            header += ' (checking for updates...)'
+        elif lookup and lookup[1]:
+            header += f' (offline copy, last updated {(lookup[0] or "never")[:10]})'
+        rows = [{'text': header}]
+        for resource in resources:
+            row = {'text': f'[{resource.kind}] {resource.title} - {resource.url}'}
+            # Saved pages open from the database, so they work offline.
+            if resource.has_content:
+                row.update(source='legal_resources', source_id=resource.resource_id)
+            else:
+                row['url'] = resource.url
+            rows.append(row)
+        if not resources and not refreshing:
+            rows.append({'text': 'No resources found.'})
+        self.legal_output.show(pages.fixed(rows))
+
+    def finish_legal_refresh(self, state, future):
         try:
-            query = f"{state} child welfare laws and forms"
-            url = f"https://www.google.com/search?q={quote(query)}"
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            response = requests.get(url, headers=headers)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            resources = []
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                if '/url?q=' in href and 'google' not in href:
-                    clean_url = href.split('/url?q=')[1].split('&')[0]
-                    resources.append(clean_url)
-            resources_text = '\n'.join(resources[:5])  # Limit to top 5 results
-            self.legal_output.text += f"\nLegal Resources for {state}:\n{resources_text}"
+            future.result()
         except Exception as e:
-            popup = Popup(title='Error', content=Label(text=f'Failed to fetch resources: {str(e)}'), size_hint=(0.8, 0.3))
+            popup = Popup(title='Error', content=Label(text=f'Failed to fetch resources: {str(e)}'),
+                          size_hint=(0.8, 0.3))
             popup.open()
+        if legal_resources.normalize_state(self.state_input_legal.text.strip() or state) == \
+                legal_resources.normalize_state(state):
+            self.show_legal_resources(state)
+
+    def update_diagnostics_toggle(self):
+        self.diagnostics_toggle.text = 'Stop Timing' if diagnostics.enabled() else 'Start Timing'
+
+    def toggle_diagnostics(self, instance):
+        if diagnostics.enabled():
+            diagnostics.configure(False)
+        else:
+            self.apply_diagnostics()
+        self.update_diagnostics_toggle()
+        self.show_diagnostics()
+
+    def toggle_memory(self, instance):
+        on = instance.text.endswith('off')
+        instance.text = f"Memory: {'on' if on else 'off'}"
+
+    def apply_diagnostics(self):
+        # tracemalloc follows the same operations as the profiler, or all of them.
+        profile = [part.strip() for part in self.profile_input.text.split(',') if part.strip()]
+        memory = (profile or ['*']) if self.memory_check.text.endswith('on') else []
+        diagnostics.configure(True, profile=profile, memory=memory)
+        self.update_diagnostics_toggle()
+
+    def clear_diagnostics(self, instance):
+        diagnostics.clear()
+        self.show_diagnostics()
+
+    def show_diagnostics(self):
+        if not diagnostics.recent():
+            text = 'No operations recorded yet.' if diagnostics.enabled() else \
+                'Timing is off. Press Start Timing, then use the app.'
+            self.diagnostics_output.show(pages.fixed([{'text': text}]))
+            return
+        rows = [{'text': line} for line in diagnostics.format_summary(diagnostics.summary())]
+        rows.append({'text': 'Recent operations (tap for details):'})
+        for record in diagnostics.recent(100):
+            text = f"{record['start'][11:19]}  {record['op']}  {record['ms']:.1f} ms"
+            if 'error' in record:
+                text += f"  FAILED: {record['error']}"
+            rows.append({'text': text, 'record': record})
+        self.diagnostics_output.show(pages.fixed(rows))
+
+    def open_diagnostic(self, row):
+        import json
+
+        record = row.get('record')
+        if not record:
+            return
+        details = {key: value for key, value in record.items() if key != 'profile'}
+        text = json.dumps(details, indent=2)
+        if 'profile' in record:
+            text += '\n\n' + record['profile']
+        popup = Popup(title=f"{record['op']} ({record['ms']:.1f} ms)", content=TextInput(text=text, readonly=True),
+                      size_hint=(0.9, 0.9))
+        popup.open()
 
     def generate_timeline(self, instance):
-        c = self.conn.cursor()
-        c.execute('SELECT event_date, description, event_type FROM events WHERE case_id=? ORDER BY event_date', 
-                  (self.current_case_id,))
-        events = c.fetchall()
-        timeline = '\n'.join([f"{row[0]}: {row[2]} - {row[1]}" for row in events])
-        self.report_output.text = f"Timeline:\n{timeline}"
-        c = canvas.Canvas('timeline.pdf', pagesize=letter)
-        c.drawString(100, 750, "Case Timeline")
-        y = 700
-        for line in timeline.split('\n'):
-            c.drawString(100, y, line)
-            y -= 20
-        c.save()
-        self.upload_to_drive('timeline.pdf', 'timeline.pdf')
-        popup = Popup(title='Success', content=Label(text='Timeline generated as timeline.pdf'), size_hint=(0.8, 0.3))
+        case_id = self.current_case_id
+
+        def events(after):
+            rows, after = pages.timeline_page(self.conn, case_id, after)
+            return [{'text': f"{row[1]}: {row[2]} - {row[3]}", 'source': 'events', 'source_id': row[0]}
+                    for row in rows], after
+        self.report_output.show(pages.chain([pages.fixed([{'text': 'Timeline:'}]), events]))
+        path = reports.report_path(case_id, reports.TIMELINE_PDF)
+        self.run_report(lambda conn: service.timeline_report(conn, case_id, path), case_id, path)
+
+    def run_report(self, render, case_id, path, popup=None):
+        # Rows are streamed into the PDF on a worker thread with its own connection.
+        password, db_path = self.db_password, self.db_path
+
+        def run():
+            conn = db.connect(password, db_path)
+            try:
+                result = render(conn)
+            except Exception as e:
+                result = e
+            finally:
+                conn.close()
+            Clock.schedule_once(lambda dt: self.finish_report(result, case_id, path, popup))
+        threading.Thread(target=run, daemon=True).start()
+
+    def finish_report(self, result, case_id, path, popup):
+        if popup:
+            popup.dismiss()
+        if isinstance(result, Exception):
+            popup = Popup(title='Error', content=Label(text=f'Report failed: {result}'), size_hint=(0.8, 0.3))
+            popup.open()
+            return
+        # Queued under the case that is open now, so skip it if the user has switched since.
+        if case_id == self.current_case_id:
+            self.upload_to_drive(path, os.path.basename(path))
+        popup = Popup(title='Success', content=Label(text=f'Report generated as {path} ({result.pages} pages)'),
+                      size_hint=(0.8, 0.3))
         popup.open()
 
     def generate_custom_report(self, instance):
@@ -659,67 +1134,72 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_custom_report(self, report_type, popup):
-        c = self.conn.cursor()
-        report_content = []
-        if 'document' in report_type.lower():
-            c.execute('SELECT doc_name, doc_date, content FROM documents WHERE case_id=?', (self.current_case_id,))
-            report_content.extend([f"Document: {row[0]} ({row[1]}): {row[2][:50]}..." for row in c.fetchall()])
-        if 'text' in report_type.lower():
-            c.execute('SELECT msg_date, content FROM text_messages WHERE case_id=?', (self.current_case_id,))
-            report_content.extend([f"Message: {row[0]}: {row[1][:50]}..." for row in c.fetchall()])
-        if 'email' in report_type.lower():
-            c.execute('SELECT email_date, subject, content FROM emails WHERE case_id=?', (self.current_case_id,))
-            report_content.extend([f"Email: {row[0]} ({row[1]}): {row[2][:50]}..." for row in c.fetchall()])
-        report_text = '\n'.join(report_content)
-        self.report_output.text = f"Custom Report ({report_type}):\n{report_text}"
-        c = canvas.Canvas('custom_report.pdf', pagesize=letter)
-        c.drawString(100, 750, f"Custom Report: {report_type}")
-        y = 700
-        for line in report_text.split('\n'):
-            c.drawString(100, y, line)
-            y -= 20
-        c.save()
-        self.upload_to_drive('custom_report.pdf', 'custom_report.pdf')
-        popup.dismiss()
-        popup = Popup(title='Success', content=Label(text='Report generated as custom_report.pdf'), size_hint=(0.8, 0.3))
+        case_id = self.current_case_id
+        # Same sections as the PDF, listed a page at a time.
+        fetchers = [pages.fixed([{'text': f"Custom Report ({report_type}):"}])]
+        kinds = report_type.lower()
+        if 'document' in kinds:
+            fetchers += [pages.fixed([{'text': 'Documents'}]),
+                         self.dated_rows('documents', 'doc_id', ('doc_name', 'doc_date', 'substr(content, 1, 300)'),
+                                         case_id, "Document: {1} ({2}): {3}")]
+        if 'text' in kinds:
+            fetchers += [pages.fixed([{'text': 'Text Messages'}]),
+                         self.dated_rows('text_messages', 'msg_id', ('msg_date', 'substr(content, 1, 300)'),
+                                         case_id, "Message: {1}: {2}")]
+        if 'email' in kinds:
+            fetchers += [pages.fixed([{'text': 'Emails'}]),
+                         self.dated_rows('emails', 'email_id', ('email_date', 'subject', 'substr(content, 1, 300)'),
+                                         case_id, "Email: {1} ({2}): {3}")]
+        self.report_output.show(pages.chain(fetchers))
+        path = reports.report_path(case_id, reports.CUSTOM_REPORT_PDF)
+        self.run_report(lambda conn: service.custom_report(conn, case_id, report_type, path), case_id, path, popup)
+
+    def dated_rows(self, table, id_col, columns, case_id, text):
+        def fetch(after):
+            rows, after = pages.dated_page(self.conn, table, id_col, columns, case_id, after)
+            return [{'text': text.format(*row), 'source': table, 'source_id': row[0]} for row in rows], after
+        return fetch
+
+    def need_llm(self):
+        # Opening a case doesn't require an API key; the AI features do.
+        if self.llm:
+            return False
+        popup = Popup(title='Error', content=Label(text='Enter an API key, then open or create a case.'),
+                      size_hint=(0.8, 0.3))
         popup.open()
+        return True
 
     def detect_lies_patterns(self, instance):
-        c = self.conn.cursor()
-        c.execute('SELECT content FROM documents WHERE case_id=?', (self.current_case_id,))
-        docs = [row[0] for row in c.fetchall()]
-        c.execute('SELECT content FROM text_messages WHERE case_id=?', (self.current_case_id,))
-        texts = [row[0] for row in c.fetchall()]
-        c.execute('SELECT content FROM emails WHERE case_id=?', (self.current_case_id,))
-        emails = [row[0] for row in c.fetchall()]
-        c.execute('SELECT transcription FROM audio_recordings WHERE case_id=?', (self.current_case_id,))
-        audios = [row[0] for row in c.fetchall()]
-        all_content = docs + texts + emails + audios
-        # Compute joined content outside f-string
-        content_text = '\n'.join(all_content)
-        prompt = f"Analyze the following evidence for inconsistencies or lies:\n{content_text}\nProvide a report."
+        if self.need_llm():
+            return
+        on_token = self.stream_to_report("Lie Detection Report:\n")
+        threading.Thread(target=self.run_lie_detection, args=(self.current_case_id, on_token), daemon=True).start()
+
+    def run_lie_detection(self, case_id, on_token):
+        # Own connection: the map-reduce runs off the UI thread.
+        conn = db.connect(self.db_password, self.db_path)
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            report = response.choices[0].message.content
+            report = analysis.detect_lies(conn, case_id, self.llm, on_token=on_token)
         except Exception as e:
             report = f"Error in lie detection: {str(e)}"
-        self.report_output.text = f"Lie Detection Report:\n{report}"
-        c = canvas.Canvas('lie_detection.pdf', pagesize=letter)
-        c.drawString(100, 750, "Lie Detection Report")
-        y = 700
-        for line in report.split('\n'):
-            c.drawString(100, y, line)
-            y -= 20
-        c.save()
-        self.upload_to_drive('lie_detection.pdf', 'lie_detection.pdf')
-        popup = Popup(title='Success', content=Label(text='Lie detection report generated as lie_detection.pdf'), size_hint=(0.8, 0.3))
+        finally:
+            conn.close()
+        Clock.schedule_once(lambda dt: self.finish_lie_detection(case_id, report))
+
+    def finish_lie_detection(self, case_id, report):
+        self.report_output.show_text(f"Lie Detection Report:\n{report}")
+        path = reports.report_path(case_id, reports.LIE_DETECTION_PDF)
+        rendered = reports.render(path, 'Lie Detection Report',
+                                  [reports.Section('Findings', report.split('\n'))], new_page_per_section=False)
+        if case_id == self.current_case_id:
+            self.upload_to_drive(path, os.path.basename(path))
+        popup = Popup(title='Success', content=Label(text=f'Lie detection report generated as {path} '
+                                                          f'({rendered.pages} pages)'), size_hint=(0.8, 0.3))
         popup.open()
 
     def draft_motion(self, instance):
+        if self.need_llm():
+            return
         content = BoxLayout(orientation='vertical')
         motion_type = TextInput(hint_text='Motion Type (e.g., Motion to Oppose Adoption)', size_hint_y=None, height=50)
         content.add_widget(motion_type)
@@ -730,36 +1210,39 @@ class CaseManagerApp(App):
         popup.open()
 
     def process_motion(self, motion_type, popup):
-        c = self.conn.cursor()
-        c.execute('SELECT content FROM documents WHERE case_id=?', (self.current_case_id,))
-        docs = [row[0] for row in c.fetchall()]
-        c.execute('SELECT content FROM text_messages WHERE case_id=?', (self.current_case_id,))
-        texts = [row[0] for row in c.fetchall()]
-        c.execute('SELECT content FROM emails WHERE case_id=?', (self.current_case_id,))
-        emails = [row[0] for row in c.fetchall()]
-        c.execute('SELECT description FROM pre_case_context WHERE case_id=?', (self.current_case_id,))
-        context = [row[0] for row in c.fetchall()]
-        all_content = docs + texts + emails + context
-        # Compute joined content outside f-string
-        content_text = '\n'.join(all_content)
-        prompt = f"Draft a legal motion for a child welfare case in {self.state}: {motion_type}\nEvidence:\n{content_text}\nInclude relevant legal citations."
+        # Only the passages most relevant to this motion are sent, each with a ref
+        # the model cites so the draft can be traced back to the evidence.
+        case_id = self.current_case_id
+        passages = retrieval.retrieve(self.conn, case_id, motion_type)
+        evidence = retrieval.format_passages(passages)
+        prompt = (f"Draft a legal motion for a child welfare case in {self.state}: {motion_type}\n"
+                  f"Evidence (cite the bracketed refs, e.g. [D12 p.3], when relying on an item):\n{evidence}\n"
+                  f"Include relevant legal citations.")
+        popup.dismiss()
+        future = self.llm.submit(prompt, on_token=self.stream_to_report("Motion Draft:\n"))
+        future.add_done_callback(
+            lambda f: Clock.schedule_once(lambda dt: self.finish_motion(case_id, motion_type, passages, f)))
+
+    def finish_motion(self, case_id, motion_type, passages, future):
+        from docx import Document
+
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            motion = response.choices[0].message.content
+            motion = future.result()
         except Exception as e:
             motion = f"Error drafting motion: {str(e)}"
         doc = Document()
         doc.add_heading(motion_type, 0)
         doc.add_paragraph(motion)
-        doc.save('motion.docx')
-        self.upload_to_drive('motion.docx', 'motion.docx')
-        self.report_output.text = f"Motion Draft:\n{motion}"
-        popup.dismiss()
-        popup = Popup(title='Success', content=Label(text='Motion drafted as motion.docx'), size_hint=(0.8, 0.3))
+        if passages:
+            doc.add_heading('Evidence Referenced', 1)
+            for p in passages:
+                doc.add_paragraph(f"[{p.ref}] {p.date} {p.title}".strip(), style='List Bullet')
+        path = reports.report_path(case_id, reports.MOTION_DOCX)
+        doc.save(path)
+        if case_id == self.current_case_id:
+            self.upload_to_drive(path, os.path.basename(path))
+        self.report_output.show_text(f"Motion Draft:\n{motion}")
+        popup = Popup(title='Success', content=Label(text=f'Motion drafted as {path}'), size_hint=(0.8, 0.3))
         popup.open()
 
 if __name__ == '__main__':
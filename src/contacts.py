@@ -0,0 +1,316 @@
+import argparse
+import difflib
+import getpass
+import os
+import re
+import unicodedata
+
+import db
+
+# Two names are the same person when their given names are equal (or one is
+# the other's initial) and the rest of the names are more similar than this
+# (difflib ratio), e.g. "Jane Smyth" and "Jane Smith" or "J. Smith" and
+# "Jane Smith", but never "Mark Jones" and "Mary Jones".
+FUZZY_THRESHOLD = 0.75
+
+_EMAIL = re.compile(r'[\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+')
+_PHONE = re.compile(r'\+?[\d\s().\-]{7,}')
+# 'Jane Smith <+1 555-123-4567>', as the message importers write senders.
+_BRACKETED_PHONE = re.compile(r'<(\+?[\d\s().\-]{7,})>\s*$')
+_BRACKETED = re.compile(r'\([^)]*\)|\[[^\]]*\]|<[^>]*>')
+_HONORIFICS = {'mr', 'mrs', 'ms', 'miss', 'dr', 'jr', 'sr', 'ii', 'iii', 'esq'}
+
+
+def normalize_name(name):
+    """'Smith, Jane (DCS)' and 'jane  smith' both become 'jane smith'."""
+    name = _BRACKETED.sub(' ', name or '')
+    parts = [part.strip() for part in name.split(',')]
+    if len(parts) == 2 and all(parts) and ' ' not in parts[0]:
+        name = f'{parts[1]} {parts[0]}'
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    words = re.sub(r'[^a-z0-9]+', ' ', name).split()
+    return ' '.join(word for word in words if word not in _HONORIFICS)
+
+
+def normalize_email(email):
+    """Lower-case and drop any +tag: 'Jane.Smith+court@DCS.gov' -> 'jane.smith@dcs.gov'."""
+    email = (email or '').strip().lower()
+    if '@' not in email:
+        return ''
+    local, domain = email.rsplit('@', 1)
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def normalize_phone(phone):
+    """Digits only, without a US country code; '' if it's too short to be a number."""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits if len(digits) >= 7 else ''
+
+
+def parse(text):
+    """Split a sender/recipient as it appears in a message into (name, email, phone).
+
+    Handles 'Jane Smith <jane@dcs.gov>', 'Jane Smith <555-123-4567>', a bare
+    address or number, and plain names. A bare address like jane.smith@dcs.gov also yields the name
+    'jane smith' so it can be matched against contacts entered by name.
+    """
+    text = (text or '').strip()
+    email = ''
+    match = _EMAIL.search(text)
+    if match:
+        email = match.group(0)
+        name = _BRACKETED.sub(' ', text.replace(email, ' ')).strip(' "\'')
+        if not name:
+            words = re.split(r'[._\-]+', email.split('@')[0].split('+')[0])
+            if len(words) > 1 and all(word.isalpha() for word in words):
+                name = ' '.join(words)
+        return name, email, ''
+    if _PHONE.fullmatch(text) and normalize_phone(text):
+        return '', '', text
+    match = _BRACKETED_PHONE.search(text)
+    if match and normalize_phone(match.group(1)):
+        return text[:match.start()].strip(' "\''), '', match.group(1).strip()
+    return text, '', ''
+
+
+class ContactIndex:
+    """Contacts keyed by normalized name, email and phone for matching in memory.
+
+    Names that don't match exactly are compared with the names sharing a word
+    with them: the given names have to agree and the rest of the names be
+    more similar than ``threshold``, unless the two have different numbers or
+    addresses. A name close to two different contacts matches neither.
+    """
+
+    def __init__(self, threshold=FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.by_name = {}
+        self.by_email = {}
+        self.by_phone = {}
+        self.by_word = {}
+        # contact_id: [email, phone], normalized; the first of each we saw.
+        self.details = {}
+
+    def add(self, contact_id, name, email='', phone=''):
+        """Index a contact; details already taken by another contact are ignored.
+
+        A name of None adds only the email and phone.
+        """
+        parsed_name, parsed_email, parsed_phone = parse(name)
+        key = normalize_name(parsed_name)
+        # A bare number or address has no name to match on.
+        if name is not None and (key or not (parsed_email or parsed_phone)) and key not in self.by_name:
+            self.by_name[key] = contact_id
+            for word in set(key.split()):
+                self.by_word.setdefault(word, []).append(key)
+        known = self.details.setdefault(contact_id, ['', ''])
+        email = normalize_email(email or parsed_email)
+        if email:
+            self.by_email.setdefault(email, contact_id)
+            known[0] = known[0] or email
+        phone = normalize_phone(phone or parsed_phone)
+        if phone:
+            self.by_phone.setdefault(phone, contact_id)
+            known[1] = known[1] or phone
+
+    def match(self, name='', email='', phone=''):
+        """Return the contact_id for these details, or None."""
+        email, phone = normalize_email(email), normalize_phone(phone)
+        if email in self.by_email:
+            return self.by_email[email]
+        if phone in self.by_phone:
+            return self.by_phone[phone]
+        key = normalize_name(name)
+        if key in self.by_name:
+            return self.by_name[key]
+        return self._fuzzy(key, email, phone)
+
+    def _fuzzy(self, key, email, phone):
+        # Only full names are compared; "Jane" alone could be anyone. Numbers
+        # in names ("Foster Parent 2") have to match exactly.
+        words = key.split()
+        if len(words) < 2:
+            return None
+        numbers = [word for word in words if word.isdigit()]
+        candidates = {other for word in words for other in self.by_word.get(word, ())}
+        for other in sorted(candidates):
+            if sorted(words) == sorted(other.split()) and not self._conflicts(self.by_name[other], email, phone):
+                return self.by_name[other]
+        # As in difflib.get_close_matches: the cheap upper bounds rule out most
+        # candidates before the full ratio is computed.
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(' '.join(words[1:]))
+        best, best_ratio = set(), self.threshold
+        for other in sorted(candidates):
+            other_words = other.split()
+            if len(other_words) < 2 or [word for word in other_words if word.isdigit()] != numbers or \
+                    not _same_given_name(words[0], other_words[0]) or \
+                    self._conflicts(self.by_name[other], email, phone):
+                continue
+            matcher.set_seq1(' '.join(other_words[1:]))
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                best, best_ratio = {self.by_name[other]}, ratio
+            elif ratio == best_ratio and best:
+                best.add(self.by_name[other])
+        return best.pop() if len(best) == 1 else None
+
+    def _conflicts(self, contact_id, email, phone):
+        known_email, known_phone = self.details.get(contact_id, ('', ''))
+        return bool(email and known_email and email != known_email or phone and known_phone and phone != known_phone)
+
+
+def _same_given_name(word, other):
+    # A typo in a given name is as likely another person ("Mark"/"Mary"), so
+    # only an initial stands in for it.
+    return word == other or (len(word) == 1 or len(other) == 1) and word[0] == other[0]
+
+
+class ContactResolver(ContactIndex):
+    """Maps the senders and recipients of one case's messages to contact ids.
+
+    The case's contacts are read once, so resolving a sender is a lookup
+    rather than a query; a miss inserts an 'Unknown' contact and indexes it.
+    Contacts inserted elsewhere should be passed to add().
+
+    The caller commits, unless ``commit`` is set: then each new contact or
+    learned address is committed at once, so an importer that batches its
+    own rows doesn't hold a write transaction open between batches.
+    """
+
+    def __init__(self, conn, case_id, threshold=FUZZY_THRESHOLD, commit=False):
+        super().__init__(threshold)
+        self.conn = conn
+        self.case_id = case_id
+        self.commit = commit
+        self.seen = {}
+        c = conn.cursor()
+        c.execute('SELECT contact_id, name, email, phone FROM contacts WHERE case_id=? ORDER BY contact_id',
+                  (case_id,))
+        for contact_id, name, email, phone in c.fetchall():
+            self.add(contact_id, name, email, phone)
+
+    def resolve(self, text, role='Unknown'):
+        """Return the contact_id for a sender/recipient, creating the contact if it's new."""
+        if text in self.seen:
+            return self.seen[text]
+        name, email, phone = parse(text)
+        contact_id = self.match(name, email, phone)
+        if contact_id is None:
+            c = self.conn.cursor()
+            c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)',
+                      (self.case_id, name or text, email, phone, role))
+            contact_id = c.lastrowid
+            if self.commit:
+                self.conn.commit()
+            self.add(contact_id, name or text, email, phone)
+        else:
+            self._learn(contact_id, email, phone)
+        self.seen[text] = contact_id
+        return contact_id
+
+    def _learn(self, contact_id, email, phone):
+        # Fill in an address or number the contact didn't have, so later
+        # messages from it match without relying on the name.
+        known_email, known_phone = self.details.get(contact_id, ('', ''))
+        email = '' if known_email or not normalize_email(email) else email
+        phone = '' if known_phone or not normalize_phone(phone) else phone
+        if not email and not phone:
+            return
+        c = self.conn.cursor()
+        c.execute("UPDATE contacts SET email=CASE WHEN ?!='' THEN ? ELSE email END, "
+                  "phone=CASE WHEN ?!='' THEN ? ELSE phone END WHERE contact_id=?",
+                  (email, email, phone, phone, contact_id))
+        if self.commit:
+            self.conn.commit()
+        self.add(contact_id, None, email, phone)
+
+
+def find_duplicates(conn, case_id, threshold=FUZZY_THRESHOLD):
+    """Group a case's contacts that match each other.
+
+    Each group starts with the contact to keep: one added by hand (a role
+    other than 'Unknown') if there is one, otherwise the oldest.
+    """
+    c = conn.cursor()
+    c.execute('SELECT contact_id, name, email, phone, role FROM contacts WHERE case_id=? ORDER BY contact_id',
+              (case_id,))
+    index = ContactIndex(threshold)
+    groups = {}
+    for contact_id, name, email, phone, role in c.fetchall():
+        parsed_name, parsed_email, parsed_phone = parse(name)
+        same = index.match(parsed_name, email or parsed_email, phone or parsed_phone)
+        if same is None:
+            same = contact_id
+            groups[same] = []
+        groups[same].append((role in (None, '', 'Unknown'), contact_id))
+        # Index every variant under the group's first contact so a third can match through it.
+        index.add(same, name, email, phone)
+    return [[contact_id for _, contact_id in sorted(group)] for group in groups.values() if len(group) > 1]
+
+
+def merge(conn, keep_id, duplicate_ids):
+    """Point messages and emails at keep_id, copy over details it lacks and delete the duplicates."""
+    if not duplicate_ids:
+        return
+    c = conn.cursor()
+    marks = ','.join('?' * len(duplicate_ids))
+    for table in ('text_messages', 'emails'):
+        for column in ('sender_id', 'recipient_id'):
+            c.execute(f'UPDATE {table} SET {column}=? WHERE {column} IN ({marks})', (keep_id, *duplicate_ids))
+    c.execute(f'SELECT contact_id, email, phone, role FROM contacts WHERE contact_id IN (?, {marks})',
+              (keep_id, *duplicate_ids))
+    rows = sorted(c.fetchall(), key=lambda row: row[0] != keep_id)
+    email, phone, role = (next((value for value in values if value not in (None, '', 'Unknown')), values[0])
+                          for values in list(zip(*rows))[1:])
+    c.execute('UPDATE contacts SET email=?, phone=?, role=? WHERE contact_id=?', (email, phone, role, keep_id))
+    c.execute(f'DELETE FROM contacts WHERE contact_id IN ({marks})', duplicate_ids)
+
+
+def describe(conn, group):
+    """'Jane Smith jane@dcs.gov = J. Smith 555-123-4567', the contacts of a group in order."""
+    c = conn.cursor()
+    c.execute(f"SELECT contact_id, name, email, phone FROM contacts WHERE contact_id IN ({','.join('?' * len(group))})",
+              group)
+    rows = {row[0]: row[1:] for row in c.fetchall()}
+    return ' = '.join(' '.join(part for part in rows[contact_id] if part) for contact_id in group if contact_id in rows)
+
+
+def merge_groups(conn, groups):
+    """Merge each group (as from find_duplicates) into its first contact; return (groups, contacts removed)."""
+    for group in groups:
+        merge(conn, group[0], group[1:])
+    conn.commit()
+    return len(groups), sum(len(group) - 1 for group in groups)
+
+
+def merge_duplicates(conn, case_id, threshold=FUZZY_THRESHOLD):
+    """Merge every group of duplicates into one contact; return (groups, contacts removed)."""
+    return merge_groups(conn, find_duplicates(conn, case_id, threshold))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge a case's duplicate contacts.")
+    parser.add_argument('--case-id', type=int, required=True)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--threshold', type=float, default=FUZZY_THRESHOLD)
+    parser.add_argument('--dry-run', action='store_true', help='list the groups without merging')
+    args = parser.parse_args(argv)
+    password = os.environ.get('CASE_MANAGER_PASSWORD') or getpass.getpass('Database password: ')
+    conn = db.connect(password, args.db)
+    db.init_schema(conn)
+    if args.dry_run:
+        for group in find_duplicates(conn, args.case_id, args.threshold):
+            print(describe(conn, group))
+    else:
+        groups, removed = merge_duplicates(conn, args.case_id, args.threshold)
+        print(f'Merged {removed} duplicate contacts into {groups}.')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
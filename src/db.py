@@ -0,0 +1,463 @@
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+
+import pysqlcipher3.dbapi2 as sqlcipher
+
+import analysis
+import attachments
+import drive_sync
+import evidence_store
+import ingest
+import legal_resources
+import llm
+import pdf_pages
+import retrieval
+import search_index
+import transcription
+import video
+
+DB_PATH = 'case_manager.db'
+# Negative cache_size is in KiB. SQLCipher decrypts every page it reads, so a
+# bigger page cache saves more than it would on plain SQLite.
+CACHE_KIB = 64 * 1024
+# Seconds a connection waits for another writer before "database is locked".
+BUSY_TIMEOUT = 30
+READERS = 4
+# Separate case databases, relative to the main database's folder.
+CASE_DIR = 'cases'
+SALT_BYTES = 16
+KEY_BYTES = 32
+# cipher_default_kdf_algorithm values; SQLCipher 3 has no such pragma and uses SHA1.
+_KDF_HASHES = {'PBKDF2_HMAC_SHA512': 'sha512', 'PBKDF2_HMAC_SHA256': 'sha256', 'PBKDF2_HMAC_SHA1': 'sha1'}
+
+# (table, id column, free-text date column) for the sort_date migration.
+DATED_TABLES = [
+    ('documents', 'doc_id', 'doc_date'),
+    ('audio_recordings', 'audio_id', 'audio_date'),
+    ('text_messages', 'msg_id', 'msg_date'),
+    ('emails', 'email_id', 'email_date'),
+    ('events', 'event_id', 'event_date'),
+    ('calendar_events', 'cal_id', 'event_date'),
+    ('pre_case_context', 'context_id', 'context_date'),
+]
+
+_ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?$')
+
+# (database path, salt, password digest): the hex key SQLCipher derives for
+# it, or None if it couldn't be reproduced and the passphrase is used.
+_raw_keys = {}
+_raw_keys_lock = threading.Lock()
+
+
+def connect(password, path=DB_PATH, check_same_thread=True, timeout=5.0):
+    # A passphrase makes SQLCipher run its key derivation (256,000 PBKDF2
+    # rounds in version 4) on every connection. The first connection to a
+    # database derives the same key here; later ones pass it as a raw key,
+    # so each database pays for the KDF once per session.
+    conn = sqlcipher.connect(path, check_same_thread=check_same_thread, timeout=timeout)
+    cache_key = _key_cache_key(password, path)
+    with _raw_keys_lock:
+        cached = cache_key in _raw_keys
+        raw_key = _raw_keys.get(cache_key)
+    if cache_key and not cached:
+        raw_key = _derive_key(conn, password, cache_key[1])
+    if raw_key:
+        conn.execute(f'PRAGMA key = "x\'{raw_key}\'"')
+        if not cached and not _readable(conn):
+            # A wrong password, or a build deriving keys differently: the passphrase decides.
+            conn.close()
+            conn = sqlcipher.connect(path, check_same_thread=check_same_thread, timeout=timeout)
+            raw_key = None
+    if not raw_key:
+        conn.execute("PRAGMA key = '{}'".format(password.replace("'", "''")))
+    # WAL lets the ingest, import and LLM cache connections read while one writes;
+    # NORMAL only syncs at checkpoints, which is safe in WAL mode.
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_KIB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    if cache_key and not cached:
+        # Only reached with the right password: the journal_mode pragma reads the database.
+        with _raw_keys_lock:
+            _raw_keys[cache_key] = raw_key
+    return conn
+
+
+def _key_cache_key(password, path):
+    # None until the database has a salt on disk (a new one gets it at the first checkpoint).
+    try:
+        with open(path, 'rb') as f:
+            salt = f.read(SALT_BYTES)
+    except OSError:
+        return None
+    if len(salt) < SALT_BYTES:
+        return None
+    return os.path.realpath(path), salt, hashlib.sha256(password.encode()).digest()
+
+
+def _derive_key(conn, password, salt):
+    # The KDF settings SQLCipher applies to a new connection. Plain SQLite has
+    # no such pragmas and returns no rows.
+    c = conn.cursor()
+    c.execute('PRAGMA cipher_default_kdf_iter')
+    iterations = c.fetchone()
+    if not iterations:
+        return None
+    c.execute('PRAGMA cipher_default_kdf_algorithm')
+    algorithm = c.fetchone()
+    name = _KDF_HASHES.get(algorithm[0]) if algorithm else 'sha1'
+    if not name:
+        return None
+    return hashlib.pbkdf2_hmac(name, password.encode(), salt, int(iterations[0]), KEY_BYTES).hex()
+
+
+def _readable(conn):
+    try:
+        conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        return True
+    except sqlcipher.DatabaseError:
+        return False
+
+
+class ConnectionPool:
+    """One writer and up to ``readers`` reader connections to one database, shared by threads.
+
+    WAL readers never wait for the writer, so searches and reports keep
+    working during an import. Writes go through the single writer
+    connection, one thread at a time: write() holds its lock, commits when
+    the block ends and rolls back if it raises. The writer begins its
+    transactions IMMEDIATE, so a write from another process (the app, a bulk
+    import) makes it wait up to BUSY_TIMEOUT instead of failing on a stale
+    snapshot. Reader connections are query_only.
+    """
+
+    def __init__(self, password, path=DB_PATH, readers=READERS, timeout=BUSY_TIMEOUT):
+        self.password = password
+        self.path = path
+        self.readers = readers
+        self.timeout = timeout
+        self.writer = connect(password, path, check_same_thread=False, timeout=timeout)
+        self.writer.isolation_level = 'IMMEDIATE'
+        self.write_lock = threading.RLock()
+        self.depth = 0
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    @contextlib.contextmanager
+    def write(self):
+        with self.write_lock:
+            self.depth += 1
+            try:
+                yield self.writer
+            except BaseException:
+                if self.depth == 1:
+                    self.writer.rollback()
+                raise
+            else:
+                # Nested write() blocks commit with the outermost one.
+                if self.depth == 1:
+                    self.writer.commit()
+            finally:
+                self.depth -= 1
+
+    def run_write(self, fn):
+        """Run fn() under the write lock; a ``schedule`` for ingest.IngestQueue."""
+        with self.write():
+            fn()
+
+    @contextlib.contextmanager
+    def read(self):
+        conn = self._reader()
+        try:
+            yield conn
+        finally:
+            # Ends any read transaction so the WAL can be checkpointed past it.
+            conn.rollback()
+            self.idle.put(conn)
+
+    def _reader(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.opened) < self.readers:
+                conn = connect(self.password, self.path, check_same_thread=False, timeout=self.timeout)
+                conn.execute('PRAGMA query_only = ON')
+                self.opened.append(conn)
+                return conn
+        return self.idle.get()
+
+    def close(self):
+        with self.write_lock, self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+            self.writer.close()
+
+
+def case_path(main_path, case_file):
+    """Where a case's own database is; cases.db_path is relative to the main database's folder."""
+    return os.path.join(os.path.dirname(os.path.abspath(main_path)), case_file)
+
+
+def normalize_date(text):
+    """Return a sortable 'YYYY-MM-DD[ HH:MM:SS]' for free-text dates, or None."""
+    text = (text or '').strip()
+    if _ISO_DATE.match(text):
+        return text
+    from dateutil.parser import parse
+    try:
+        value = parse(text)
+    except (ValueError, OverflowError):
+        return None
+    if value.hour or value.minute or value.second:
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value.strftime('%Y-%m-%d')
+
+
+def init_schema(conn):
+    create_tables(conn)
+    migrate(conn)
+    # Last: the index triggers reference the tables above.
+    search_index.ensure_index(conn)
+    conn.commit()
+
+
+def create_tables(conn):
+    """Create the version 0 schema; later changes are made by MIGRATIONS."""
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS cases (
+        case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_name TEXT,
+        state TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS contacts (
+        contact_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        name TEXT,
+        email TEXT,
+        phone TEXT,
+        role TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS documents (
+        doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        doc_name TEXT,
+        file_path TEXT,
+        content TEXT,
+        doc_date TEXT,
+        category TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS audio_recordings (
+        audio_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        audio_name TEXT,
+        file_path TEXT,
+        transcription TEXT,
+        audio_date TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS text_messages (
+        msg_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        msg_date TEXT,
+        sender_id INTEGER,
+        recipient_id INTEGER,
+        content TEXT,
+        is_image INTEGER,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id),
+        FOREIGN KEY(sender_id) REFERENCES contacts(contact_id),
+        FOREIGN KEY(recipient_id) REFERENCES contacts(contact_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS emails (
+        email_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        email_date TEXT,
+        sender_id INTEGER,
+        recipient_id INTEGER,
+        subject TEXT,
+        content TEXT,
+        is_image INTEGER,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id),
+        FOREIGN KEY(sender_id) REFERENCES contacts(contact_id),
+        FOREIGN KEY(recipient_id) REFERENCES contacts(contact_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        event_date TEXT,
+        description TEXT,
+        event_type TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS calendar_events (
+        cal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        event_date TEXT,
+        title TEXT,
+        description TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS pre_case_context (
+        context_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        description TEXT,
+        context_date TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    ingest.ensure_schema(conn)
+    evidence_store.ensure_schema(conn)
+    attachments.ensure_schema(conn)
+    transcription.ensure_schema(conn)
+    video.ensure_schema(conn)
+    pdf_pages.ensure_schema(conn)
+    analysis.ensure_schema(conn)
+    llm.ensure_schema(conn)
+    retrieval.ensure_schema(conn)
+    drive_sync.ensure_schema(conn)
+    legal_resources.ensure_schema(conn)
+
+
+def _add_indexes(conn):
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS contacts_case_name ON contacts(case_id, name)')
+    c.execute('CREATE INDEX IF NOT EXISTS document_pages_doc ON document_pages(doc_id, page_no)')
+    c.execute('CREATE INDEX IF NOT EXISTS audio_segments_audio ON audio_segments(audio_id, start_time)')
+    c.execute('CREATE INDEX IF NOT EXISTS ingest_jobs_status ON ingest_jobs(status, job_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS ingest_jobs_case ON ingest_jobs(case_id, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache(last_used)')
+
+
+def _add_sort_dates(conn, batch_size=10000):
+    # Refresh the index triggers first so the backfill below doesn't reindex every row.
+    search_index.ensure_index(conn)
+    c = conn.cursor()
+    for table, id_col, date_col in DATED_TABLES:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN sort_date TEXT')
+        last_id = 0
+        while True:
+            c.execute(f'SELECT {id_col}, {date_col} FROM {table} WHERE {id_col} > ? ORDER BY {id_col} LIMIT ?',
+                      (last_id, batch_size))
+            rows = c.fetchall()
+            if not rows:
+                break
+            c.executemany(f'UPDATE {table} SET sort_date = ? WHERE {id_col} = ?',
+                          [(normalize_date(date), row_id) for row_id, date in rows])
+            last_id = rows[-1][0]
+    # Covering indexes for the per-case, date-ordered reads.
+    c.execute('CREATE INDEX IF NOT EXISTS events_case_date '
+              'ON events(case_id, sort_date, event_id, event_date, event_type, description)')
+    c.execute('CREATE INDEX IF NOT EXISTS calendar_events_case_date ON calendar_events(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS documents_case_date ON documents(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS audio_recordings_case_date ON audio_recordings(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS text_messages_case_date ON text_messages(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS emails_case_date ON emails(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS pre_case_context_case_date ON pre_case_context(case_id, sort_date)')
+
+
+def _add_drive_outbox_indexes(conn):
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS drive_outbox_status ON drive_outbox(status, upload_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS drive_outbox_sha256 ON drive_outbox(sha256)')
+
+
+def _add_drive_manifest(conn):
+    c = conn.cursor()
+    # The file's mtime when it was hashed, to tell if it changed under an interrupted upload.
+    c.execute('ALTER TABLE drive_outbox ADD COLUMN mtime_ns INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS drive_outbox_path ON drive_outbox(file_path, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS drive_manifest_file ON drive_manifest(case_id, drive_file_id)')
+
+
+def _add_video_indexes(conn):
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS videos_case_date ON videos(case_id, sort_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS video_segments_video ON video_segments(video_id, start_time)')
+    c.execute('CREATE INDEX IF NOT EXISTS video_thumbnails_video ON video_thumbnails(video_id, time)')
+
+
+def _add_case_files(conn):
+    c = conn.cursor()
+    # A case with its own database file; NULL keeps it in this one. See case_path().
+    c.execute('ALTER TABLE cases ADD COLUMN db_path TEXT')
+
+
+def _reindex_case_ids(conn):
+    # Legal resources were indexed with a NULL case_id and matched every case;
+    # they now go under search_index.SHARED_CASE_ID, and caseless rows are dropped.
+    search_index.ensure_index(conn)
+    search_index.rebuild_index(conn)
+
+
+def _key_index_by_case(conn):
+    # evidence_fts rowids now start with the case id; see search_index.case_rows.
+    search_index.ensure_index(conn)
+    search_index.rebuild_index(conn)
+
+
+def _store_thumbnails(conn):
+    # Video preview frames move to the attachment store: video_thumbnails rows
+    # and cached extractions keep only each image's sha256.
+    c = conn.cursor()
+    c.execute('ALTER TABLE video_thumbnails ADD COLUMN sha256 TEXT')
+    c.execute('SELECT thumbnail_id, time, image FROM video_thumbnails WHERE image IS NOT NULL')
+    for thumbnail_id, time, image in c.fetchall():
+        (_, sha256), = video.save_frames(conn, [(time, bytes(image))])
+        c.execute('UPDATE video_thumbnails SET sha256=?, image=NULL WHERE thumbnail_id=?', (sha256, thumbnail_id))
+    c.execute("SELECT sha256, extracted FROM evidence_files WHERE kind='video' AND extracted IS NOT NULL")
+    for sha256, extracted in c.fetchall():
+        result = json.loads(extracted)
+        frames = [(time, base64.b64decode(image)) for time, image in result.get('thumbnails', [])]
+        result['thumbnails'] = video.save_frames(conn, frames)
+        c.execute('UPDATE evidence_files SET extracted=? WHERE sha256=?', (json.dumps(result), sha256))
+
+
+def _key_index_by_source(conn):
+    # Each source's rows are now a range of their case's; see search_index.source_rows.
+    search_index.ensure_index(conn)
+    search_index.rebuild_index(conn)
+
+
+# Applied in order; PRAGMA user_version records how many have run. Never edit
+# or reorder a released entry, only append.
+MIGRATIONS = [
+    _add_indexes,
+    _add_sort_dates,
+    _add_drive_outbox_indexes,
+    _add_drive_manifest,
+    _add_video_indexes,
+    _add_case_files,
+    _reindex_case_ids,
+    _key_index_by_case,
+    _store_thumbnails,
+    _key_index_by_source,
+]
+
+
+def schema_version(conn):
+    c = conn.cursor()
+    c.execute('PRAGMA user_version')
+    return c.fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Bring the schema up to date, committing after each migration."""
+    version = schema_version(conn)
+    for number, migration in enumerate(migrations[version:], version + 1):
+        migration(conn)
+        conn.cursor().execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+    if version < len(migrations):
+        conn.cursor().execute('ANALYZE')
+        conn.commit()
+    return schema_version(conn)
@@ -0,0 +1,320 @@
+"""Timing spans and counters for the slow paths (imports, search, reports, sync, LLM).
+
+Off unless configure() is called (the app calls configure_from_env()); while
+off, span() hands back one shared no-op context manager and count() returns
+at once, so the calls can stay in hot loops.
+
+The outermost span on a thread (or asyncio task) is an operation, e.g.
+``ingest.document``; spans inside it are its stages (``pdf.extract``,
+``db.commit``), summed by name. count() adds to the running operation's
+counters (bytes, rows, pages, tokens). Each finished operation is written as
+one JSON line to a rotating log and kept in memory for the Diagnostics tab.
+
+cProfile and tracemalloc can be switched on for operations by name prefix;
+only one operation is profiled (and one traced) at a time.
+"""
+import contextlib
+import contextvars
+import datetime
+import functools
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+ENV = 'CASE_MANAGER_DIAGNOSTICS'
+PROFILE_ENV = 'CASE_MANAGER_PROFILE'
+TRACEMALLOC_ENV = 'CASE_MANAGER_TRACEMALLOC'
+LOG_PATH = 'diagnostics.log'
+LOG_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+# Finished operations kept in memory for the Diagnostics tab.
+RECENT = 500
+PROFILE_LINES = 30
+
+_NOOP = contextlib.nullcontext()
+_current = contextvars.ContextVar('diagnostics_operation', default=None)
+_config = None
+_recent = deque(maxlen=RECENT)
+_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_memory_lock = threading.Lock()
+
+
+class _Config:
+    def __init__(self, log_path, profile, memory):
+        # Process pool workers inherit this on fork; only the configuring process records.
+        self.pid = os.getpid()
+        self.profile = tuple(profile)
+        self.memory = tuple(memory)
+        self.logger = None
+        if log_path:
+            self.logger = logging.getLogger('case_manager.diagnostics')
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            handler = RotatingFileHandler(log_path, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+
+def _matches(name, prefixes):
+    return any(prefix == '*' or name.startswith(prefix) for prefix in prefixes)
+
+
+def configure(enabled=True, log_path=LOG_PATH, profile=(), memory=()):
+    """Turn recording on or off.
+
+    profile and memory are operation name prefixes ('*' for all) to run under
+    cProfile or tracemalloc; log_path None keeps records in memory only.
+    """
+    global _config
+    if not enabled:
+        _config = None
+        return
+    _config = _Config(log_path, profile, memory)
+
+
+def configure_from_env(log_path=LOG_PATH):
+    """CASE_MANAGER_DIAGNOSTICS=1 turns recording on; CASE_MANAGER_PROFILE and
+    CASE_MANAGER_TRACEMALLOC take comma-separated operation prefixes."""
+    def prefixes(env):
+        return [part.strip() for part in os.environ.get(env, '').split(',') if part.strip()]
+    profile, memory = prefixes(PROFILE_ENV), prefixes(TRACEMALLOC_ENV)
+    configure(os.environ.get(ENV) == '1' or bool(profile or memory), log_path, profile, memory)
+
+
+def enabled():
+    return _config is not None
+
+
+def settings():
+    """(enabled, profile prefixes, memory prefixes)."""
+    config = _config
+    return (config is not None, config.profile if config else (), config.memory if config else ())
+
+
+def span(name, **fields):
+    """Time a block as an operation (outermost) or as a stage of the running one."""
+    config = _config
+    if config is None:
+        return _NOOP
+    if config.pid != os.getpid():
+        return _NOOP
+    operation = _current.get()
+    if operation is None:
+        return _Operation(config, name, fields)
+    return _Stage(operation, name)
+
+
+def count(name, amount=1):
+    """Add to a counter of the running operation."""
+    if _config is None:
+        return
+    operation = _current.get()
+    if operation is not None:
+        operation.counters[name] = operation.counters.get(name, 0) + amount
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _Stage:
+    __slots__ = ('operation', 'name', 'start')
+
+    def __init__(self, operation, name):
+        self.operation = operation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        total, calls = self.operation.stages.get(self.name, (0.0, 0))
+        self.operation.stages[self.name] = (total + elapsed, calls + 1)
+        return False
+
+
+class _Operation:
+    def __init__(self, config, name, fields):
+        self.config = config
+        self.name = name
+        self.fields = fields
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+        self.tracing = False
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        if _matches(self.name, self.config.profile) and _profile_lock.acquire(blocking=False):
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler (a debugger, or cProfile from the command line) is active.
+                self.profiler = None
+                _profile_lock.release()
+        if _matches(self.name, self.config.memory) and _memory_lock.acquire(blocking=False):
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.tracing = True
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        _current.reset(self.token)
+        record = {
+            'op': self.name,
+            'start': self.started.isoformat(timespec='milliseconds'),
+            'ms': round(elapsed, 3),
+            'thread': threading.current_thread().name,
+            'stages': {name: {'ms': round(total, 3), 'n': calls} for name, (total, calls) in self.stages.items()},
+            'counters': self.counters,
+        }
+        if self.fields:
+            record['fields'] = self.fields
+        if exc_type is not None:
+            record['error'] = f'{exc_type.__name__}: {exc}'
+        if self.profiler is not None:
+            self.profiler.disable()
+            record['profile'] = _profile_text(self.profiler)
+            _profile_lock.release()
+        if self.tracing:
+            import tracemalloc
+
+            # Allocations by other threads during the operation are included.
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            record['memory'] = {'peak_kib': round(peak / 1024, 1), 'current_kib': round(current / 1024, 1),
+                                'top': [f'{stat.size / 1024:.1f} KiB {stat.traceback}' for stat in top]}
+            _memory_lock.release()
+        with _lock:
+            _recent.append(record)
+        if self.config.logger is not None:
+            self.config.logger.info(json.dumps(record, default=str))
+        return False
+
+
+def _profile_text(profiler):
+    import pstats
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+
+def recent(limit=None):
+    """Finished operations, newest first."""
+    with _lock:
+        records = list(_recent)
+    records.reverse()
+    return records[:limit] if limit else records
+
+
+def clear():
+    with _lock:
+        _recent.clear()
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summary(records=None):
+    """Per operation: runs, p50/p95/max ms, total ms and counters per stage, summed counters.
+
+    Operations are ordered by total time, slowest first.
+    """
+    records = recent() if records is None else records
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record['op'], []).append(record)
+    result = []
+    for name, runs in grouped.items():
+        times = [run['ms'] for run in runs]
+        stages, counters = {}, {}
+        for run in runs:
+            for stage, value in run['stages'].items():
+                total = stages.setdefault(stage, {'ms': 0.0, 'n': 0})
+                total['ms'] += value['ms']
+                total['n'] += value['n']
+            for counter, value in run['counters'].items():
+                counters[counter] = counters.get(counter, 0) + value
+        result.append({
+            'op': name, 'runs': len(runs), 'errors': sum('error' in run for run in runs),
+            'p50_ms': round(_percentile(times, 50), 1), 'p95_ms': round(_percentile(times, 95), 1),
+            'max_ms': round(max(times), 1), 'total_ms': round(sum(times), 1),
+            'stages': dict(sorted(stages.items(), key=lambda item: -item[1]['ms'])), 'counters': counters,
+        })
+    return sorted(result, key=lambda entry: -entry['total_ms'])
+
+
+def read_log(path=LOG_PATH):
+    """Records from the log and its rotated backups, oldest first."""
+    records = []
+    for n in range(LOG_BACKUPS, -1, -1):
+        name = f'{path}.{n}' if n else path
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def format_summary(entries):
+    lines = []
+    for entry in entries:
+        lines.append(f"{entry['op']}: {entry['runs']} run(s), p50 {entry['p50_ms']} ms, p95 {entry['p95_ms']} ms, "
+                     f"max {entry['max_ms']} ms" + (f", {entry['errors']} failed" if entry['errors'] else ''))
+        for stage, value in entry['stages'].items():
+            share = 100 * value['ms'] / entry['total_ms'] if entry['total_ms'] else 0
+            lines.append(f"    {stage}: {value['ms']:.1f} ms over {value['n']} call(s) ({share:.0f}%)")
+        if entry['counters']:
+            lines.append('    ' + ', '.join(f'{name} {value:,}' for name, value in sorted(entry['counters'].items())))
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize the diagnostics log by operation and stage.')
+    parser.add_argument('log', nargs='?', default=LOG_PATH)
+    parser.add_argument('--op', help='only operations starting with this')
+    args = parser.parse_args(argv)
+    records = [record for record in read_log(args.log) if not args.op or record['op'].startswith(args.op)]
+    for line in format_summary(summary(records)):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,650 @@
+import datetime
+import mimetypes
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import attachments
+import diagnostics
+import evidence_store
+
+ROOT_URL = os.environ.get('CASE_MANAGER_DRIVE_URL', 'https://www.googleapis.com')
+# Resumable chunks must be a multiple of 256 KiB.
+CHUNK_SIZE = 32 * 256 * 1024
+WORKERS = 3
+MAX_RETRIES = 6
+TIMEOUT = 60
+
+PENDING = 'pending'
+UPLOADING = 'uploading'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+FOLDER_TYPE = 'application/vnd.google-apps.folder'
+UPLOAD_FIELDS = 'id, md5Checksum, modifiedTime'
+
+
+class DriveError(Exception):
+    pass
+
+
+class SessionExpired(DriveError):
+    pass
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_outbox (
+        upload_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        file_path TEXT,
+        name TEXT,
+        sha256 TEXT,
+        size INTEGER,
+        status TEXT,
+        session_uri TEXT,
+        bytes_sent INTEGER,
+        drive_file_id TEXT,
+        attempts INTEGER,
+        error TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    # What each synced local file looked like when it last matched its Drive copy.
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_manifest (
+        case_id INTEGER,
+        local_path TEXT,
+        drive_file_id TEXT,
+        sha256 TEXT,
+        size INTEGER,
+        mtime_ns INTEGER,
+        md5 TEXT,
+        drive_modified TEXT,
+        synced_at TEXT,
+        PRIMARY KEY(case_id, local_path),
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    # The shared Drive folder of each case, and how far it has been pulled.
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_folders (
+        case_id INTEGER PRIMARY KEY,
+        folder_id TEXT,
+        pulled_until TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def enqueue(conn, case_id, file_path, name, sha256=None, drive_file_id=None):
+    """Add a file to the outbox; the caller commits. Returns the upload id.
+
+    With ``drive_file_id`` the upload replaces that Drive file's content.
+    Content already queued or uploaded as a new file for the same case is
+    not queued again, nor is a file that is still waiting in the queue.
+    Another case's copy is made on Drive by the engine (SyncEngine._known_file).
+    """
+    c = conn.cursor()
+    if sha256 and drive_file_id is None:
+        c.execute('SELECT upload_id FROM drive_outbox WHERE sha256=? AND case_id IS ? AND status!=? LIMIT 1',
+                  (sha256, case_id, FAILED))
+        row = c.fetchone()
+        if row:
+            return row[0]
+    c.execute('SELECT upload_id FROM drive_outbox WHERE file_path=? AND status=? LIMIT 1', (file_path, PENDING))
+    row = c.fetchone()
+    if row:
+        return row[0]
+    now = _now()
+    c.execute('INSERT INTO drive_outbox VALUES (NULL, ?, ?, ?, ?, NULL, ?, NULL, 0, ?, 0, NULL, ?, ?, NULL)',
+              (case_id, file_path, name, sha256, PENDING, drive_file_id, now, now))
+    return c.lastrowid
+
+
+def manifest_entry(conn, case_id, local_path):
+    c = conn.cursor()
+    c.execute('SELECT drive_file_id, sha256, size, mtime_ns FROM drive_manifest WHERE case_id=? AND local_path=?',
+              (case_id, local_path))
+    return c.fetchone()
+
+
+def queue_file(conn, case_id, file_path, name, sha256=None):
+    """Queue a local file unless it is unchanged since it was last synced.
+
+    A file already in the manifest is updated in place on Drive. Only a
+    stat is done here; the engine hashes the file before uploading and skips
+    it if the content turns out to be the same. The caller commits.
+    """
+    file_path = os.path.abspath(file_path)
+    entry = manifest_entry(conn, case_id, file_path)
+    if entry:
+        if not os.path.exists(file_path) and entry[1] == sha256:
+            # Only in the attachment store (attachments.stored_path), which never changes.
+            return None
+        stat = os.stat(file_path)
+        if (stat.st_size, stat.st_mtime_ns) == (entry[2], entry[3]):
+            return None
+        return enqueue(conn, case_id, file_path, name, None, entry[0])
+    return enqueue(conn, case_id, file_path, name, sha256)
+
+
+def _record(conn, case_id, local_path, drive_file_id, sha256, size, mtime_ns, md5=None, drive_modified=None):
+    # md5 and drive_modified are Drive's view of the file; a skipped upload
+    # doesn't know them, so the ones already recorded are kept.
+    conn.cursor().execute(
+        'INSERT INTO drive_manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(case_id, local_path) DO UPDATE SET drive_file_id=excluded.drive_file_id, '
+        'sha256=excluded.sha256, size=excluded.size, mtime_ns=excluded.mtime_ns, '
+        'md5=COALESCE(excluded.md5, md5), drive_modified=COALESCE(excluded.drive_modified, drive_modified), '
+        'synced_at=excluded.synced_at',
+        (case_id, local_path, drive_file_id, sha256, size, mtime_ns, md5, drive_modified, _now()))
+
+
+def retry_failed(conn):
+    c = conn.cursor()
+    c.execute('UPDATE drive_outbox SET status=?, error=NULL, updated_at=? WHERE status=?', (PENDING, _now(), FAILED))
+    return c.rowcount
+
+
+def _backoff(attempt, retry_after=None):
+    if retry_after:
+        return retry_after
+    return min(60, 2 ** attempt) * (0.5 + random.random())
+
+
+class DriveClient:
+    """Drive v3 REST client using resumable uploads.
+
+    Each thread gets one HTTP session, built on first use and then reused,
+    so connections and OAuth tokens carry over between uploads. Without creds
+    a plain session is used (the local fake server in benchmarks/).
+    """
+
+    def __init__(self, creds=None, root_url=ROOT_URL, chunk_size=CHUNK_SIZE):
+        self.creds = creds
+        self.files_url = f'{root_url}/drive/v3/files'
+        self.upload_url = f'{root_url}/upload/drive/v3/files'
+        self.chunk_size = chunk_size
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            if self.creds is not None:
+                from google.auth.transport.requests import AuthorizedSession
+                self.local.session = AuthorizedSession(self.creds)
+            else:
+                import requests
+                self.local.session = requests.Session()
+        return self.local.session
+
+    def find_by_sha256(self, sha256):
+        query = f"appProperties has {{ key='sha256' and value='{sha256}' }} and trashed = false"
+        response = self.session().get(self.files_url, params={'q': query, 'fields': 'files(id)'}, timeout=TIMEOUT)
+        response.raise_for_status()
+        files = response.json().get('files', [])
+        return files[0]['id'] if files else None
+
+    def start_upload(self, name, size, sha256, mime_type=None, parents=None, file_id=None):
+        """Open a resumable session; with file_id it replaces that file's content."""
+        metadata = {'name': name, 'appProperties': {'sha256': sha256}}
+        if parents and not file_id:
+            metadata['parents'] = parents
+        headers = {'X-Upload-Content-Length': str(size),
+                   'X-Upload-Content-Type': mime_type or 'application/octet-stream'}
+        params = {'uploadType': 'resumable', 'fields': UPLOAD_FIELDS}
+        if file_id:
+            response = self.session().patch(f'{self.upload_url}/{file_id}', params=params, json=metadata,
+                                            headers=headers, timeout=TIMEOUT)
+        else:
+            response = self.session().post(self.upload_url, params=params, json=metadata, headers=headers,
+                                           timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.headers['Location']
+
+    def copy_file(self, file_id, name, sha256, parents):
+        """Copy a Drive file into ``parents``; returns its metadata, or None if it is gone."""
+        metadata = {'name': name, 'parents': parents, 'appProperties': {'sha256': sha256}}
+        response = self.session().post(f'{self.files_url}/{file_id}/copy', params={'fields': UPLOAD_FIELDS},
+                                       json=metadata, timeout=TIMEOUT)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def create_folder(self, name):
+        metadata = {'name': name, 'mimeType': FOLDER_TYPE}
+        response = self.session().post(self.files_url, params={'fields': 'id'}, json=metadata, timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.json()['id']
+
+    def list_folder(self, folder_id, modified_after=None):
+        """Yield the files in a folder, only those changed after modified_after if given."""
+        query = f"'{folder_id}' in parents and trashed = false"
+        if modified_after:
+            query += f" and modifiedTime > '{modified_after}'"
+        params = {'q': query, 'pageSize': 1000,
+                  'fields': f'nextPageToken, files(name, mimeType, {UPLOAD_FIELDS})'}
+        while True:
+            response = self.session().get(self.files_url, params=params, timeout=TIMEOUT)
+            response.raise_for_status()
+            page = response.json()
+            yield from page.get('files', [])
+            if not page.get('nextPageToken'):
+                return
+            params['pageToken'] = page['nextPageToken']
+
+    def download(self, file_id, path):
+        # Written next to the target and renamed, so a cut-off download never
+        # replaces a good local copy.
+        partial = path + '.part'
+        with self.session().get(f'{self.files_url}/{file_id}', params={'alt': 'media'}, stream=True,
+                                timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            with open(partial, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        os.replace(partial, path)
+
+    def query_offset(self, session_uri, size):
+        """Ask the server how much of an interrupted upload it has.
+
+        Returns the next byte to send, or the finished file's metadata.
+        """
+        response = self.session().put(session_uri, headers={'Content-Range': f'bytes */{size}'}, timeout=TIMEOUT)
+        return self._offset(response)
+
+    def send_chunk(self, session_uri, f, offset, size):
+        f.seek(offset)
+        data = f.read(self.chunk_size)
+        end = offset + len(data) - 1
+        headers = {'Content-Range': f'bytes {offset}-{end}/{size}' if data else f'bytes */{size}'}
+        response = self.session().put(session_uri, data=data, headers=headers, timeout=TIMEOUT)
+        return self._offset(response)
+
+    def _offset(self, response):
+        if response.status_code in (200, 201):
+            return response.json()
+        if response.status_code == 308:
+            # Range: bytes=0-N means the server has N + 1 bytes.
+            received = response.headers.get('Range')
+            return int(received.rsplit('-', 1)[1]) + 1 if received else 0
+        if response.status_code in (404, 410):
+            raise SessionExpired(f'upload session expired ({response.status_code})')
+        response.raise_for_status()
+        raise DriveError(f'unexpected status {response.status_code}')
+
+
+class SyncEngine:
+    """Uploads files from the drive_outbox table in the background.
+
+    Up to ``workers`` files upload at once, each in CHUNK_SIZE pieces. The
+    session URI and byte count are saved after every chunk, so an upload cut
+    off by a dropped connection or an app restart continues where it stopped.
+    Content already in Drive (same sha256 in appProperties) is not sent again.
+
+    Each worker thread opens its own connection with ``connect``.
+    ``on_update(upload_id, status, row)`` is called from worker threads.
+    """
+
+    def __init__(self, connect, client, workers=WORKERS, on_update=None, max_retries=MAX_RETRIES):
+        self.connect = connect
+        self.client = client
+        self.workers = workers
+        self.on_update = on_update
+        self.max_retries = max_retries
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drive')
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.active = set()
+        self.lock = threading.Lock()
+        self.folder_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._dispatch, name='drive-sync', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self, wait=False):
+        # Unfinished uploads keep their session in the outbox and resume next start.
+        with self.lock:
+            self.closed = True
+        self.wakeup.set()
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    def sync_case(self, case_id, pull_dir):
+        """Queue local changes and pull new or changed files from the case folder.
+
+        Runs on the worker pool; the future's result is the list of local
+        paths written by the pull.
+        """
+        return self.pool.submit(self._sync_case, case_id, pull_dir)
+
+    def _conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = self.connect()
+        return self.local.conn
+
+    def _dispatch(self):
+        while not self.closed:
+            self.wakeup.clear()
+            c = self._conn().cursor()
+            c.execute('SELECT upload_id FROM drive_outbox WHERE status IN (?, ?) ORDER BY upload_id',
+                      (PENDING, UPLOADING))
+            for (upload_id,) in c.fetchall():
+                with self.lock:
+                    if self.closed or upload_id in self.active or len(self.active) >= self.workers:
+                        continue
+                    self.active.add(upload_id)
+                    self.pool.submit(self._upload, upload_id)
+            self.wakeup.wait(timeout=30)
+
+    def _update(self, upload_id, **fields):
+        fields['updated_at'] = _now()
+        conn = self._conn()
+        assignments = ', '.join(f'{name}=?' for name in fields)
+        conn.cursor().execute(f'UPDATE drive_outbox SET {assignments} WHERE upload_id=?',
+                              list(fields.values()) + [upload_id])
+        conn.commit()
+
+    def _notify(self, upload_id, status, row):
+        if self.on_update:
+            self.on_update(upload_id, status, row)
+
+    def _upload(self, upload_id):
+        try:
+            with diagnostics.span('drive.upload', upload_id=upload_id):
+                self._upload_one(upload_id)
+        except Exception as e:
+            if self.closed:
+                return
+            c = self._conn().cursor()
+            c.execute('SELECT attempts FROM drive_outbox WHERE upload_id=?', (upload_id,))
+            self._update(upload_id, status=FAILED, error=str(e) or type(e).__name__,
+                         attempts=(c.fetchone()[0] or 0) + 1)
+            self._notify(upload_id, FAILED, self._row(upload_id))
+        finally:
+            with self.lock:
+                self.active.discard(upload_id)
+            self.wake()
+
+    def _row(self, upload_id):
+        c = self._conn().cursor()
+        c.execute('SELECT * FROM drive_outbox WHERE upload_id=?', (upload_id,))
+        columns = [d[0] for d in c.description]
+        return dict(zip(columns, c.fetchone()))
+
+    def _upload_one(self, upload_id):
+        row = self._row(upload_id)
+        if not os.path.exists(row['file_path']):
+            if row['sha256'] and attachments.stored(self._conn(), row['sha256']):
+                self._upload_stored(upload_id, row)
+                return
+            raise DriveError(f"{row['file_path']} no longer exists")
+        stat = os.stat(row['file_path'])
+        sha256, size = row['sha256'], row['size']
+        if row['session_uri'] and (stat.st_size, stat.st_mtime_ns) != (size, row['mtime_ns']):
+            # Changed since the interrupted upload began; the session holds stale bytes.
+            row['session_uri'] = sha256 = None
+            self._update(upload_id, session_uri=None, bytes_sent=0)
+        if not sha256 or size is None:
+            with diagnostics.span('hash'):
+                sha256, size = evidence_store.hash_file(row['file_path'])
+            self._update(upload_id, sha256=sha256, size=size, mtime_ns=stat.st_mtime_ns)
+        elif row['mtime_ns'] is None:
+            self._update(upload_id, mtime_ns=stat.st_mtime_ns)
+        target = row['drive_file_id']
+        entry = manifest_entry(self._conn(), row['case_id'], row['file_path'])
+        if not row['session_uri']:
+            if target and entry and entry[1] == sha256:
+                known = {'id': target}
+            else:
+                known = None if target else self._known_file(row, sha256)
+            if known:
+                self._finish(upload_id, SKIPPED, row, known['id'], sha256, size, stat.st_mtime_ns,
+                             known.get('md5Checksum'), known.get('modifiedTime'))
+                return
+        parents = [self._case_folder(row['case_id'])] if row['case_id'] is not None and not target else None
+        result = self._send(upload_id, row, sha256, size, parents, target)
+        if result is None:
+            return
+        self._finish(upload_id, DONE, row, result['id'], sha256, size, stat.st_mtime_ns,
+                     result.get('md5Checksum'), result.get('modifiedTime'))
+        if os.stat(row['file_path']).st_mtime_ns != stat.st_mtime_ns:
+            # Rewritten while uploading (a regenerated report); send the new version too.
+            conn = self._conn()
+            enqueue(conn, row['case_id'], row['file_path'], row['name'], None, result['id'])
+            conn.commit()
+
+    def _upload_stored(self, upload_id, row):
+        # The original was moved or deleted after it was imported; its copy in
+        # the attachment store is streamed instead. That copy never changes,
+        # so there are no mtime checks.
+        sha256 = row['sha256']
+        source = attachments.reader(self._conn(), sha256)
+        size = source.size
+        if row['size'] is None:
+            self._update(upload_id, size=size)
+        target = row['drive_file_id']
+        entry = manifest_entry(self._conn(), row['case_id'], row['file_path'])
+        if not row['session_uri']:
+            if target and entry and entry[1] == sha256:
+                known = {'id': target}
+            else:
+                known = None if target else self._known_file(row, sha256)
+            if known:
+                source.close()
+                self._finish(upload_id, SKIPPED, row, known['id'], sha256, size, row['mtime_ns'],
+                             known.get('md5Checksum'), known.get('modifiedTime'))
+                return
+        parents = [self._case_folder(row['case_id'])] if row['case_id'] is not None and not target else None
+        result = self._send(upload_id, row, sha256, size, parents, target, source)
+        if result is None:
+            return
+        self._finish(upload_id, DONE, row, result['id'], sha256, size, row['mtime_ns'],
+                     result.get('md5Checksum'), result.get('modifiedTime'))
+
+    def _finish(self, upload_id, status, row, file_id, sha256, size, mtime_ns, md5=None, drive_modified=None):
+        conn = self._conn()
+        if row['case_id'] is not None:
+            _record(conn, row['case_id'], row['file_path'], file_id, sha256, size, mtime_ns, md5, drive_modified)
+        self._update(upload_id, status=status, drive_file_id=file_id, bytes_sent=size, error=None)
+        self._notify(upload_id, status, self._row(upload_id))
+
+    def _case_folder(self, case_id, create=True):
+        # One shared folder per case; the lock stops two workers creating it twice.
+        with self.folder_lock:
+            c = self._conn().cursor()
+            c.execute('SELECT folder_id FROM drive_folders WHERE case_id=?', (case_id,))
+            row = c.fetchone()
+            if row or not create:
+                return row[0] if row else None
+            c.execute('SELECT case_name FROM cases WHERE case_id=?', (case_id,))
+            case = c.fetchone()
+            folder_id = self.client.create_folder(f'Case Manager - {case[0] if case else case_id}')
+            c.execute('INSERT INTO drive_folders VALUES (?, ?, NULL)', (case_id, folder_id))
+            self._conn().commit()
+            return folder_id
+
+    def _sync_case(self, case_id, pull_dir):
+        with diagnostics.span('drive.sync', case_id=case_id):
+            return self._sync_case_files(case_id, pull_dir)
+
+    def _sync_case_files(self, case_id, pull_dir):
+        conn = self._conn()
+        for local_path, file_id in changed_files(conn, case_id):
+            enqueue(conn, case_id, local_path, os.path.basename(local_path), None, file_id)
+        conn.commit()
+        self.wake()
+        folder_id = self._case_folder(case_id, create=False)
+        return self._pull(case_id, folder_id, pull_dir) if folder_id else []
+
+    def _pull(self, case_id, folder_id, pull_dir):
+        conn = self._conn()
+        c = conn.cursor()
+        c.execute('SELECT pulled_until FROM drive_folders WHERE case_id=?', (case_id,))
+        pulled_until = c.fetchone()[0]
+        written = []
+        for remote in self.client.list_folder(folder_id, pulled_until):
+            if self.closed:
+                return written
+            pulled_until = max(pulled_until or '', remote['modifiedTime'])
+            if remote['mimeType'].startswith('application/vnd.google-apps.'):
+                # Google Docs/Sheets have no file content to download.
+                continue
+            c.execute('SELECT local_path, md5, sha256, size, mtime_ns FROM drive_manifest '
+                      'WHERE case_id=? AND drive_file_id=?', (case_id, remote['id']))
+            known = c.fetchone()
+            if known and known[1] == remote.get('md5Checksum'):
+                continue
+            if known and not _changed_locally(known[0], known[3], known[4]):
+                local_path = known[0]
+            elif known:
+                # Both sides changed: the local edit is queued for upload, so keep
+                # the Drive version alongside it.
+                stem, ext = os.path.splitext(known[0])
+                local_path = _free_path(f'{stem} (Drive copy){ext}')
+            else:
+                os.makedirs(pull_dir, exist_ok=True)
+                local_path = _free_path(os.path.join(os.path.abspath(pull_dir), os.path.basename(remote['name'])))
+            with diagnostics.span('drive.download'):
+                self.client.download(remote['id'], local_path)
+            diagnostics.count('bytes', os.path.getsize(local_path))
+            written.append(local_path)
+            if known and local_path != known[0]:
+                continue
+            sha256, size = evidence_store.hash_file(local_path)
+            _record(conn, case_id, local_path, remote['id'], sha256, size, os.stat(local_path).st_mtime_ns,
+                    remote.get('md5Checksum'), remote['modifiedTime'])
+            conn.commit()
+        c.execute('UPDATE drive_folders SET pulled_until=? WHERE case_id=?', (pulled_until, case_id))
+        conn.commit()
+        return written
+
+    def _known_file(self, row, sha256):
+        # Content already on Drive. A case reuses only a file in its own
+        # folder; one uploaded for another case is copied into this case's
+        # folder on Drive's side, so the bytes aren't sent twice.
+        case_id = row['case_id']
+        c = self._conn().cursor()
+        if case_id is not None:
+            c.execute('SELECT drive_file_id FROM drive_manifest WHERE case_id=? AND sha256=? LIMIT 1',
+                      (case_id, sha256))
+            found = c.fetchone()
+            if found:
+                return {'id': found[0]}
+        c.execute('SELECT drive_file_id FROM drive_outbox WHERE sha256=? AND drive_file_id IS NOT NULL LIMIT 1',
+                  (sha256,))
+        found = c.fetchone()
+        file_id = found[0] if found else None
+        if file_id is None:
+            cached = evidence_store.lookup(self._conn(), sha256)
+            file_id = cached.drive_file_id if cached and cached.drive_file_id else None
+        if file_id is None:
+            file_id = self.client.find_by_sha256(sha256)
+        if file_id is None or case_id is None:
+            return {'id': file_id} if file_id else None
+        return self.client.copy_file(file_id, row['name'], sha256, [self._case_folder(case_id)])
+
+    def _send(self, upload_id, row, sha256, size, parents=None, file_id=None, source=None):
+        # source: a seekable file object to send instead of the file at row['file_path'].
+        import requests
+
+        session_uri = row['session_uri']
+        offset = None
+        attempt = 0
+        with source or open(row['file_path'], 'rb') as f:
+            while not self.closed:
+                try:
+                    if session_uri is None:
+                        mime_type = mimetypes.guess_type(row['name'])[0]
+                        session_uri = self.client.start_upload(row['name'], size, sha256, mime_type, parents,
+                                                               file_id)
+                        offset = 0
+                        self._update(upload_id, status=UPLOADING, session_uri=session_uri, bytes_sent=0)
+                    elif offset is None:
+                        # Resuming: the server knows how much actually arrived.
+                        offset = self.client.query_offset(session_uri, size)
+                    else:
+                        sent = offset
+                        with diagnostics.span('drive.chunk'):
+                            offset = self.client.send_chunk(session_uri, f, offset, size)
+                        diagnostics.count('bytes', (size if isinstance(offset, dict) else offset) - sent)
+                    if isinstance(offset, dict):
+                        return offset
+                    with diagnostics.span('db.update'):
+                        self._update(upload_id, status=UPLOADING, bytes_sent=offset)
+                    attempt = 0
+                except SessionExpired:
+                    session_uri, offset = None, None
+                    self._update(upload_id, session_uri=None, bytes_sent=0)
+                except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                    response = getattr(e, 'response', None)
+                    status = response.status_code if response is not None else None
+                    if status is not None and status < 500 and status != 429:
+                        raise
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+                    retry_after = response.headers.get('Retry-After') if response is not None else None
+                    time.sleep(_backoff(attempt, float(retry_after) if retry_after else None))
+                    offset = None if session_uri else offset
+        return None
+
+
+def _changed_locally(local_path, size, mtime_ns):
+    try:
+        stat = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    return (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns)
+
+
+def _free_path(path):
+    stem, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = f'{stem} ({n}){ext}'
+    return path
+
+
+def changed_files(conn, case_id):
+    """Return (local path, Drive file id) for synced files edited since their last sync.
+
+    One query for the whole manifest and a stat per file; files whose size
+    and mtime match are not read. Files deleted locally are left alone on Drive.
+    """
+    c = conn.cursor()
+    c.execute('SELECT local_path, drive_file_id, sha256, size, mtime_ns FROM drive_manifest WHERE case_id=?',
+              (case_id,))
+    changed = []
+    for local_path, file_id, sha256, size, mtime_ns in c.fetchall():
+        if not _changed_locally(local_path, size, mtime_ns):
+            continue
+        new_sha256, new_size = evidence_store.hash_file(local_path)
+        if new_sha256 == sha256:
+            # Touched but not edited; remember the new mtime so it isn't hashed again.
+            c.execute('UPDATE drive_manifest SET mtime_ns=? WHERE case_id=? AND local_path=?',
+                      (os.stat(local_path).st_mtime_ns, case_id, local_path))
+            continue
+        changed.append((local_path, file_id))
+    return changed
+
+
+def summary(conn, case_id=None):
+    c = conn.cursor()
+    if case_id is None:
+        c.execute('SELECT status, COUNT(*) FROM drive_outbox GROUP BY status')
+    else:
+        c.execute('SELECT status, COUNT(*) FROM drive_outbox WHERE case_id=? GROUP BY status', (case_id,))
+    return dict(c.fetchall())
+
@@ -0,0 +1,82 @@
+import datetime
+import hashlib
+import json
+from collections import namedtuple
+
+CHUNK_SIZE = 1 << 20
+
+Evidence = namedtuple('Evidence', 'sha256 size kind extracted drive_file_id linked')
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    # One row per distinct file content, shared across cases.
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence_files (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER,
+        kind TEXT,
+        extracted TEXT,
+        drive_file_id TEXT,
+        first_path TEXT,
+        created_at TEXT
+    )''')
+    # Which case rows were created from which content.
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence_links (
+        sha256 TEXT,
+        case_id INTEGER,
+        source TEXT,
+        source_id INTEGER,
+        PRIMARY KEY(sha256, case_id, source, source_id),
+        FOREIGN KEY(sha256) REFERENCES evidence_files(sha256),
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+
+
+def hash_file(file_path):
+    """Return (sha256 hex digest, size) reading the file in fixed-size chunks."""
+    h = hashlib.sha256()
+    size = 0
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+            size += n
+    return h.hexdigest(), size
+
+
+def lookup(conn, sha256, case_id=None):
+    c = conn.cursor()
+    c.execute('SELECT size, kind, extracted, drive_file_id FROM evidence_files WHERE sha256=?', (sha256,))
+    row = c.fetchone()
+    if not row:
+        return None
+    linked = False
+    if case_id is not None:
+        c.execute('SELECT 1 FROM evidence_links WHERE sha256=? AND case_id=? LIMIT 1', (sha256, case_id))
+        linked = c.fetchone() is not None
+    extracted = json.loads(row[2]) if row[2] else None
+    return Evidence(sha256, row[0], row[1], extracted, row[3], linked)
+
+
+def remember(conn, sha256, size, kind, extracted, file_path):
+    c = conn.cursor()
+    c.execute('INSERT OR IGNORE INTO evidence_files VALUES (?, ?, ?, NULL, NULL, ?, ?)',
+              (sha256, size, kind, file_path, datetime.datetime.now().isoformat(timespec='seconds')))
+    if extracted is not None:
+        # An out of date extraction is replaced when the file is re-extracted.
+        extracted = json.dumps(extracted)
+        c.execute('UPDATE evidence_files SET extracted=? WHERE sha256=? AND (extracted IS NULL OR extracted!=?)',
+                  (extracted, sha256, extracted))
+
+
+def link(conn, sha256, case_id, source, source_id):
+    conn.cursor().execute('INSERT OR IGNORE INTO evidence_links VALUES (?, ?, ?, ?)',
+                          (sha256, case_id, source, source_id))
+
+
+def set_drive_id(conn, sha256, drive_file_id):
+    conn.cursor().execute('UPDATE evidence_files SET drive_file_id=? WHERE sha256=?', (drive_file_id, sha256))
@@ -0,0 +1,290 @@
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+import attachments
+import diagnostics
+import evidence_store
+import pdf_pages
+import screenshot_ocr
+import transcription
+import video
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+DUPLICATE = 'duplicate'
+CANCELLED = 'cancelled'
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS ingest_jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        kind TEXT,
+        payload TEXT,
+        status TEXT,
+        error TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+# Extractors run off the UI thread (CPU-bound ones in a separate process), so
+# they must be module-level, take only the JSON payload and never touch the DB.
+# Their libraries are imported on first use to keep app startup light.
+
+def extract_document(payload, executor=None):
+    # PDFs are split into pages (fanned out over executor when given) so
+    # scanned pages can be OCR'd and search hits can cite a page number.
+    file_path = payload['file_path']
+    content = ''
+    if file_path.endswith('.pdf'):
+        pages = pdf_pages.extract_pages(file_path, executor)
+        return {'content': ' '.join(text for _, text, _ in pages), 'pages': pages}
+    elif file_path.endswith('.docx'):
+        from docx import Document
+        doc = Document(file_path)
+        content = ' '.join(p.text for p in doc.paragraphs)
+    elif file_path.endswith('.txt'):
+        with open(file_path, 'r') as f:
+            content = f.read()
+    return {'content': content}
+
+
+def extract_audio(payload):
+    # Decoded by ffmpeg and transcribed in silence-split chunks; see transcription.py.
+    segments = transcription.transcribe_file(payload['file_path'])
+    return {'transcription': transcription.join_segments(segments),
+            'segments': [list(segment) for segment in segments]}
+
+
+def extract_text_image(payload):
+    # Split into message bubbles with senders and timestamps; see screenshot_ocr.py.
+    return screenshot_ocr.extract(payload['file_path'], payload.get('date'))
+
+
+def extract_video(payload, cancelled=None):
+    # Audio streamed out by ffmpeg in segments, plus keyframe thumbnails; see video.py.
+    return video.extract(payload['file_path'], cancelled)
+
+
+def counts(conn, case_id=None):
+    """{status: number of jobs}, of one case or all."""
+    c = conn.cursor()
+    if case_id is None:
+        c.execute('SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status')
+    else:
+        c.execute('SELECT status, COUNT(*) FROM ingest_jobs WHERE case_id=? GROUP BY status', (case_id,))
+    return dict(c.fetchall())
+
+
+def is_current(kind, extracted):
+    # Cached extractions from an older screenshot OCR are redone.
+    return kind != 'text_image' or screenshot_ocr.is_current(extracted)
+
+
+class IngestQueue:
+    """Persistent ingestion job queue.
+
+    Jobs are stored in ``ingest_jobs`` and extracted on worker threads, with
+    CPU-bound extractors handed to a process pool. All database access happens
+    through ``schedule``, which must run the callable on the thread that owns
+    ``conn`` (the Kivy main thread in the app).
+
+    Files are hashed before extraction, in the same pass that copies them
+    into the encrypted attachment store: content already linked to the case
+    is skipped as a duplicate, and content seen before (in any case) reuses
+    the cached extraction from ``evidence_files`` unless it's out of date.
+    """
+
+    def __init__(self, conn, schedule, on_update=None, cpu_workers=None, io_workers=4):
+        self.conn = conn
+        self.schedule = schedule
+        self.on_update = on_update
+        self.handlers = {}
+        cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers)
+        self.runner = ThreadPoolExecutor(max_workers=cpu_workers + io_workers, thread_name_prefix='ingest')
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='ingest-io')
+        # job_id: threading.Event for every job not finished yet; set when it's cancelled.
+        self.cancel_events = {}
+        self.closed = False
+        self.store = None
+
+    def register(self, kind, extract, store, cpu_bound=False, fan_out=False, cancellable=False):
+        # store(case_id, payload, result) writes the rows and returns the
+        # (table, row id) the file was stored as; the queue commits.
+        # fan_out extractors run on the runner thread as extract(payload, cpu_pool)
+        # and split their own work across the process pool.
+        # cancellable extractors run on the runner thread as extract(payload, event)
+        # and should stop soon after the event is set; other jobs are cancelled
+        # when they'd start and their results discarded.
+        self.handlers[kind] = (extract, store, cpu_bound, fan_out, cancellable)
+
+    def submit(self, case_id, kind, payload):
+        c = self.conn.cursor()
+        now = _now()
+        c.execute('INSERT INTO ingest_jobs VALUES (NULL, ?, ?, ?, ?, NULL, ?, ?)',
+                  (case_id, kind, json.dumps(payload), QUEUED, now, now))
+        job_id = c.lastrowid
+        self.conn.commit()
+        self.cancel_events[job_id] = threading.Event()
+        self._notify(job_id, QUEUED, None)
+        self.runner.submit(self._run, job_id, case_id, kind, payload)
+        return job_id
+
+    def resume(self):
+        c = self.conn.cursor()
+        c.execute('SELECT job_id, case_id, kind, payload FROM ingest_jobs WHERE status IN (?, ?) ORDER BY job_id',
+                  (QUEUED, RUNNING))
+        jobs = c.fetchall()
+        for job_id, case_id, kind, payload in jobs:
+            self._set_status(job_id, QUEUED)
+            self.cancel_events[job_id] = threading.Event()
+            self.runner.submit(self._run, job_id, case_id, kind, json.loads(payload))
+        self.conn.commit()
+        return len(jobs)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it had already finished."""
+        event = self.cancel_events.pop(job_id, None)
+        if event is None:
+            return False
+        event.set()
+        self._mark(job_id, CANCELLED)
+        return True
+
+    def cancel_case(self, case_id):
+        """Cancel every unfinished job of a case; returns how many there were."""
+        c = self.conn.cursor()
+        c.execute('SELECT job_id FROM ingest_jobs WHERE case_id=? AND status IN (?, ?)', (case_id, QUEUED, RUNNING))
+        return sum(self.cancel(job_id) for job_id, in c.fetchall())
+
+    def run_background(self, fn, *args):
+        return self.io_pool.submit(fn, *args)
+
+    def counts(self, case_id=None):
+        return counts(self.conn, case_id)
+
+    def shutdown(self, wait=False):
+        # Unfinished jobs stay queued/running in the table and resume next launch.
+        self.closed = True
+        for event in list(self.cancel_events.values()):
+            event.set()
+        self.runner.shutdown(wait=wait, cancel_futures=True)
+        self.io_pool.shutdown(wait=wait, cancel_futures=True)
+        self.cpu_pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id, case_id, kind, payload):
+        with diagnostics.span(f'ingest.{kind}', job_id=job_id):
+            self._extract(job_id, case_id, kind, payload)
+
+    def _extract(self, job_id, case_id, kind, payload):
+        extract, store, cpu_bound, fan_out, cancellable = self.handlers[kind]
+        cancelled = self.cancel_events.get(job_id)
+        if cancelled is None or cancelled.is_set():
+            return
+        self.schedule(lambda: self._mark(job_id, RUNNING))
+        try:
+            if self.store is None:
+                self.store = self._call(lambda: attachments.store(self.conn))
+            with diagnostics.span('hash'):
+                sha256, size, chunk_ids = self.store.write(payload['file_path'], cancelled)
+            diagnostics.count('bytes', size)
+            with diagnostics.span('cache.lookup'):
+                cached = self._call(lambda: evidence_store.lookup(self.conn, sha256, case_id))
+            if cached and cached.linked:
+                self.schedule(lambda: self._mark(job_id, DUPLICATE))
+                return
+            with diagnostics.span('extract'):
+                if cached and cached.extracted is not None and is_current(kind, cached.extracted):
+                    diagnostics.count('cache_hits')
+                    result = cached.extracted
+                elif fan_out:
+                    result = extract(payload, self.cpu_pool)
+                elif cancellable:
+                    result = extract(payload, cancelled)
+                elif cpu_bound:
+                    result = self.cpu_pool.submit(extract, payload).result()
+                else:
+                    result = extract(payload)
+        except Exception as e:
+            if self.closed:
+                # Stopped by shutdown(); the job resumes next launch.
+                return
+            error = str(e) or type(e).__name__
+            self.schedule(lambda: self._mark(job_id, FAILED, error))
+            return
+        payload = dict(payload, sha256=sha256)
+        self.schedule(lambda: self._complete(job_id, case_id, kind, payload, size, result, store, chunk_ids))
+
+    def _call(self, fn):
+        # Run fn on the connection's thread and wait for its result.
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        self.schedule(run)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except TimeoutError:
+                if self.closed:
+                    raise RuntimeError('Ingest queue shut down.')
+
+    def _complete(self, job_id, case_id, kind, payload, size, result, store, chunk_ids):
+        if job_id not in self.cancel_events:
+            return
+        # The same file may have been queued twice before either finished.
+        cached = evidence_store.lookup(self.conn, payload['sha256'], case_id)
+        if cached and cached.linked:
+            self._mark(job_id, DUPLICATE)
+            return
+        try:
+            with diagnostics.span(f'ingest.{kind}.store', job_id=job_id):
+                with diagnostics.span('store'):
+                    source, source_id = store(case_id, payload, result)
+                with diagnostics.span('cache.remember'):
+                    attachments.save(self.conn, payload['sha256'], size, chunk_ids)
+                    evidence_store.remember(self.conn, payload['sha256'], size, kind, result, payload['file_path'])
+                    evidence_store.link(self.conn, payload['sha256'], case_id, source, source_id)
+                self._set_status(job_id, DONE)
+                with diagnostics.span('db.commit'):
+                    self.conn.commit()
+            self.cancel_events.pop(job_id, None)
+        except Exception as e:
+            self.conn.rollback()
+            self._mark(job_id, FAILED, str(e) or type(e).__name__)
+            return
+        self._notify(job_id, DONE, None)
+
+    def _mark(self, job_id, status, error=None):
+        # A cancelled job's worker may still report back; the cancellation stands.
+        if status != CANCELLED and job_id not in self.cancel_events:
+            return
+        if status not in (QUEUED, RUNNING):
+            self.cancel_events.pop(job_id, None)
+        self._set_status(job_id, status, error)
+        self.conn.commit()
+        self._notify(job_id, status, error)
+
+    def _set_status(self, job_id, status, error=None):
+        self.conn.cursor().execute('UPDATE ingest_jobs SET status=?, error=?, updated_at=? WHERE job_id=?',
+                                   (status, error, _now(), job_id))
+
+    def _notify(self, job_id, status, error):
+        if self.on_update:
+            self.on_update(job_id, status, error)
@@ -0,0 +1,303 @@
+import datetime
+import hashlib
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote, urlparse
+
+SEARCH_URL = os.environ.get('CASE_MANAGER_LEGAL_SEARCH_URL', 'https://www.google.com/search')
+QUERY = '{state} child welfare laws and forms'
+USER_AGENT = 'Mozilla/5.0'
+# Bump when what is saved per state changes (the query, how pages are read);
+# states saved by an older version are looked up again on their next refresh.
+STORE_VERSION = 1
+# A state's search results are looked up again after LOOKUP_TTL. Each saved
+# page is rechecked after PAGE_TTL with a conditional GET, which is usually a
+# 304 with no body.
+LOOKUP_TTL = datetime.timedelta(days=30)
+PAGE_TTL = datetime.timedelta(days=7)
+MAX_RESULTS = 8
+# Larger pages and PDFs are listed as links without their text.
+MAX_BYTES = 5 * 1024 * 1024
+WORKERS = 4
+TIMEOUT = 20
+
+STATUTE = 'statute'
+FORM = 'form'
+LINK = 'link'
+
+Resource = namedtuple('Resource', 'resource_id state kind title url fetched_at has_content')
+
+_STATUTE = re.compile(r'statute|code|law|legislat|\brcw\b|\bors\b|\bilcs\b|title[-_ ]?\d|chapter|\bsection\b|§', re.I)
+_FORM = re.compile(r'\bforms?\b|\.pdf$|petition|motion|application', re.I)
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    # Statutes, forms and links found for a state. case_id is always NULL:
+    # the library is shared by every case, and indexed for search under
+    # search_index.SHARED_CASE_ID.
+    c.execute('''CREATE TABLE IF NOT EXISTS legal_resources (
+        resource_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        state TEXT,
+        kind TEXT,
+        title TEXT,
+        url TEXT,
+        content TEXT,
+        content_hash TEXT,
+        etag TEXT,
+        last_modified TEXT,
+        version INTEGER,
+        fetched_at TEXT,
+        checked_at TEXT,
+        error TEXT,
+        UNIQUE(state, url)
+    )''')
+    # When each state's search was last run, and by which STORE_VERSION.
+    c.execute('''CREATE TABLE IF NOT EXISTS legal_lookups (
+        state TEXT PRIMARY KEY,
+        store_version INTEGER,
+        refreshed_at TEXT,
+        error TEXT
+    )''')
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _older_than(stamp, ttl, now):
+    return not stamp or datetime.datetime.fromisoformat(stamp) < now - ttl
+
+
+def normalize_state(state):
+    """'new  york' -> 'New York', 'ny' -> 'NY', so one state is saved once."""
+    state = ' '.join(state.split())
+    return state.upper() if len(state) == 2 else state.title()
+
+
+def cached(conn, state):
+    """Saved resources of a state, statutes first; no network."""
+    c = conn.cursor()
+    c.execute('''SELECT resource_id, state, kind, title, url, fetched_at, content IS NOT NULL
+                 FROM legal_resources WHERE state = ?
+                 ORDER BY CASE kind WHEN ? THEN 0 WHEN ? THEN 1 ELSE 2 END, resource_id''',
+              (normalize_state(state), STATUTE, FORM))
+    return [Resource(*row) for row in c.fetchall()]
+
+
+def last_lookup(conn, state):
+    """(refreshed_at, error) of a state's last search, or None if it was never searched."""
+    c = conn.cursor()
+    c.execute('SELECT refreshed_at, error FROM legal_lookups WHERE state = ?', (normalize_state(state),))
+    return c.fetchone()
+
+
+def needs_refresh(conn, state, now=None):
+    """Whether the state's search or any of its pages is past its TTL."""
+    now = now or datetime.datetime.now()
+    state = normalize_state(state)
+    c = conn.cursor()
+    c.execute('SELECT store_version, refreshed_at FROM legal_lookups WHERE state = ?', (state,))
+    row = c.fetchone()
+    if not row or row[0] != STORE_VERSION or _older_than(row[1], LOOKUP_TTL, now):
+        return True
+    c.execute('SELECT MIN(checked_at) FROM legal_resources WHERE state = ?', (state,))
+    return _older_than(c.fetchone()[0], PAGE_TTL, now)
+
+
+def classify(url, title=''):
+    path = unquote(urlparse(url).path)
+    if _FORM.search(path) or _FORM.search(title or ''):
+        return FORM
+    if _STATUTE.search(path) or _STATUTE.search(title or ''):
+        return STATUTE
+    return LINK
+
+
+def search_results(html):
+    """[(url, title)] of the result links on a search page, without duplicates."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    results = []
+    seen = set()
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if '/url?q=' not in href or 'google' in href:
+            continue
+        url = unquote(href.split('/url?q=')[1].split('&')[0])
+        if url not in seen:
+            seen.add(url)
+            results.append((url, link.get_text(' ', strip=True) or url))
+    return results
+
+
+def page_text(data, content_type):
+    """(title or None, text) of a fetched HTML page or PDF."""
+    if 'pdf' in content_type or data[:5] == b'%PDF-':
+        from io import BytesIO
+
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(BytesIO(data))
+        return None, '\n'.join(page.extract_text() or '' for page in reader.pages).strip()
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(data, 'html.parser')
+    for tag in soup(['script', 'style', 'nav', 'header', 'footer', 'noscript']):
+        tag.decompose()
+    title = soup.title.get_text(strip=True) if soup.title else None
+    text = '\n'.join(line for line in (line.strip() for line in soup.get_text('\n').splitlines()) if line)
+    return title or None, text
+
+
+def _session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # One keep-alive pool shared by every fetch; most of a state's pages are
+    # on one or two government hosts.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                            allowed_methods=('GET',)))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+class LegalLibrary:
+    """Keeps the legal_resources table of each state up to date in the background.
+
+    refresh() runs the state's search (at most every LOOKUP_TTL) and then
+    rechecks its pages that are past PAGE_TTL, ``workers`` at a time, with
+    If-None-Match / If-Modified-Since. A page whose text changed gets a new
+    version, which reindexes it for search. Failures are recorded and the
+    saved copy is kept, so lookups work offline.
+
+    Refreshes run one at a time on their own thread and connection (from
+    ``connect``); page fetches only do HTTP.
+    """
+
+    def __init__(self, connect, session=None, workers=WORKERS, search_url=SEARCH_URL):
+        self.connect = connect
+        self.session = session or _session(workers)
+        self.search_url = search_url
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='legal')
+        self.fetchers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='legal-fetch')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def refresh(self, state, force=False):
+        """Refresh a state in the background; the future's result is the number of pages added or changed.
+
+        A refresh of a state that is already queued returns the same future.
+        """
+        state = normalize_state(state)
+        with self.lock:
+            future = self.pending.get(state)
+            if future is None or future.done():
+                future = self.pool.submit(self._refresh, state, force)
+                self.pending[state] = future
+            return future
+
+    def close(self, wait=False):
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+        self.fetchers.shutdown(wait=wait, cancel_futures=True)
+        self.session.close()
+
+    def _conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = self.connect()
+        return self.local.conn
+
+    def _refresh(self, state, force):
+        conn = self._conn()
+        now = datetime.datetime.now()
+        c = conn.cursor()
+        c.execute('SELECT store_version, refreshed_at FROM legal_lookups WHERE state = ?', (state,))
+        row = c.fetchone()
+        if force or not row or row[0] != STORE_VERSION or _older_than(row[1], LOOKUP_TTL, now):
+            self._lookup(conn, state)
+        c.execute('SELECT resource_id, url, title, etag, last_modified, content_hash, checked_at '
+                  'FROM legal_resources WHERE state = ?', (state,))
+        due = [row for row in c.fetchall() if force or _older_than(row[6], PAGE_TTL, now)]
+        futures = [(row, self.fetchers.submit(self._fetch, row[1], row[3], row[4])) for row in due]
+        changed = 0
+        for (resource_id, url, title, _, _, content_hash, _), future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                c.execute('UPDATE legal_resources SET error = ? WHERE resource_id = ?', (str(e), resource_id))
+                continue
+            changed += self._store(conn, resource_id, url, title, content_hash, result)
+        conn.commit()
+        return changed
+
+    def _lookup(self, conn, state):
+        c = conn.cursor()
+        query = QUERY.format(state=state)
+        try:
+            response = self.session.get(f'{self.search_url}?q={quote(query)}', timeout=TIMEOUT)
+            response.raise_for_status()
+        except Exception as e:
+            # Rate limited or offline: keep what's saved and try again next time.
+            c.execute('INSERT INTO legal_lookups VALUES (?, NULL, NULL, ?) '
+                      'ON CONFLICT(state) DO UPDATE SET error = excluded.error', (state, str(e)))
+            conn.commit()
+            return
+        for url, title in search_results(response.text)[:MAX_RESULTS]:
+            # Results dropped from a later search stay saved; statutes rarely move.
+            c.execute('INSERT OR IGNORE INTO legal_resources VALUES '
+                      '(NULL, NULL, ?, ?, ?, ?, NULL, NULL, NULL, NULL, 0, NULL, NULL, NULL)',
+                      (state, classify(url, title), title, url))
+        c.execute('INSERT OR REPLACE INTO legal_lookups VALUES (?, ?, ?, NULL)', (state, STORE_VERSION, _now()))
+        conn.commit()
+
+    def _fetch(self, url, etag, last_modified):
+        # None means not modified; otherwise (title, text, etag, last_modified).
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with self.session.get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            data = b''
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > MAX_BYTES:
+                    return None, None, response.headers.get('ETag'), response.headers.get('Last-Modified')
+            title, text = page_text(data, content_type)
+            return title, text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def _store(self, conn, resource_id, url, title, content_hash, result):
+        c = conn.cursor()
+        now = _now()
+        if result is None:
+            c.execute('UPDATE legal_resources SET checked_at = ?, error = NULL WHERE resource_id = ?',
+                      (now, resource_id))
+            return 0
+        page_title, text, etag, last_modified = result
+        new_hash = hashlib.sha256(text.encode()).hexdigest() if text is not None else None
+        if new_hash == content_hash:
+            # Same text under a new validator; the index is left alone.
+            c.execute('UPDATE legal_resources SET etag = ?, last_modified = ?, checked_at = ?, error = NULL '
+                      'WHERE resource_id = ?', (etag, last_modified, now, resource_id))
+            return 0
+        title = page_title or title
+        c.execute('''UPDATE legal_resources SET kind = ?, title = ?, content = ?, content_hash = ?, etag = ?,
+                     last_modified = ?, version = version + 1, fetched_at = ?, checked_at = ?, error = NULL
+                     WHERE resource_id = ?''',
+                  (classify(url, title), title, text, new_hash, etag, last_modified, now, now, resource_id))
+        return 1
@@ -0,0 +1,199 @@
+import datetime
+import hashlib
+import os
+import random
+import threading
+
+import diagnostics
+
+DEFAULT_MODEL = os.environ.get('CASE_MANAGER_MODEL', 'gpt-4o-mini')
+MAX_CONNECTIONS = 8
+MAX_RETRIES = 5
+# Responses are kept in the encrypted case database; least recently used
+# entries are evicted once the cache grows past this many bytes.
+CACHE_BYTES = 50 * 1024 * 1024
+
+def ensure_schema(conn):
+    conn.cursor().execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT,
+        response TEXT,
+        size INTEGER,
+        created_at TEXT,
+        last_used TEXT
+    )''')
+
+
+def cache_key(model, prompt, json_mode):
+    return hashlib.sha256(f'{model}\0{int(json_mode)}\0{prompt}'.encode('utf-8')).hexdigest()
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='microseconds')
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """One shared OpenAI-compatible client for the whole app.
+
+    Requests run on a private asyncio loop in a background thread over a single
+    pooled HTTP client, so callers on any thread can use ``complete`` (blocking)
+    or ``submit`` (returns a concurrent.futures.Future) without freezing the UI.
+    Identical (model, prompt) pairs are answered from ``llm_cache``; ``connect``
+    opens the cache connection, which is only ever used on the loop thread.
+    """
+
+    def __init__(self, api_key, connect=None, base_url=None, max_connections=MAX_CONNECTIONS,
+                 max_retries=MAX_RETRIES, cache_bytes=CACHE_BYTES):
+        self.api_key = api_key
+        self.base_url = base_url or os.environ.get('OPENAI_BASE_URL')
+        self.connect = connect
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.cache_bytes = cache_bytes
+        self.cache_conn = None
+        self.client = None
+        # asyncio is imported here rather than at module load: db imports this
+        # module for its schema and the app's first frame shouldn't wait for it.
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='llm', daemon=True)
+        self.thread.start()
+
+    def _client(self):
+        # openai and httpx are imported here, not at module load, so the app
+        # starts without them; the first request pays for the import.
+        import httpx
+        import openai
+
+        if self.client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self.client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0,
+                                             http_client=openai.DefaultAsyncHttpxClient(limits=limits))
+        return self.client
+
+    def _cache(self):
+        if self.cache_conn is None and self.connect:
+            self.cache_conn = self.connect()
+            ensure_schema(self.cache_conn)
+            self.cache_conn.commit()
+        return self.cache_conn
+
+    def _cache_get(self, key):
+        conn = self._cache()
+        if conn is None:
+            return None
+        c = conn.cursor()
+        c.execute('SELECT response FROM llm_cache WHERE cache_key=?', (key,))
+        row = c.fetchone()
+        if row:
+            c.execute('UPDATE llm_cache SET last_used=? WHERE cache_key=?', (_now(), key))
+            conn.commit()
+            return row[0]
+        return None
+
+    def _cache_put(self, key, model, response):
+        conn = self._cache()
+        if conn is None:
+            return
+        now = _now()
+        c = conn.cursor()
+        c.execute('INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)',
+                  (key, model, response, len(response.encode('utf-8')), now, now))
+        c.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache')
+        excess = c.fetchone()[0] - self.cache_bytes
+        if excess > 0:
+            c.execute('SELECT cache_key, size FROM llm_cache ORDER BY last_used')
+            evict = []
+            for old_key, size in c.fetchall():
+                if excess <= 0:
+                    break
+                evict.append((old_key,))
+                excess -= size
+            c.executemany('DELETE FROM llm_cache WHERE cache_key=?', evict)
+        conn.commit()
+
+    async def _stream(self, prompt, model, json_mode, on_token):
+        kwargs = {'response_format': {'type': 'json_object'}} if json_mode else {}
+        stream = await self._client().chat.completions.create(
+            model=model, messages=[{'role': 'user', 'content': prompt}], stream=True, **kwargs)
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                # Streamed chunks are about one token each.
+                diagnostics.count('tokens')
+                parts.append(delta)
+                if on_token:
+                    on_token(delta)
+        return ''.join(parts)
+
+    async def acomplete(self, prompt, model=DEFAULT_MODEL, json_mode=False, on_token=None, use_cache=True):
+        with diagnostics.span('llm.complete', model=model):
+            diagnostics.count('prompt_chars', len(prompt))
+            return await self._complete(prompt, model, json_mode, on_token, use_cache)
+
+    async def _complete(self, prompt, model, json_mode, on_token, use_cache):
+        import asyncio
+
+        import openai
+
+        key = cache_key(model, prompt, json_mode)
+        if use_cache:
+            with diagnostics.span('cache.get'):
+                cached = self._cache_get(key)
+            if cached is not None:
+                diagnostics.count('cache_hits')
+                if on_token:
+                    on_token(cached)
+                return cached
+        retryable = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                     openai.InternalServerError)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with diagnostics.span('llm.request'):
+                    response = await self._stream(prompt, model, json_mode, on_token)
+                break
+            except retryable as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_after(e) or min(60, 2 ** attempt) * (0.5 + random.random())
+                if on_token:
+                    # Tell the listener to discard the partial output before the retry.
+                    on_token(None)
+                await asyncio.sleep(delay)
+        if use_cache:
+            with diagnostics.span('cache.put'):
+                self._cache_put(key, model, response)
+        return response
+
+    def submit(self, prompt, model=DEFAULT_MODEL, json_mode=False, on_token=None, use_cache=True):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(
+            self.acomplete(prompt, model, json_mode, on_token, use_cache), self.loop)
+
+    def complete(self, prompt, model=DEFAULT_MODEL, json_mode=False, on_token=None, use_cache=True, timeout=None):
+        return self.submit(prompt, model, json_mode, on_token, use_cache).result(timeout)
+
+    def close(self):
+        import asyncio
+
+        async def shutdown():
+            if self.client is not None:
+                await self.client.close()
+            if self.cache_conn is not None:
+                self.cache_conn.close()
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
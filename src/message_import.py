@@ -0,0 +1,436 @@
+import argparse
+import base64
+import datetime
+import email
+import email.errors
+import email.header
+import email.utils
+import getpass
+import html
+import io
+import mailbox
+import mimetypes
+import os
+import re
+import sqlite3
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import attachments
+import contacts
+import db
+import evidence_store
+
+BATCH_SIZE = 1000
+ME = 'Me'
+
+# SMS Backup & Restore: sms type / mms msg_box 2 is sent, and in an MMS's
+# addrs, type 137 is the sender and 151 a recipient.
+_SENT = '2'
+_MMS_FROM = '137'
+_MMS_TO = '151'
+# iOS stores dates since 2001-01-01, in nanoseconds since iOS 11.
+_APPLE_EPOCH = 978307200
+_TAGS = re.compile(r'<(script|style)\b.*?</\1>|<[^>]+>', re.S | re.I)
+
+Message = namedtuple('Message', 'kind date sender recipient subject body attachments')
+# An attachment has either the bytes (data) or an existing file (path).
+Attachment = namedtuple('Attachment', 'name mime data path')
+
+
+def _local_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _person(name, address):
+    name = (name or '').strip()
+    if not name or name == '(Unknown)' or name == address:
+        return address or name or 'Unknown'
+    return f'{name} <{address}>' if address else name
+
+
+# Readers. Each yields Messages one at a time and appends (where, error) to
+# errors for entries it can't read, then carries on with the next one.
+
+def read_sms_backup(path, errors):
+    """Android "SMS Backup & Restore" XML, read element by element."""
+    context = ET.iterparse(path, events=('start', 'end'))
+    root = None
+    for event, elem in context:
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag not in ('sms', 'mms'):
+            continue
+        try:
+            yield _sms(elem) if elem.tag == 'sms' else _mms(elem)
+        except Exception as e:
+            errors.append((f"{path}: {elem.tag} {elem.get('date')}", str(e)))
+        # Drop what's been read so memory stays flat on huge backups.
+        root.clear()
+
+
+def _sms(elem):
+    person = _person(elem.get('contact_name'), elem.get('address'))
+    sent = elem.get('type') == _SENT
+    return Message('text', _local_time(int(elem.get('date')) / 1000), ME if sent else person,
+                   person if sent else ME, '', elem.get('body') or '', [])
+
+
+def _mms(elem):
+    texts, attachments = [], []
+    for part in elem.iter('part'):
+        mime = part.get('ct') or ''
+        if mime == 'text/plain':
+            texts.append(part.get('text') or '')
+        elif mime != 'application/smil' and part.get('data'):
+            name = part.get('cl') or part.get('name') or f"part{part.get('seq')}{mimetypes.guess_extension(mime) or ''}"
+            attachments.append(Attachment(name, mime, base64.b64decode(part.get('data')), None))
+    name = elem.get('contact_name')
+    sender = recipient = None
+    for addr in elem.iter('addr'):
+        if addr.get('type') == _MMS_FROM and sender is None:
+            sender = addr.get('address')
+        elif addr.get('type') == _MMS_TO and recipient is None:
+            recipient = addr.get('address')
+    sent = elem.get('msg_box') == _SENT
+    if sent:
+        sender, recipient = ME, _person(name, recipient or elem.get('address'))
+    else:
+        sender, recipient = _person(name, sender or elem.get('address')), ME
+    return Message('text', _local_time(int(elem.get('date')) / 1000), sender, recipient, '',
+                   '\n'.join(texts), attachments)
+
+
+def read_ios_sms(path, errors):
+    """A copy of an iPhone's sms.db (a plain SQLite database, from a backup)."""
+    folder = os.path.dirname(os.path.abspath(path))
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT m.ROWID, m.text, m.attributedBody, m.date, m.is_from_me, h.id
+                     FROM message m LEFT JOIN handle h ON h.ROWID = m.handle_id ORDER BY m.ROWID''')
+        attachments = conn.cursor()
+        for rowid, text, body, date, from_me, handle in c:
+            try:
+                date = date / 1e9 if date > 1e11 else date
+                text = text if text is not None else _attributed_text(body)
+                attachments.execute('''SELECT a.filename, a.mime_type, a.transfer_name
+                                       FROM message_attachment_join j JOIN attachment a ON a.ROWID = j.attachment_id
+                                       WHERE j.message_id=?''', (rowid,))
+                files = [_ios_attachment(folder, *row) for row in attachments.fetchall()]
+                handle = handle or 'Unknown'
+                yield Message('text', _local_time(date + _APPLE_EPOCH), ME if from_me else handle,
+                              handle if from_me else ME, '', (text or '').replace('\ufffc', '').strip(),
+                              [a for a in files if a])
+            except Exception as e:
+                errors.append((f'{path}: message {rowid}', str(e)))
+    finally:
+        conn.close()
+
+
+def _attributed_text(blob):
+    # Newer iOS leaves text NULL and keeps it in a serialized NSAttributedString:
+    # the string follows b'NSString', a '+' and its length (0x81 + 2 bytes if long).
+    if not blob:
+        return ''
+    start = blob.find(b'NSString')
+    start = blob.find(b'+', start) if start >= 0 else -1
+    if start < 0:
+        return ''
+    length, start = blob[start + 1], start + 2
+    if length == 0x81:
+        length, start = int.from_bytes(blob[start:start + 2], 'little'), start + 2
+    return blob[start:start + length].decode('utf-8', 'replace')
+
+
+def _ios_attachment(folder, filename, mime, transfer_name):
+    # Paths are like ~/Library/SMS/Attachments/ab/11/<guid>/IMG_0001.HEIC; a
+    # copied backup keeps the Attachments folder next to sms.db.
+    if not filename:
+        return None
+    relative = filename.split('Library/SMS/', 1)[-1].lstrip('~/')
+    for candidate in (os.path.join(folder, relative), os.path.join(folder, os.path.basename(filename))):
+        if os.path.isfile(candidate):
+            return Attachment(transfer_name or os.path.basename(filename), mime or '', None, candidate)
+    return None
+
+
+def read_mbox(path, errors):
+    """A Unix mbox file (Gmail Takeout, Thunderbird), one message at a time."""
+    box = mailbox.mbox(path, create=False)
+    for key in box.iterkeys():
+        try:
+            yield _email(box[key])
+        except Exception as e:
+            errors.append((f'{path}: message {key}', str(e)))
+
+
+def read_eml_folder(path, errors):
+    """Every .eml file under a folder."""
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith('.eml'):
+                yield from read_eml(os.path.join(dirpath, name), errors)
+
+
+def read_eml(path, errors):
+    try:
+        with open(path, 'rb') as f:
+            message = email.message_from_binary_file(f)
+        yield _email(message)
+    except Exception as e:
+        errors.append((path, str(e)))
+
+
+# Messages are parsed with the default compat32 policy: email.policy.default
+# parses every header into objects, which made importing ten times slower.
+
+def _email(message):
+    try:
+        sent = email.utils.parsedate_to_datetime(message['date'])
+    except (TypeError, ValueError):
+        sent = None
+    if sent is not None and sent.tzinfo is not None:
+        sent = sent.astimezone().replace(tzinfo=None)
+    return Message('email', sent.strftime('%Y-%m-%d %H:%M:%S') if sent else 'Unknown',
+                   _address(message['from']), _address(message['to']), _header(message['subject']),
+                   _email_body(message), [])
+
+
+def _header(value):
+    if not value:
+        return ''
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except (LookupError, UnicodeError, email.errors.HeaderParseError):
+        return str(value)
+
+
+def _address(value):
+    addresses = email.utils.getaddresses([str(value or '')])
+    name, address = addresses[0] if addresses else ('', '')
+    name = _header(name)
+    return email.utils.formataddr((name, address)) if address else (name or 'Unknown')
+
+
+def _email_body(message):
+    parts = {}
+    for part in message.walk():
+        if not part.is_multipart() and part.get_content_disposition() != 'attachment':
+            parts.setdefault(part.get_content_type(), part)
+    part = parts.get('text/plain') or parts.get('text/html')
+    if part is None:
+        return ''
+    payload = part.get_payload(decode=True) or b''
+    try:
+        text = payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+    except LookupError:
+        text = payload.decode('utf-8', 'replace')
+    if part.get_content_type() == 'text/html':
+        text = html.unescape(_TAGS.sub(' ', text))
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+READERS = {
+    'sms_backup': read_sms_backup,
+    'ios_sms': read_ios_sms,
+    'mbox': read_mbox,
+    'eml': read_eml_folder,
+}
+
+
+def detect(path):
+    """Name the reader for path, or None if it isn't an archive we know."""
+    if os.path.isdir(path):
+        return 'eml'
+    lower = path.lower()
+    if lower.endswith('.eml'):
+        return 'eml'
+    with open(path, 'rb') as f:
+        head = f.read(512)
+    if head.startswith(b'SQLite format 3'):
+        return 'ios_sms'
+    if head.startswith(b'From ') or lower.endswith('.mbox'):
+        return 'mbox'
+    if head.lstrip().startswith(b'<?xml') and (b'<smses' in head or b'<sms ' in head or lower.endswith('.xml')):
+        return 'sms_backup'
+    return None
+
+
+def read(path, errors):
+    kind = detect(path)
+    if kind is None:
+        raise ValueError(f'Not a message archive: {path}')
+    if kind == 'eml' and not os.path.isdir(path):
+        return read_eml(path, errors)
+    return READERS[kind](path, errors)
+
+
+class MessageImporter:
+    """Stream an SMS backup, sms.db, mbox or .eml folder into one case.
+
+    Messages are read one at a time and written with executemany in
+    transactions of ``batch_size``, each with its timeline event. Senders go
+    through a ContactResolver, messages already in the case are skipped, and
+    MMS/iMessage attachments are copied into the encrypted attachment store
+    and recorded as evidence. One that only exists inside the backup is
+    never written out in plain text; it's recorded under
+    attachments.stored_path.
+    """
+
+    def __init__(self, conn, case_id, batch_size=BATCH_SIZE, on_file=None, progress=None):
+        self.conn = conn
+        self.case_id = case_id
+        self.batch_size = batch_size
+        self.on_file = on_file
+        self.progress = progress
+        # Between flushes nothing else is written, so new contacts are
+        # committed as they're made rather than holding the write lock until
+        # the batch is.
+        self.contacts = contacts.ContactResolver(conn, case_id, commit=True)
+        self.store = None
+        self.seen = self._existing()
+        self._reset_batch()
+
+    def _existing(self):
+        # Fingerprints of what's already imported, so re-importing a newer
+        # backup only adds the new messages.
+        seen = set()
+        c = self.conn.cursor()
+        c.execute('SELECT msg_date, sender_id, content FROM text_messages WHERE case_id=?', (self.case_id,))
+        seen.update(hash(('text',) + row) for row in c)
+        c.execute('SELECT email_date, sender_id, subject, content FROM emails WHERE case_id=?', (self.case_id,))
+        seen.update(hash(('email',) + row) for row in c)
+        return seen
+
+    def _reset_batch(self):
+        self.batch = {'text_messages': [], 'emails': [], 'events': []}
+        self.batch_files = []
+
+    def run(self, path):
+        stats = {'texts': 0, 'emails': 0, 'attachments': 0, 'duplicates': 0, 'errors': []}
+        start = time.perf_counter()
+        try:
+            for message in read(path, stats['errors']):
+                self._add(message, stats)
+                if len(self.batch['events']) >= self.batch_size:
+                    self.flush()
+                    if self.progress:
+                        self.progress(stats['texts'] + stats['emails'])
+        finally:
+            # Keep what was read before a truncated or corrupt archive failed.
+            self.flush()
+        stats['failed'] = len(stats['errors'])
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def _add(self, message, stats):
+        sender_id = self.contacts.resolve(message.sender)
+        recipient_id = self.contacts.resolve(message.recipient)
+        sort_date = db.normalize_date(message.date)
+        if message.kind == 'email':
+            key = hash(('email', message.date, sender_id, message.subject, message.body))
+        else:
+            body = '\n'.join([message.body] + [f'[Attachment: {a.name}]' for a in message.attachments]).strip()
+            key = hash(('text', message.date, sender_id, body))
+        if key in self.seen:
+            stats['duplicates'] += 1
+            return
+        self.seen.add(key)
+        if message.kind == 'email':
+            self.batch['emails'].append((self.case_id, message.date, sender_id, recipient_id, message.subject,
+                                         message.body, 0, sort_date))
+            self.batch['events'].append((self.case_id, message.date, f"Email from {message.sender}: {message.subject}",
+                                         'Email', sort_date))
+            stats['emails'] += 1
+            return
+        files = [self._save(attachment) for attachment in message.attachments]
+        is_image = int(any(mime.startswith('image/') for _, _, mime, _ in files))
+        self.batch['text_messages'].append((self.case_id, message.date, sender_id, recipient_id, body, is_image,
+                                            sort_date))
+        self.batch['events'].append((self.case_id, message.date,
+                                     f"Text message from {message.sender} to {message.recipient}", 'Text Message',
+                                     sort_date))
+        self.batch_files.append((len(self.batch['text_messages']) - 1, files))
+        stats['texts'] += 1
+        stats['attachments'] += len(files)
+
+    def _save(self, attachment):
+        """Return (file_path, name, mime, (sha256, size, chunk ids)) with the attachment stored."""
+        if self.store is None:
+            self.store = attachments.store(self.conn)
+        if attachment.path:
+            return attachment.path, attachment.name, attachment.mime, self.store.write(attachment.path)
+        stored = self.store.write_stream(io.BytesIO(attachment.data))
+        extension = os.path.splitext(attachment.name)[1] or mimetypes.guess_extension(attachment.mime) or ''
+        return attachments.stored_path(self.conn, stored[0], extension), attachment.name, attachment.mime, stored
+
+    def _first_inserted_id(self, table, count):
+        # As in bulk_import: AUTOINCREMENT ids are contiguous inside our transaction.
+        c = self.conn.cursor()
+        c.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,))
+        return c.fetchone()[0] - count + 1
+
+    def flush(self):
+        if not self.batch['events']:
+            return
+        c = self.conn.cursor()
+        c.executemany('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)', self.batch['text_messages'])
+        c.executemany('INSERT INTO emails VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)', self.batch['emails'])
+        c.executemany('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)', self.batch['events'])
+        uploads = []
+        if self.batch_files:
+            first_id = self._first_inserted_id('text_messages', len(self.batch['text_messages']))
+            for row, files in self.batch_files:
+                for file_path, name, mime, (sha256, size, chunk_ids) in files:
+                    kind = 'text_image' if mime.startswith('image/') else 'attachment'
+                    attachments.save(self.conn, sha256, size, chunk_ids)
+                    evidence_store.remember(self.conn, sha256, size, kind, None, file_path)
+                    evidence_store.link(self.conn, sha256, self.case_id, 'text_messages', first_id + row)
+                    uploads.append((file_path, name, sha256))
+        self.conn.commit()
+        if self.on_file:
+            for file_path, name, sha256 in uploads:
+                self.on_file(file_path, name, sha256)
+        self._reset_batch()
+
+
+def format_stats(stats):
+    seconds = max(stats['seconds'], 1e-9)
+    messages = stats['texts'] + stats['emails']
+    return (f"Imported {stats['texts']} text messages and {stats['emails']} emails "
+            f"({stats['attachments']} attachments) in {seconds:.1f}s: {messages / seconds:.0f} messages/sec. "
+            f"Duplicates skipped: {stats['duplicates']}. Failed: {stats['failed']}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Import an SMS Backup & Restore XML, iOS sms.db, mbox or folder of .eml files into a case.')
+    parser.add_argument('path')
+    parser.add_argument('--case-id', type=int, required=True)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    password = os.environ.get('CASE_MANAGER_PASSWORD') or getpass.getpass('Database password: ')
+    conn = db.connect(password, args.db)
+    db.init_schema(conn)
+
+    def progress(done):
+        print(f"\r{done} messages", end='', file=sys.stderr)
+
+    importer = MessageImporter(conn, args.case_id, batch_size=args.batch_size, progress=progress)
+    stats = importer.run(args.path)
+    print(file=sys.stderr)
+    for where, error in stats['errors']:
+        print(f"Failed: {where}: {error}", file=sys.stderr)
+    print(format_stats(stats))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import search_index
+
+PAGE_SIZE = 100
+
+# Paged reads for the app's result lists. Each *_page function takes the
+# token returned by the previous call (None for the first page) and returns
+# (rows, next token); the next token is None after the last page.
+#
+# Dated tables are read in (sort_date, id) order and continue from the last
+# row's key rather than an OFFSET, so page 1,000 costs the same as page 1.
+
+# table: (id column, label, title, date, body) for rows that aren't in
+# search_index.SOURCES.
+RECORDS = {
+    'events': ('event_id', 'Event', 'event_type', 'event_date', 'description'),
+    'calendar_events': ('cal_id', 'Calendar', 'title', 'event_date', 'description'),
+}
+
+
+def dated_page(conn, table, id_col, columns, case_id, after=None, limit=PAGE_SIZE):
+    """Rows (id, *columns) of one case in date order, starting after the key ``after``."""
+    if after is None:
+        where, params = '', ()
+    elif after[0] is None:
+        # Undated rows sort first.
+        where, params = f' AND ((sort_date IS NULL AND {id_col} > ?) OR sort_date IS NOT NULL)', (after[1],)
+    else:
+        where, params = f' AND (sort_date, {id_col}) > (?, ?)', after
+    c = conn.cursor()
+    c.execute(f'SELECT {id_col}, {", ".join(columns)}, sort_date FROM {table} WHERE case_id=?{where} '
+              f'ORDER BY sort_date, {id_col} LIMIT ?', (case_id,) + tuple(params) + (limit,))
+    rows = c.fetchall()
+    next_key = (rows[-1][-1], rows[-1][0]) if len(rows) == limit else None
+    return [row[:-1] for row in rows], next_key
+
+
+def timeline_page(conn, case_id, after=None, limit=PAGE_SIZE):
+    return dated_page(conn, 'events', 'event_id', ('event_date', 'event_type', 'description'), case_id, after,
+                      limit)
+
+
+def calendar_page(conn, case_id, after=None, limit=PAGE_SIZE):
+    return dated_page(conn, 'calendar_events', 'cal_id', ('event_date', 'title', 'description'), case_id, after,
+                      limit)
+
+
+def search_page(conn, case_id, query, offset=None, limit=PAGE_SIZE):
+    # Hits are ranked, so these pages do use an offset.
+    offset = offset or 0
+    hits = search_index.search(conn, case_id, query, limit, offset)
+    return hits, offset + limit if len(hits) == limit else None
+
+
+def fixed(rows):
+    """A fetch function with one page of ready-made rows."""
+    return lambda token: (rows, None)
+
+
+def chain(fetchers):
+    """Page through several fetch(token) functions one after another."""
+    def fetch(token):
+        index, inner = token or (0, None)
+        rows, inner = fetchers[index](inner)
+        if inner is None:
+            index, inner = index + 1, None
+        return rows, (index, inner) if index < len(fetchers) else None
+    return fetch
+
+
+def source_record(conn, case_id, source, source_id):
+    """Return (label, title, date, body) of one case's evidence row, or None if it's gone or another case's.
+
+    Shared rows (search_index.CASE_IDS, e.g. saved legal resources) belong to
+    every case.
+    """
+    if source in RECORDS:
+        id_col, label, title, date, body = RECORDS[source]
+        sql = f'SELECT {title}, {date}, {body} FROM {source} WHERE {id_col}=?'
+    else:
+        table, id_col, title, body, date, _ = next(s for s in search_index.SOURCES if s[0] == source)
+        label = search_index.SOURCE_LABELS[source]
+        sql = f'SELECT {title}, {date}, {body} FROM {table} WHERE {table}.{id_col}=?'.format(row=table)
+    params = (source_id,)
+    if source not in search_index.CASE_IDS:
+        sql += ' AND case_id=?'
+        params += (case_id,)
+    c = conn.cursor()
+    c.execute(sql, params)
+    row = c.fetchone()
+    return (label,) + tuple(row) if row else None
@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import diagnostics
+
+# Pages with less extractable text than this are treated as scans and OCR'd.
+MIN_TEXT_CHARS = 25
+OCR_DPI = 300
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS document_pages (
+        page_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        doc_id INTEGER,
+        page_no INTEGER,
+        content TEXT,
+        ocr INTEGER,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id),
+        FOREIGN KEY(doc_id) REFERENCES documents(doc_id)
+    )''')
+
+
+def store_pages(conn, case_id, doc_id, pages):
+    conn.cursor().executemany('INSERT INTO document_pages VALUES (NULL, ?, ?, ?, ?, ?)',
+                              [(case_id, doc_id, page_no, text, ocr) for page_no, text, ocr in pages])
+
+
+def page_count(file_path):
+    import PyPDF2
+
+    with open(file_path, 'rb') as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _ocr_page(pdf, index, dpi):
+    import pytesseract
+
+    page = pdf[index]
+    try:
+        bitmap = page.render(scale=dpi / 72, grayscale=True)
+        return pytesseract.image_to_string(bitmap.to_pil())
+    finally:
+        page.close()
+
+
+def extract_range(file_path, start, stop, dpi=OCR_DPI):
+    """Return [page_no, text, ocr] for pages start..stop-1 (page_no is 1-based)."""
+    import PyPDF2
+    import pypdfium2 as pdfium
+
+    # Tesseract's own OpenMP threads would fight the process pool for cores.
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    pages = []
+    scanned = None
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        for index in range(start, stop):
+            with diagnostics.span('pdf.text'):
+                text = reader.pages[index].extract_text() or ''
+            ocr = 0
+            if len(text.strip()) < MIN_TEXT_CHARS:
+                if scanned is None:
+                    scanned = pdfium.PdfDocument(file_path)
+                with diagnostics.span('ocr'):
+                    text = _ocr_page(scanned, index, dpi)
+                ocr = 1
+            pages.append([index + 1, text, ocr])
+    if scanned is not None:
+        scanned.close()
+    return pages
+
+
+def extract_pages(file_path, executor=None, workers=None):
+    """Extract every page, OCR'ing pages without a text layer.
+
+    With an executor the page ranges are spread over it (a process pool), with
+    several small ranges per worker so a run of scanned pages doesn't end up
+    on one core. Without one the pages are read in-process.
+    """
+    count = page_count(file_path)
+    diagnostics.count('pages', count)
+    if executor is None or count < 2:
+        pages = extract_range(file_path, 0, count)
+        diagnostics.count('ocr_pages', sum(ocr for _, _, ocr in pages))
+        return pages
+    workers = workers or getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+    step = max(1, count // (workers * 4))
+    futures = [executor.submit(extract_range, file_path, start, min(start + step, count))
+               for start in range(0, count, step)]
+    pages = []
+    # Pages are read in the worker processes; their time shows up here as waiting.
+    with diagnostics.span('pdf.pool'):
+        for future in futures:
+            pages.extend(future.result())
+    diagnostics.count('ocr_pages', sum(ocr for _, _, ocr in pages))
+    return pages
+
+
+def extract_pdf(file_path, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return extract_pages(file_path, pool, workers)
@@ -0,0 +1,261 @@
+import os
+from collections import namedtuple
+
+import diagnostics
+
+PAGE_MARGIN = 54
+FONT = 'Helvetica'
+BOLD_FONT = 'Helvetica-Bold'
+FONT_SIZE = 10
+LEADING = 13
+TITLE_SIZE = 16
+HEADING_SIZE = 13
+
+# Generated reports are written to REPORT_DIR under per-case names; see report_path.
+REPORT_DIR = 'reports'
+TIMELINE_PDF = 'timeline.pdf'
+CUSTOM_REPORT_PDF = 'custom_report.pdf'
+LIE_DETECTION_PDF = 'lie_detection.pdf'
+MOTION_DOCX = 'motion.docx'
+
+# lines is any iterable of strings, usually a generator over a DB cursor, so a
+# section is read one row at a time while its pages are drawn.
+Section = namedtuple('Section', 'title lines')
+
+Rendered = namedtuple('Rendered', 'pages lines')
+
+
+def report_path(case_id, name):
+    """The file a case's report called ``name`` is written to, creating REPORT_DIR.
+
+    Each case has its own, so Drive sync (which tracks files by path, per
+    case) never sends one case's report to another case's folder.
+    """
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    return os.path.join(REPORT_DIR, f'case_{case_id}_{name}')
+
+
+def query_lines(conn, sql, params, format_row):
+    """Yield one formatted line per row without fetching the whole result."""
+    c = conn.cursor()
+    c.execute(sql, params)
+    for row in c:
+        yield format_row(row)
+
+
+class ReportWriter:
+    """Draws a PDF one page at a time with reportlab's canvas.
+
+    Lines are wrapped to the page width and each page gets a running header
+    and a "Page N of M" footer. With more than one section, a contents page
+    lists the page each section starts on. Page numbers that aren't known
+    yet (the total, and the contents entries) are drawn as PDF forms that
+    are filled in by finish(), so nothing is laid out twice.
+    """
+
+    def __init__(self, path, title, section_titles=()):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+
+        self.canvas = canvas.Canvas(path, pagesize=letter, pageCompression=1)
+        self.canvas.setTitle(title)
+        self.width, self.height = letter
+        self.text_width = self.width - 2 * PAGE_MARGIN
+        self.title = title
+        self.section = ''
+        self.page = 0
+        self.y = 0
+        self.lines = 0
+        self.section_pages = []
+        self.widths = {}
+        self.toc_titles = list(section_titles) if len(section_titles) > 1 else []
+
+    def _new_page(self):
+        if self.page:
+            self._end_page()
+        self.page += 1
+        c = self.canvas
+        c.setFont(FONT, 8)
+        c.drawString(PAGE_MARGIN, self.height - PAGE_MARGIN / 2, self.title)
+        c.drawRightString(self.width - PAGE_MARGIN, self.height - PAGE_MARGIN / 2, self.section)
+        footer = f'Page {self.page} of '
+        c.drawString(self.width / 2 - 30, PAGE_MARGIN / 2, footer)
+        self._draw_form('page_count', self.width / 2 - 30 + c.stringWidth(footer, FONT, 8), PAGE_MARGIN / 2)
+        self.y = self.height - PAGE_MARGIN
+        # Body lines go into one text object per page, much cheaper than a drawString each.
+        self.text = c.beginText()
+        self.font = None
+
+    def _end_page(self):
+        self.canvas.drawText(self.text)
+        self.canvas.showPage()
+
+    def _draw_form(self, name, x, y):
+        self.canvas.saveState()
+        self.canvas.translate(x, y)
+        self.canvas.doForm(name)
+        self.canvas.restoreState()
+
+    def _space(self, height):
+        if self.y - height < PAGE_MARGIN:
+            self._new_page()
+
+    def _width(self, word, font, size):
+        key = (word, font, size)
+        width = self.widths.get(key)
+        if width is None:
+            if len(self.widths) > 100000:
+                self.widths.clear()
+            width = self.widths[key] = self.canvas.stringWidth(word, font, size)
+        return width
+
+    def _wrap(self, text, font, size):
+        # Greedy wrap at spaces; words wider than the page (URLs, hashes) are cut.
+        space = self._width(' ', font, size)
+        line, line_width = [], 0
+        for word in text.split(' '):
+            width = self._width(word, font, size)
+            while width > self.text_width:
+                if line:
+                    yield ' '.join(line)
+                    line, line_width = [], 0
+                cut = max(1, int(len(word) * self.text_width / width))
+                yield word[:cut]
+                word = word[cut:]
+                width = self._width(word, font, size)
+            if line and line_width + space + width > self.text_width:
+                yield ' '.join(line)
+                line, line_width = [], 0
+            line_width += width + (space if line else 0)
+            line.append(word)
+        yield ' '.join(line)
+
+    def write_line(self, text, font=FONT, size=FONT_SIZE, leading=LEADING):
+        self.lines += 1
+        for line in self._wrap(' '.join(text.split()), font, size):
+            self._space(leading)
+            if self.font != (font, size):
+                self.text.setFont(font, size)
+                self.font = (font, size)
+            self.y -= leading
+            self.text.setTextOrigin(PAGE_MARGIN, self.y)
+            self.text.textOut(line)
+
+    def title_page(self, subtitle=None):
+        self._new_page()
+        self.y -= TITLE_SIZE * 2
+        self.canvas.setFont(BOLD_FONT, TITLE_SIZE)
+        self.canvas.drawString(PAGE_MARGIN, self.y, self.title)
+        if subtitle:
+            self.y -= LEADING * 2
+            self.write_line(subtitle)
+        if self.toc_titles:
+            self.y -= LEADING
+            self.write_line('Contents', BOLD_FONT, HEADING_SIZE, HEADING_SIZE * 1.5)
+            for number, title in enumerate(self.toc_titles):
+                self._space(LEADING)
+                self.y -= LEADING
+                self.canvas.setFont(FONT, FONT_SIZE)
+                self.canvas.drawString(PAGE_MARGIN + 12, self.y, title)
+                self._draw_form(f'toc{number}', self.width - PAGE_MARGIN, self.y)
+                self.canvas.linkRect('', f'section{number}',
+                                     (PAGE_MARGIN, self.y - 2, self.width - PAGE_MARGIN, self.y + FONT_SIZE))
+
+    def start_section(self, title, new_page=True):
+        number = len(self.section_pages)
+        self.section = title
+        if new_page or not self.page:
+            self._new_page()
+        else:
+            self._space(HEADING_SIZE * 3)
+            self.y -= LEADING
+        self.section_pages.append(self.page)
+        self.canvas.bookmarkPage(f'section{number}', fit='XYZ', top=self.y)
+        self.canvas.addOutlineEntry(title, f'section{number}', level=0)
+        self.write_line(title, BOLD_FONT, HEADING_SIZE, HEADING_SIZE * 1.5)
+        self.y -= LEADING / 2
+
+    def finish(self):
+        c = self.canvas
+        total = str(self.page)
+        c.beginForm('page_count', lowerx=0, lowery=0, upperx=60, uppery=10)
+        c.setFont(FONT, 8)
+        c.drawString(0, 0, total)
+        c.endForm()
+        for number in range(len(self.toc_titles)):
+            page = str(self.section_pages[number]) if number < len(self.section_pages) else ''
+            c.beginForm(f'toc{number}', lowerx=-60, lowery=0, upperx=0, uppery=FONT_SIZE + 2)
+            c.setFont(FONT, FONT_SIZE)
+            c.drawRightString(0, 0, page)
+            c.endForm()
+        self._end_page()
+        c.save()
+        return Rendered(self.page, self.lines)
+
+
+def render(path, title, sections, subtitle=None, new_page_per_section=True):
+    """Write sections to a paginated PDF at path and return (pages, lines).
+
+    Sections are consumed in order and their lines are never held all at
+    once, so memory stays flat however many rows the report has.
+    """
+    with diagnostics.span('report', title=title):
+        writer = ReportWriter(path, title, [section.title for section in sections])
+        writer.title_page(subtitle)
+        for section in sections:
+            writer.start_section(section.title, new_page_per_section)
+            lines = iter(section.lines)
+            while True:
+                # Rows are fetched as they're drawn; the two are timed apart.
+                with diagnostics.span('db.fetch'):
+                    line = next(lines, None)
+                if line is None:
+                    break
+                with diagnostics.span('pdf.draw'):
+                    writer.write_line(line)
+        with diagnostics.span('pdf.finish'):
+            rendered = writer.finish()
+        diagnostics.count('pages', rendered.pages)
+        diagnostics.count('lines', rendered.lines)
+    return rendered
+
+
+def timeline_sections(conn, case_id):
+    """One section per year of events, in date order; undated events come first."""
+    c = conn.cursor()
+    c.execute('SELECT DISTINCT substr(sort_date, 1, 4) FROM events WHERE case_id=? ORDER BY 1', (case_id,))
+    years = [row[0] for row in c.fetchall()]
+    sections = []
+    for year in years:
+        if year is None:
+            where, params = 'sort_date IS NULL', (case_id,)
+        else:
+            where, params = 'sort_date >= ? AND sort_date < ?', (case_id, year, f'{int(year) + 1:04d}')
+        sections.append(Section(year or 'Undated', query_lines(
+            conn, f'SELECT event_date, event_type, description FROM events WHERE case_id=? AND {where} '
+                  'ORDER BY sort_date, event_id', params,
+            lambda row: f"{row[0]}: {row[1]} - {row[2]}")))
+    return sections
+
+
+def custom_sections(conn, case_id, report_type):
+    report_type = report_type.lower()
+    sections = []
+    if 'document' in report_type:
+        sections.append(Section('Documents', query_lines(
+            conn, 'SELECT doc_name, doc_date, content FROM documents WHERE case_id=? ORDER BY sort_date, doc_id',
+            (case_id,), lambda row: f"Document: {row[0]} ({row[1]}): {_excerpt(row[2])}")))
+    if 'text' in report_type:
+        sections.append(Section('Text Messages', query_lines(
+            conn, 'SELECT msg_date, content FROM text_messages WHERE case_id=? ORDER BY sort_date, msg_id',
+            (case_id,), lambda row: f"Message: {row[0]}: {row[1]}")))
+    if 'email' in report_type:
+        sections.append(Section('Emails', query_lines(
+            conn, 'SELECT email_date, subject, content FROM emails WHERE case_id=? ORDER BY sort_date, email_id',
+            (case_id,), lambda row: f"Email: {row[0]} ({row[1]}): {row[2]}")))
+    return sections
+
+
+def _excerpt(text, limit=500):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit] + '...'
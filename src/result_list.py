@@ -0,0 +1,230 @@
+import textwrap
+
+from kivy.core.text import Label as CoreLabel
+from kivy.metrics import dp, sp
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.label import Label
+from kivy.properties import NumericProperty
+from kivy.uix.recyclelayout import RecycleLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+ROW_HEIGHT = dp(44)
+TEXT_ROW_HEIGHT = dp(22)
+FONT_SIZE = sp(14)
+# Fetch the next page while this many rows are still below the viewport.
+PREFETCH_ROWS = 60
+
+
+_char_widths = {}
+
+
+def _char_width():
+    # Average over mixed text; close enough to wrap proportional fonts by characters.
+    if FONT_SIZE not in _char_widths:
+        sample = 'abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789'
+        _char_widths[FONT_SIZE] = CoreLabel(font_size=FONT_SIZE).get_extents(sample)[0] / len(sample)
+    return _char_widths[FONT_SIZE]
+
+
+class _RowOptions:
+    """FixedRowLayout's view_opts: every row gets the same options, made on demand."""
+
+    def __init__(self, layout, count):
+        self.layout = layout
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        layout = self.layout
+        return {'size': [layout.width, layout.row_height], 'size_hint': [1, None],
+                'size_hint_min': [None, None], 'size_hint_max': [None, None], 'pos_hint': {},
+                'pos': [layout.x, layout.top - (index + 1) * layout.row_height],
+                'viewclass': layout.viewclass, 'width_none': False, 'height_none': False}
+
+
+class FixedRowLayout(RecycleLayout):
+    """A vertical RecycleView layout for rows that all have row_height.
+
+    RecycleBoxLayout keeps a dict and a position per row, walks all of them
+    whenever rows are appended and scans them to find the rows on screen.
+    With one row height both are arithmetic, so scrolling and paging cost
+    the same at 100 rows or 100,000.
+    """
+
+    row_height = NumericProperty(ROW_HEIGHT)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.placed = None
+        self.fbind('row_height', self._row_height_changed)
+        self.fbind('pos', self._trigger_layout)
+        self.fbind('size', self._trigger_layout)
+
+    def _row_height_changed(self, instance, value):
+        if self.recycleview is not None:
+            self.recycleview.refresh_from_data()
+
+    def compute_sizes_from_data(self, data, flags):
+        self.clear_layout()
+        self.view_opts = _RowOptions(self, len(data))
+
+    def compute_layout(self, data, flags):
+        self._size_needs_update = False
+        self.height = len(data) * self.row_height
+        # Rows are placed from the top, so they all move when the list grows
+        # or the width changes; lay the visible ones out again.
+        if self.placed != (self.top, self.width):
+            self.placed = (self.top, self.width)
+            self.clear_layout()
+
+    def get_view_index_at(self, pos):
+        count = len(self.view_opts)
+        index = int((self.top - pos[1]) // self.row_height)
+        return min(max(index, 0), max(count - 1, 0))
+
+    def compute_visible_views(self, data, viewport):
+        if not data:
+            return []
+        x, y, w, h = viewport
+        return list(range(self.get_view_index_at((x, y + h)), self.get_view_index_at((x, y)) + 1))
+
+
+class ResultRow(RecycleDataViewBehavior, ButtonBehavior, Label):
+    """One recycled row: a fixed-height label, cut to two lines."""
+
+    def __init__(self, **kwargs):
+        super().__init__(halign='left', valign='middle', shorten=True, shorten_from='right', max_lines=2,
+                         font_size=FONT_SIZE, **kwargs)
+        self.index = None
+        self.list = None
+        self.bind(size=self._fit_text)
+
+    def _fit_text(self, instance, size):
+        self.text_size = (size[0] - dp(8), size[1])
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        self.list = rv
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_release(self):
+        if self.list is not None:
+            self.list.open_row(self.index)
+
+
+class ResultList(RecycleView):
+    """A scrolling list that only builds widgets for the rows on screen.
+
+    show(fetch) pages rows in from ``fetch(token) -> (rows, next token)`` (see
+    pages.py) as the user scrolls, so a 100k row result costs one page up
+    front. Rows are dicts with 'text' plus anything on_open(row) needs,
+    called when a row is tapped. show_text() and append_text() display plain
+    text, such as a streamed report, as wrapped single-line rows.
+    """
+
+    def __init__(self, on_open=None, markup=False, **kwargs):
+        super().__init__(**kwargs)
+        self.on_open = on_open
+        self.markup = markup
+        self.layout = FixedRowLayout(size_hint_y=None)
+        self.layout.bind(height=self._keep_position)
+        self.add_widget(self.layout)
+        # Only takes effect once the layout manager has been added.
+        self.viewclass = ResultRow
+        self.anchor = None
+        self.rows = []
+        self.fetch = None
+        self.token = None
+        self.text = None
+        self.columns = None
+        self.bind(scroll_y=self._scrolled, width=self._rewrap)
+
+    def _reset(self, row_height):
+        self.layout.row_height = row_height
+        self.rows = []
+        self.data = []
+        self.fetch = None
+        self.token = None
+        self.text = None
+        self.anchor = None
+        self.scroll_y = 1
+
+    def show(self, fetch, empty_text='No results found.'):
+        self._reset(ROW_HEIGHT)
+        self.fetch = fetch
+        self.load_more()
+        if not self.rows:
+            self.add_rows([{'text': empty_text}])
+
+    def add_rows(self, rows):
+        self.rows.extend(rows)
+        self.data.extend({'text': row['text'], 'markup': self.markup} for row in rows)
+
+    def load_more(self):
+        # Empty pages can come back from pages.chain between sources; keep going.
+        while self.fetch is not None:
+            rows, self.token = self.fetch(self.token)
+            if self.token is None:
+                self.fetch = None
+            if rows:
+                # scroll_y is relative, so remember the distance from the top
+                # to stop the view jumping when the list grows.
+                self.anchor = (1 - self.scroll_y) * self._scrollable()
+                self.add_rows(rows)
+                return
+
+    def _scrollable(self):
+        return max(0, self.layout.height - self.height)
+
+    def _keep_position(self, instance, height):
+        if self.anchor is not None and self._scrollable():
+            self.scroll_y = max(0, 1 - self.anchor / self._scrollable())
+        self.anchor = None
+
+    def _scrolled(self, instance, scroll_y):
+        if self.fetch is None:
+            return
+        below = scroll_y * self._scrollable()
+        if below < PREFETCH_ROWS * self.layout.row_height:
+            self.load_more()
+
+    def open_row(self, index):
+        if self.on_open and index < len(self.rows):
+            self.on_open(self.rows[index])
+
+    # Plain text mode. Rows are wrapped lines so every row has the same
+    # height; the text is re-wrapped when the list changes width.
+
+    def _columns(self):
+        return max(20, int((self.width - dp(8)) / _char_width()))
+
+    def _wrap(self, paragraph):
+        return textwrap.wrap(paragraph, self.columns, replace_whitespace=False, drop_whitespace=True) or ['']
+
+    def show_text(self, text):
+        self._reset(TEXT_ROW_HEIGHT)
+        self.text = ''
+        self.columns = self._columns()
+        self.append_text(text)
+
+    def append_text(self, text):
+        if self.text is None:
+            return self.show_text(text)
+        # Only the last paragraph can change, so only it is re-wrapped.
+        start = self.text.rfind('\n') + 1
+        last = self.text[start:]
+        self.text += text
+        paragraphs = self.text[start:].split('\n')
+        old_rows = len(self._wrap(last)) if self.rows else 0
+        lines = [line for paragraph in paragraphs for line in self._wrap(paragraph)]
+        if old_rows:
+            del self.rows[-old_rows:]
+            del self.data[-old_rows:]
+        self.add_rows([{'text': line} for line in lines])
+
+    def _rewrap(self, instance, width):
+        if self.text is not None and self.columns != self._columns():
+            self.show_text(self.text)
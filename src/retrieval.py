@@ -0,0 +1,221 @@
+import hashlib
+import os
+import re
+from collections import Counter, namedtuple
+
+import diagnostics
+import search_index
+
+
+TOP_K = 12
+CANDIDATES = 60
+# bm25 costs a few microseconds per matching row. Each source is ranked on
+# its own, so where tens of thousands of one source's rows match (a phone's
+# worth of texts), only its RANKED_ROWS newest (highest id) matches are
+# ranked; the other sources' evidence is ranked all the same.
+RANKED_ROWS = 2000
+PASSAGE_WORDS = 180
+PASSAGE_OVERLAP = 40
+
+EMBEDDINGS_ENV = 'CASE_MANAGER_EMBEDDINGS'
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+Passage = namedtuple('Passage', 'ref source source_id title date text score')
+
+REF_PREFIXES = {
+    'documents': 'D',
+    'text_messages': 'M',
+    'emails': 'E',
+    'audio_recordings': 'A',
+    'videos': 'V',
+    'pre_case_context': 'C',
+}
+
+# Extra terms per motion so "Motion to Oppose Adoption" also finds evidence
+# about services, visits and compliance rather than just the word "adoption".
+MOTION_TERMS = {
+    'concurrent': ['reunification', 'permanency', 'case plan', 'services', 'visitation', 'compliance', 'relative'],
+    'adoption': ['reunification', 'bond', 'visitation', 'compliance', 'services', 'termination', 'relative'],
+    'guardianship': ['relative', 'grandparent', 'placement', 'home study', 'stable', 'kinship'],
+    'contempt': ['court order', 'ordered', 'failed', 'missed', 'cancelled', 'violation', 'visitation'],
+    'mandamus': ['delay', 'deadline', 'hearing', 'continuance', 'failed', 'months'],
+    'medication': ['medication', 'prescribed', 'psychiatrist', 'dosage', 'consent', 'diagnosis'],
+    'visitation': ['visit', 'visitation', 'cancelled', 'supervised', 'missed'],
+    'placement': ['placement', 'relative', 'foster', 'home study', 'kinship'],
+}
+
+_WORD = re.compile(r"[\w']+")
+_STOPWORDS = {'a', 'an', 'and', 'for', 'in', 'of', 'on', 'the', 'to', 'motion', 'with'}
+
+
+def query_terms(motion_type):
+    terms = [w for w in _WORD.findall(motion_type.lower()) if w not in _STOPWORDS]
+    lowered = motion_type.lower()
+    for key, extra in MOTION_TERMS.items():
+        if key in lowered:
+            terms.extend(extra)
+    seen = []
+    for term in terms:
+        if term not in seen:
+            seen.append(term)
+    return seen
+
+
+def _match_query(terms):
+    return ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _passages(text, words=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    tokens = text.split()
+    if len(tokens) <= words:
+        yield text
+        return
+    step = words - overlap
+    for start in range(0, len(tokens) - overlap, step):
+        yield ' '.join(tokens[start:start + words])
+
+
+def _term_pattern(terms):
+    # Finds only the query's words, as whole _WORD tokens; splitting every
+    # passage into all of its words took most of the time of a retrieval.
+    words = [re.escape(term) for term in terms if ' ' not in term]
+    return re.compile(r"(?<![\w'])(" + '|'.join(words) + r")(?![\w'])") if words else None
+
+
+def _score(passage, terms, pattern=None):
+    lowered = passage.lower()
+    if pattern is None:
+        pattern = _term_pattern(terms)
+    counts = Counter(pattern.findall(lowered)) if pattern else {}
+    score = 0.0
+    for term in terms:
+        if ' ' in term:
+            hits = lowered.count(term)
+        else:
+            hits = counts.get(term, 0)
+        if hits:
+            # Saturating term frequency, like BM25's k1.
+            score += hits * 2.2 / (hits + 1.2)
+    return score
+
+
+def _page_refs(conn, page_ids):
+    if not page_ids:
+        return {}
+    c = conn.cursor()
+    marks = ','.join('?' * len(page_ids))
+    c.execute(f'SELECT page_id, doc_id, page_no FROM document_pages WHERE page_id IN ({marks})', list(page_ids))
+    return {page_id: f'D{doc_id} p.{page_no}' for page_id, doc_id, page_no in c.fetchall()}
+
+
+def ref_for(source, source_id, page_refs):
+    if source == 'document_pages':
+        return page_refs.get(source_id, f'P{source_id}')
+    return f'{REF_PREFIXES.get(source, "X")}{source_id}'
+
+
+@diagnostics.timed('retrieve')
+def retrieve(conn, case_id, query, k=TOP_K, candidates=CANDIDATES, ranked_rows=RANKED_ROWS):
+    """Return the k most relevant evidence passages for ``query``.
+
+    Rows are ranked by FTS5 bm25 over each source's range of the case's
+    evidence index (kept current by its triggers), up to the ``ranked_rows``
+    newest matches per source; bm25 uses whole-table statistics, so the
+    sources' scores are merged as they are. The best passage of each
+    candidate row is then picked and re-scored, optionally blended with
+    embedding similarity.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    match = _match_query(terms)
+    c = conn.cursor()
+    ranked = []
+    for table, _, _, _, _, slot in search_index.SOURCES:
+        if table in search_index.CASE_IDS:
+            continue
+        first, last = search_index.source_rows(case_id, slot)
+        c.execute('''SELECT rowid FROM evidence_fts WHERE evidence_fts MATCH ? AND rowid BETWEEN ? AND ?
+                     ORDER BY rowid DESC LIMIT 1 OFFSET ?''', (match, first, last, ranked_rows - 1))
+        row = c.fetchone()
+        if row:
+            first = row[0]
+        # Rank on rowids alone; fetching body for every match would read all of it.
+        c.execute('''SELECT rowid, bm25(evidence_fts, 5.0, 1.0) AS score FROM evidence_fts
+                     WHERE evidence_fts MATCH ? AND rowid BETWEEN ? AND ? ORDER BY score LIMIT ?''',
+                  (match, first, last, candidates))
+        ranked += c.fetchall()
+    ranked.sort(key=lambda row: row[1])
+    rowids = [rowid for rowid, _ in ranked[:candidates]]
+    if not rowids:
+        return []
+    c.execute(f'''SELECT rowid, source, source_id, title, ref_date, body FROM evidence_fts
+                  WHERE rowid IN ({','.join('?' * len(rowids))})''', rowids)
+    by_rowid = {row[0]: row[1:] for row in c.fetchall()}
+    rows = [by_rowid[rowid] for rowid in rowids if rowid in by_rowid]
+    page_refs = _page_refs(conn, {row[1] for row in rows if row[0] == 'document_pages'})
+    scored = []
+    pattern = _term_pattern(terms)
+    for rank, (source, source_id, title, date, body) in enumerate(rows):
+        best, best_score = '', -1.0
+        for passage in _passages(body or ''):
+            score = _score(passage, terms, pattern)
+            if score > best_score:
+                best, best_score = passage, score
+        # Combine the row's bm25 rank with the score of its best passage.
+        combined = best_score + (candidates - rank) / candidates
+        scored.append(Passage(ref_for(source, source_id, page_refs), source, source_id, title or '', date or '',
+                              best, combined))
+    if os.environ.get(EMBEDDINGS_ENV) == '1' and scored:
+        scored = rerank_embeddings(conn, query, scored)
+    scored.sort(key=lambda p: p.score, reverse=True)
+    return scored[:k]
+
+
+def format_passages(passages):
+    return '\n\n'.join(f'[{p.ref} | {p.date} | {p.title}]\n{p.text}' for p in passages)
+
+
+# Optional CPU embeddings. Vectors are stored as float32 bytes keyed by the
+# passage hash, so only passages that were never embedded are encoded.
+
+_model = None
+
+
+def ensure_schema(conn):
+    conn.cursor().execute('''CREATE TABLE IF NOT EXISTS chunk_embeddings (
+        chunk_hash TEXT PRIMARY KEY,
+        model TEXT,
+        vector BLOB
+    )''')
+
+
+def _embed(texts):
+    global _model
+    from sentence_transformers import SentenceTransformer
+    if _model is None:
+        _model = SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+    return _model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+
+
+def rerank_embeddings(conn, query, passages, weight=2.0):
+    import numpy as np
+
+    c = conn.cursor()
+    hashes = [hashlib.sha256(p.text.encode('utf-8')).hexdigest() for p in passages]
+    vectors = {}
+    for h in hashes:
+        c.execute('SELECT vector FROM chunk_embeddings WHERE chunk_hash=? AND model=?', (h, EMBEDDING_MODEL))
+        row = c.fetchone()
+        if row:
+            vectors[h] = np.frombuffer(row[0], dtype=np.float32)
+    missing = [(h, p.text) for h, p in zip(hashes, passages) if h not in vectors]
+    if missing:
+        for (h, _), vector in zip(missing, _embed([text for _, text in missing])):
+            vectors[h] = vector.astype(np.float32)
+            c.execute('INSERT OR REPLACE INTO chunk_embeddings VALUES (?, ?, ?)',
+                      (h, EMBEDDING_MODEL, vectors[h].tobytes()))
+        conn.commit()
+    query_vector = _embed([query])[0]
+    return [p._replace(score=p.score + weight * float(np.dot(vectors[h], query_vector)))
+            for h, p in zip(hashes, passages)]
@@ -0,0 +1,277 @@
+import argparse
+import datetime
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when extraction changes; cached results from older versions are redone.
+VERSION = 2
+# Screenshots are scaled down to this width first. Phones capture at 2-3x, so
+# text stays around 30 px high, which Tesseract reads well, with a third of
+# the pixels to binarize and scan.
+MAX_WIDTH = 1000
+# Words Tesseract is less sure of than this (0-100) are dropped; they're
+# almost always status bar icons and bubble edges.
+MIN_CONFIDENCE = 30
+# The contact's name is in the header; lines above this fraction of the
+# height are never message text.
+HEADER = 0.13
+# Lines further apart than this many line heights are separate bubbles; lines
+# in a bubble are about half a line apart, bubbles at least one.
+BUBBLE_GAP = 1.0
+# Pixels more saturated than this (0-255) are part of a colored bubble.
+SATURATED = 80
+ME = 'Me'
+
+_TIME = re.compile(r'\b\d{1,2}[:.]\d{2}\s*(?:[ap]\.?m\.?)?', re.I)
+_DAY = re.compile(r'\b(today|yesterday|mon|tue|wed|thu|fri|sat|sun)[a-z]*\b', re.I)
+_WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_EXPLICIT_DATE = re.compile(r'\d{1,2}/\d{1,2}|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b',
+                            re.I)
+_STAMP_WORDS = re.compile(r'\b(today|yesterday|at|am|pm|a\.m\.|p\.m\.|mon|tue|wed|thu|fri|sat|sun|jan|feb|mar|apr|'
+                          r'may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?$|^[\d/:.,-]+$', re.I)
+
+Line = namedtuple('Line', 'text left top right bottom block')
+Bubble = namedtuple('Bubble', 'sent stamp time text')
+
+
+def register_heif(file_path):
+    """Let PIL open HEIC/HEIF files (iPhone photos and screenshots) with pillow-heif."""
+    if os.path.splitext(file_path)[1].lower() in ('.heic', '.heif'):
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+
+
+def open_image(file_path):
+    """Open a screenshot as upright RGB."""
+    from PIL import Image, ImageOps
+
+    register_heif(file_path)
+    with Image.open(file_path) as image:
+        return ImageOps.exif_transpose(image.convert('RGB'))
+
+
+def preprocess(image, max_width=MAX_WIDTH):
+    """Downscale and binarize a screenshot to dark text on white.
+
+    Light text on a dark background (dark mode) is inverted. Colored bubbles
+    (usually the phone owner's, white text on blue) are binarized on their
+    own, since one threshold for the whole image would lose their text.
+    """
+    from PIL import Image, ImageChops, ImageFilter
+
+    if image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.BILINEAR)
+    gray = image.convert('L')
+    colored = image.convert('HSV').getchannel('S').point(lambda value: 255 if value > SATURATED else 0)
+    # Closing (grow, then shrink back) fills in the text so the mask covers
+    # whole bubbles; box blurs are much cheaper than Max/MinFilter.
+    colored = colored.filter(ImageFilter.BoxBlur(4)).point(lambda value: 255 if value else 0)
+    colored = colored.filter(ImageFilter.BoxBlur(4)).point(lambda value: 255 if value > 250 else 0)
+    binary = gray.point(_binarize(gray.histogram(ImageChops.invert(colored))))
+    if colored.getbbox():
+        binary.paste(gray.point(_binarize(gray.histogram(colored))), mask=colored)
+    return binary
+
+
+def _binarize(histogram):
+    # A lookup table turning the background (the larger class) white and text black.
+    total = sum(histogram) or 1
+    threshold = _otsu(histogram, total)
+    if sum(histogram[:threshold + 1]) > total / 2:
+        return [0 if value > threshold else 255 for value in range(256)]
+    return [255 if value > threshold else 0 for value in range(256)]
+
+
+def _otsu(histogram, total):
+    # The threshold that best separates the histogram into two classes.
+    weighted_total = sum(value * count for value, count in enumerate(histogram))
+    background = weighted_background = 0
+    best, threshold = -1, 127
+    for value, count in enumerate(histogram):
+        background += count
+        if not background or background == total:
+            continue
+        weighted_background += value * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / (total - background)
+        between = background * (total - background) * (mean_background - mean_foreground) ** 2
+        if between > best:
+            best, threshold = between, value
+    return threshold
+
+
+def read_lines(image):
+    """OCR a preprocessed image into Lines using Tesseract's TSV (word box) output."""
+    import pytesseract
+
+    return lines_from_data(pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT))
+
+
+def lines_from_data(data):
+    """Group image_to_data's words into lines, top to bottom."""
+    lines = {}
+    for i, word in enumerate(data['text']):
+        word = (word or '').strip()
+        if not word or float(data['conf'][i]) < MIN_CONFIDENCE:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        left, top = data['left'][i], data['top'][i]
+        right, bottom = left + data['width'][i], top + data['height'][i]
+        if key in lines:
+            words, l, t, r, b = lines[key]
+            lines[key] = (words + [word], min(l, left), min(t, top), max(r, right), max(b, bottom))
+        else:
+            lines[key] = ([word], left, top, right, bottom)
+    result = [Line(' '.join(words), left, top, right, bottom, key[0])
+              for key, (words, left, top, right, bottom) in lines.items()]
+    return sorted(result, key=lambda line: (line.top, line.left))
+
+
+def _is_stamp(text):
+    # "10:42 AM", "Yesterday 9:15 PM", "Mon, Jan 5 at 3:02 PM", "1/5/24, 3:02 PM"
+    if not _TIME.search(text) and not _DAY.search(text):
+        return False
+    return all(_STAMP_WORDS.search(word) or _TIME.fullmatch(word) for word in text.split())
+
+
+def _centered(line, width):
+    return abs((line.left + line.right) / 2 - width / 2) < width * 0.12
+
+
+def split_bubbles(lines, width, height):
+    """Return (contact name, [Bubble]) from the OCR'd lines of a chat screenshot.
+
+    The contact is the centered line in the header. Centered timestamps
+    ("Today 9:41 AM") become the stamp of the bubbles below them, and a bare
+    time as a bubble's last line becomes its time. Bubbles hugging the right
+    edge were sent by the phone's owner.
+    """
+    contact = None
+    bubbles = []
+    current = None
+    stamp = None
+
+    def close():
+        if current:
+            words, left, right, time = current['lines'], current['left'], current['right'], None
+            if len(words) > 1 and _is_stamp(words[-1]):
+                time = words.pop()
+            bubbles.append(Bubble(width - right < left, stamp, time, ' '.join(words)))
+
+    for line in lines:
+        if line.bottom < height * HEADER:
+            if contact is None and _centered(line, width) and re.search('[A-Za-z]', line.text) \
+                    and not _is_stamp(line.text):
+                contact = line.text
+            continue
+        if _centered(line, width) and _is_stamp(line.text):
+            close()
+            current, stamp = None, line.text
+            continue
+        line_height = line.bottom - line.top
+        sent = width - line.right < line.left
+        if current is None or line.top - current['bottom'] > BUBBLE_GAP * max(line_height, current['height']) or \
+                current['block'] != line.block or (width - current['right'] < current['left']) != sent:
+            close()
+            current = {'lines': [], 'left': line.left, 'right': line.right, 'block': line.block, 'height': 0}
+        current['lines'].append(line.text)
+        current['height'] = max(current['height'], line_height)
+        current['left'] = min(current['left'], line.left)
+        current['right'] = max(current['right'], line.right)
+        current['bottom'] = line.bottom
+    close()
+    return contact, bubbles
+
+
+def parse_stamp(text, base):
+    """Turn a chat timestamp into a datetime, or None; missing parts come from base."""
+    from dateutil.parser import parse
+
+    lower = text.lower()
+    day = base
+    if 'yesterday' in lower:
+        day = base - datetime.timedelta(days=1)
+    else:
+        weekday = next((n for n, name in enumerate(_WEEKDAYS) if re.search(rf'\b{name}', lower)), None)
+        if weekday is not None and not _EXPLICIT_DATE.search(text):
+            # "Mon 3:02 PM" is the last Monday on or before the screenshot.
+            day = base - datetime.timedelta(days=(base.weekday() - weekday) % 7)
+    cleaned = _DAY.sub(' ', text).replace(' at ', ' ')
+    try:
+        value = parse(cleaned, fuzzy=True, default=day)
+    except (ValueError, OverflowError):
+        return None
+    return value
+
+
+def extract(file_path, date=None):
+    """OCR one chat screenshot into its messages.
+
+    date ('YYYY-MM-DD', e.g. from EXIF) dates timestamps that only show a
+    time; without it the file's modified time is used.
+    """
+    # Tesseract's own OpenMP threads would fight the process pool for cores.
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    image = preprocess(open_image(file_path))
+    lines = read_lines(image)
+    contact, bubbles = split_bubbles(lines, *image.size)
+    contact = contact or 'Unknown'
+    if date:
+        base = datetime.datetime.strptime(date[:10], '%Y-%m-%d')
+    else:
+        base = datetime.datetime.combine(datetime.date.fromtimestamp(os.path.getmtime(file_path)), datetime.time())
+    found = []
+    for bubble in bubbles:
+        # "Yesterday 9:15 PM" above a bubble ending "9:20 PM" is yesterday at 9:20.
+        day = (parse_stamp(bubble.stamp, base) if bubble.stamp else None) or base
+        when = parse_stamp(bubble.time, day) if bubble.time else None
+        if when:
+            when = when.strftime('%Y-%m-%d %H:%M:%S')
+        elif day is not base:
+            when = day.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            when = base.strftime('%Y-%m-%d')
+        found.append([when, ME if bubble.sent else contact, bubble.text])
+    return {'version': VERSION, 'contact': contact, 'messages': found,
+            'text': '\n'.join(line.text for line in lines)}
+
+
+def is_current(extracted):
+    """Whether a cached extraction came from this version of the OCR."""
+    return bool(extracted) and extracted.get('version') == VERSION
+
+
+def messages(result, date):
+    """[date, sender, content] rows of an extraction; at least one, dated date if no bubbles were found."""
+    return result['messages'] or [[date, result['contact'], result['text'] or 'No content extracted']]
+
+
+def extract_batch(file_paths, workers=None):
+    """Yield (file_path, result or exception) for each screenshot, OCR'd on every core."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(file_path, pool.submit(extract, file_path)) for file_path in file_paths]
+        for file_path, future in futures:
+            try:
+                yield file_path, future.result()
+            except Exception as e:
+                yield file_path, e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OCR chat screenshots into individual messages.')
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    for file_path, result in extract_batch(args.images, args.workers):
+        print(f'== {file_path}')
+        if isinstance(result, Exception):
+            print(f'Failed: {result}')
+            continue
+        for when, sender, content in messages(result, 'Unknown'):
+            print(f'{when}  {sender}: {content}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import re
+from collections import namedtuple
+
+import diagnostics
+
+# Every searchable evidence row lives in one FTS5 table. The rowid is derived
+# from the case, the source's slot and the source row id so triggers can
+# update/delete without scanning, and so each case's rows, and each source's
+# rows within a case, are one rowid range (see case_rows and source_rows)
+# that FTS5 seeks to instead of reading every match to check it.
+SOURCE_SLOTS = 32
+SOURCE_ROWS = 1 << 35
+CASE_ROWS = SOURCE_SLOTS * SOURCE_ROWS
+
+# (table, id column, title, body, date, slot). Expressions are SQL with {row}
+# standing for the source row (NEW in triggers, the table in backfills).
+SOURCES = [
+    ('documents', 'doc_id', '{row}.doc_name', '{row}.content', '{row}.doc_date', 1),
+    ('text_messages', 'msg_id', "''", '{row}.content', '{row}.msg_date', 2),
+    ('emails', 'email_id', '{row}.subject', '{row}.content', '{row}.email_date', 3),
+    ('pre_case_context', 'context_id', "''", '{row}.description', '{row}.context_date', 4),
+    ('audio_recordings', 'audio_id', '{row}.audio_name', '{row}.transcription', '{row}.audio_date', 5),
+    ('document_pages', 'page_id',
+     "(SELECT doc_name FROM documents WHERE doc_id = {row}.doc_id) || ', page ' || {row}.page_no",
+     '{row}.content', '(SELECT doc_date FROM documents WHERE doc_id = {row}.doc_id)', 6),
+    ('videos', 'video_id', '{row}.video_name', '{row}.transcription', '{row}.video_date', 7),
+    ('legal_resources', 'resource_id', "{row}.state || ': ' || {row}.title", '{row}.content',
+     'substr({row}.fetched_at, 1, 10)', 8),
+]
+
+# The saved legal resources belong to no case; they are indexed under
+# SHARED_CASE_ID, which the Search tab searches after the case. Rows of any
+# other source without a case_id aren't indexed at all.
+SHARED_CASE_ID = 0
+CASE_IDS = {
+    'legal_resources': str(SHARED_CASE_ID),
+}
+
+# Documents split into pages are searched page by page, so the whole-document
+# row is only indexed while it has no pages.
+CONDITIONS = {
+    'documents': 'NOT EXISTS (SELECT 1 FROM document_pages WHERE doc_id = {row}.doc_id)',
+}
+ON_INSERT = {
+    'document_pages': f'DELETE FROM evidence_fts '
+                      f'WHERE rowid = NEW.case_id * {CASE_ROWS} + {SOURCE_ROWS} + NEW.doc_id;',
+}
+
+SOURCE_LABELS = {
+    'documents': 'Document',
+    'text_messages': 'Message',
+    'emails': 'Email',
+    'pre_case_context': 'Pre-Case',
+    'audio_recordings': 'Audio',
+    'document_pages': 'Document',
+    'videos': 'Video',
+    'legal_resources': 'Legal',
+}
+
+# Snippet markers; callers swap these for their own markup after escaping.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+SearchHit = namedtuple('SearchHit', 'source source_id title date snippet score')
+
+_OPERATORS = {'AND', 'OR', 'NOT'}
+
+
+def _conditions(table):
+    conditions = [] if table in CASE_IDS else ['{row}.case_id IS NOT NULL']
+    if table in CONDITIONS:
+        conditions.append(CONDITIONS[table])
+    return ' AND '.join(conditions)
+
+
+def _rowid_sql(table, id_col, slot, row):
+    case_id = CASE_IDS.get(table, '{row}.case_id')
+    return f'{case_id} * {CASE_ROWS} + {slot * SOURCE_ROWS} + {{row}}.{id_col}'.format(row=row)
+
+
+def _select_sql(table, id_col, title, body, date, slot, row, from_clause=''):
+    case_id = CASE_IDS.get(table, '{row}.case_id')
+    sql = (f"SELECT {_rowid_sql(table, id_col, slot, row)}, {title}, {body}, {case_id}, '{table}', "
+           f"{row}.{id_col}, {date}").format(row=row) + from_clause
+    conditions = _conditions(table)
+    if conditions:
+        sql += ' WHERE ' + conditions.format(row=row)
+    return sql
+
+
+def _trigger_sql(table, id_col, title, body, date, slot):
+    insert = (f"INSERT INTO evidence_fts(rowid, title, body, case_id, source, source_id, ref_date) "
+              f"{_select_sql(table, id_col, title, body, date, slot, 'NEW')};")
+    delete = f"DELETE FROM evidence_fts WHERE rowid = {_rowid_sql(table, id_col, slot, 'OLD')};"
+    extra = ON_INSERT.get(table, '')
+    # Only edits to indexed columns reindex the row; bookkeeping updates
+    # (sort_date backfills and the like) leave the index alone.
+    template = ' '.join([title, body, date, _conditions(table)])
+    columns = sorted(set(re.findall(r'\{row\}\.(\w+)', template)) | {id_col, 'case_id'})
+    return [
+        f"DROP TRIGGER IF EXISTS {table}_fts_ai",
+        f"DROP TRIGGER IF EXISTS {table}_fts_ad",
+        f"DROP TRIGGER IF EXISTS {table}_fts_au",
+        f"CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN {extra} {insert} END",
+        f"CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF {', '.join(columns)} ON {table} "
+        f"BEGIN {delete} {insert} END",
+    ]
+
+
+def _backfill_sql(table, id_col, title, body, date, slot):
+    return (f"INSERT INTO evidence_fts(rowid, title, body, case_id, source, source_id, ref_date) "
+            f"{_select_sql(table, id_col, title, body, date, slot, table, f' FROM {table}')}")
+
+
+def ensure_index(conn):
+    """Create the evidence index and (re)create its triggers, backfilling existing rows once."""
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='evidence_fts'")
+    exists = c.fetchone() is not None
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS evidence_fts USING fts5(
+        title, body,
+        case_id UNINDEXED, source UNINDEXED, source_id UNINDEXED, ref_date UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )''')
+    for source in SOURCES:
+        for sql in _trigger_sql(*source):
+            c.execute(sql)
+    if not exists:
+        for source in SOURCES:
+            c.execute(_backfill_sql(*source))
+        c.execute("INSERT INTO evidence_fts(evidence_fts) VALUES ('optimize')")
+
+
+def rebuild_index(conn):
+    c = conn.cursor()
+    c.execute('DELETE FROM evidence_fts')
+    for source in SOURCES:
+        c.execute(_backfill_sql(*source))
+    c.execute("INSERT INTO evidence_fts(evidence_fts) VALUES ('optimize')")
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def to_match_query(text):
+    """Turn user input into an FTS5 query.
+
+    "quoted words" stay phrases, a trailing * is a prefix query, bare AND/OR/NOT
+    are passed through, and everything else is quoted so punctuation in names
+    or case numbers can't produce a syntax error.
+    """
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase:
+            parts.append(_quote(phrase))
+        elif word in _OPERATORS:
+            parts.append(word)
+        elif word.endswith('*') and word.strip('*'):
+            parts.append(_quote(word.strip('*')) + '*')
+        elif word.strip('*"'):
+            parts.append(_quote(word.strip('*"')))
+    # Drop dangling operators so "dcs OR" is still a valid query.
+    while parts and parts[0] in _OPERATORS:
+        parts.pop(0)
+    while parts and parts[-1] in _OPERATORS:
+        parts.pop()
+    return ' '.join(parts)
+
+
+def case_rows(case_id):
+    """The first and last evidence_fts rowid a case's rows can have."""
+    return case_id * CASE_ROWS, (case_id + 1) * CASE_ROWS - 1
+
+
+def source_rows(case_id, slot):
+    """The first and last evidence_fts rowid of a case's rows from the source in ``slot``."""
+    first = case_id * CASE_ROWS + slot * SOURCE_ROWS
+    return first, first + SOURCE_ROWS - 1
+
+
+def search(conn, case_id, query, limit=200, offset=0):
+    match = to_match_query(query)
+    if not match:
+        return []
+    with diagnostics.span('search', offset=offset):
+        c = conn.cursor()
+        c.execute(f'''SELECT source, source_id, title, ref_date,
+                      snippet(evidence_fts, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', 16),
+                      bm25(evidence_fts, 5.0, 1.0) AS score
+                      FROM evidence_fts
+                      WHERE evidence_fts MATCH ? AND rowid BETWEEN ? AND ?
+                      ORDER BY score LIMIT ? OFFSET ?''',
+                  (match, *case_rows(case_id), limit, offset))
+        hits = [SearchHit(*row) for row in c.fetchall()]
+        diagnostics.count('rows', len(hits))
+    return hits
+
@@ -0,0 +1,598 @@
+"""Case storage, ingestion, search and reports without the UI.
+
+The functions take a connection and leave committing to the caller; the app
+calls them with its own connection. CaseService wraps them around a
+db.ConnectionPool so any number of threads (the CLI, the HTTP API in api.py,
+scripts) can use one database at once: reads run on pooled reader
+connections while an import holds the writer. A case created with
+separate=True keeps its records in a database file of its own (the main
+database still lists it), which CaseService opens when the case is used.
+
+    python src/service.py cases
+    python src/service.py search 1 "visit*"
+    python src/service.py import 1 court_order.pdf call.m4a
+    python src/service.py serve --port 8765
+"""
+import argparse
+import functools
+import getpass
+import json
+import os
+import sys
+import threading
+
+import attachments
+import bulk_import
+import contacts
+import db
+import ingest
+import pages
+import pdf_pages
+import reports
+import screenshot_ocr
+import search_index
+import transcription
+import video
+
+VIDEO_EXTS = ('.mp4', '.mov', '.m4v', '.avi', '.mkv', '.webm')
+FINISHED = (ingest.DONE, ingest.FAILED, ingest.DUPLICATE, ingest.CANCELLED)
+
+
+def _required(*values):
+    if not all(values):
+        raise ValueError('All fields required.')
+
+
+def list_cases(conn):
+    """(case_id, case_name, state, db_path) of every case; db_path is None for cases in this database."""
+    c = conn.cursor()
+    c.execute('SELECT case_id, case_name, state, db_path FROM cases ORDER BY case_id')
+    return c.fetchall()
+
+
+def get_case(conn, case_id):
+    c = conn.cursor()
+    c.execute('SELECT case_id, case_name, state, db_path FROM cases WHERE case_id=?', (case_id,))
+    return c.fetchone()
+
+
+def create_case(conn, case_name, state, separate=False):
+    """Add a case; with separate, its records go in a database file of its own (see init_case_db)."""
+    _required(case_name, state)
+    c = conn.cursor()
+    c.execute('INSERT INTO cases (case_name, state) VALUES (?, ?)', (case_name, state))
+    case_id = c.lastrowid
+    if separate:
+        c.execute('UPDATE cases SET db_path=? WHERE case_id=?',
+                  (os.path.join(db.CASE_DIR, f'case_{case_id}.db'), case_id))
+    return case_id
+
+
+def init_case_db(conn, case_id, case_name, state):
+    """Set up a case's own database, with the case under the same id as in the main one."""
+    db.init_schema(conn)
+    c = conn.cursor()
+    c.execute('INSERT OR IGNORE INTO cases (case_id, case_name, state) VALUES (?, ?, ?)', (case_id, case_name, state))
+    conn.commit()
+
+
+def case_db(main_path, case):
+    """The database file holding a case's records, given its list_cases() row."""
+    return db.case_path(main_path, case[3]) if case[3] else main_path
+
+
+def add_contact(conn, case_id, name, email='', phone='', role='', resolver=None):
+    if not name:
+        raise ValueError('Name is required.')
+    c = conn.cursor()
+    c.execute('INSERT INTO contacts VALUES (NULL, ?, ?, ?, ?, ?)', (case_id, name, email, phone, role))
+    if resolver:
+        resolver.add(c.lastrowid, name, email, phone)
+    return c.lastrowid
+
+
+def add_text_message(conn, case_id, msg_date, sender, recipient, content, resolver=None):
+    resolver = resolver or contacts.ContactResolver(conn, case_id)
+    sender_id = resolver.resolve(sender)
+    recipient_id = resolver.resolve(recipient)
+    c = conn.cursor()
+    sort_date = db.normalize_date(msg_date)
+    c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+              (case_id, msg_date, sender_id, recipient_id, content, 0, sort_date))
+    msg_id = c.lastrowid
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, msg_date, f"Text message from {sender} to {recipient}", 'Text Message', sort_date))
+    return msg_id
+
+
+def add_email(conn, case_id, email_date, sender, recipient, subject, content, resolver=None):
+    resolver = resolver or contacts.ContactResolver(conn, case_id)
+    sender_id = resolver.resolve(sender)
+    recipient_id = resolver.resolve(recipient)
+    c = conn.cursor()
+    sort_date = db.normalize_date(email_date)
+    c.execute('INSERT INTO emails VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)',
+              (case_id, email_date, sender_id, recipient_id, subject, content, 0, sort_date))
+    email_id = c.lastrowid
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, email_date, f"Email from {sender}: {subject}", 'Email', sort_date))
+    return email_id
+
+
+def add_event(conn, case_id, event_date, description, event_type):
+    _required(event_date, description, event_type)
+    c = conn.cursor()
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, event_date, description, event_type, db.normalize_date(event_date)))
+    return c.lastrowid
+
+
+def add_calendar_event(conn, case_id, event_date, title, description):
+    _required(event_date, title, description)
+    c = conn.cursor()
+    c.execute('INSERT INTO calendar_events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, event_date, title, description, db.normalize_date(event_date)))
+    return c.lastrowid
+
+
+def add_pre_case_context(conn, case_id, context_date, description):
+    _required(context_date, description)
+    c = conn.cursor()
+    c.execute('INSERT INTO pre_case_context VALUES (NULL, ?, ?, ?, ?)',
+              (case_id, description, context_date, db.normalize_date(context_date)))
+    return c.lastrowid
+
+
+# Ingest store callbacks: write the rows of an extracted file and return the
+# (table, row id) it was stored as. The queue links the evidence and commits.
+
+def store_document(conn, case_id, payload, result, resolver=None):
+    c = conn.cursor()
+    c.execute('INSERT INTO documents VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+              (case_id, payload['doc_name'], payload['file_path'], result['content'], payload['doc_date'],
+               payload['category'], db.normalize_date(payload['doc_date'])))
+    doc_id = c.lastrowid
+    pdf_pages.store_pages(conn, case_id, doc_id, result.get('pages', []))
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, payload['doc_date'], f"Added document: {payload['doc_name']}", 'Document',
+               db.normalize_date(payload['doc_date'])))
+    return 'documents', doc_id
+
+
+def store_audio(conn, case_id, payload, result, resolver=None):
+    c = conn.cursor()
+    c.execute('INSERT INTO audio_recordings VALUES (NULL, ?, ?, ?, ?, ?, ?)',
+              (case_id, payload['audio_name'], payload['file_path'], result['transcription'], payload['audio_date'],
+               db.normalize_date(payload['audio_date'])))
+    audio_id = c.lastrowid
+    transcription.store_segments(conn, audio_id, result.get('segments', []))
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, payload['audio_date'], f"Added audio: {payload['audio_name']}", 'Audio',
+               db.normalize_date(payload['audio_date'])))
+    return 'audio_recordings', audio_id
+
+
+def store_video(conn, case_id, payload, result, resolver=None):
+    c = conn.cursor()
+    c.execute('INSERT INTO videos VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+              (case_id, payload['video_name'], payload['file_path'], result['transcription'], payload['video_date'],
+               result['duration'], result['video_codec'], result['audio_codec'], result['width'], result['height'],
+               db.normalize_date(payload['video_date'])))
+    video_id = c.lastrowid
+    video.store_segments(conn, video_id, result['segments'])
+    # The result is cached once this returns; a cached one already has its thumbnails stored.
+    if 'frames' in result:
+        result['thumbnails'] = video.save_frames(conn, result.pop('frames'))
+    video.store_thumbnails(conn, video_id, result['thumbnails'])
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, payload['video_date'], f"Added video: {payload['video_name']} "
+               f"({video.format_time(result['duration'])})", 'Video', db.normalize_date(payload['video_date'])))
+    return 'videos', video_id
+
+
+def store_text_image(conn, case_id, payload, result, resolver=None):
+    resolver = resolver or contacts.ContactResolver(conn, case_id)
+    me_id = resolver.resolve(screenshot_ocr.ME)
+    contact_id = resolver.resolve(result['contact'])
+    messages = screenshot_ocr.messages(result, payload.get('date') or 'Unknown')
+    c = conn.cursor()
+    msg_id = None
+    for msg_date, sender, content in messages:
+        sent = sender == screenshot_ocr.ME
+        c.execute('INSERT INTO text_messages VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                  (case_id, msg_date, me_id if sent else contact_id, contact_id if sent else me_id, content, 1,
+                   db.normalize_date(msg_date)))
+        msg_id = msg_id or c.lastrowid
+    msg_date = messages[0][0]
+    c.execute('INSERT INTO events VALUES (NULL, ?, ?, ?, ?, ?)',
+              (case_id, msg_date, f"Text message image from {result['contact']}", 'Text Message',
+               db.normalize_date(msg_date)))
+    return 'text_messages', msg_id
+
+
+# kind: (extract, store, IngestQueue.register options, payload key of the file's name)
+KINDS = {
+    'document': (ingest.extract_document, store_document, {'fan_out': True}, 'doc_name'),
+    'audio': (ingest.extract_audio, store_audio, {}, 'audio_name'),
+    'video': (ingest.extract_video, store_video, {'cancellable': True}, 'video_name'),
+    'text_image': (ingest.extract_text_image, store_text_image, {'cpu_bound': True}, None),
+}
+
+
+def register_handlers(queue, conn, resolver=None, on_file=None):
+    """Register every kind in KINDS with an IngestQueue writing through conn.
+
+    resolver(case_id) returns the case's ContactResolver (one is built per
+    file otherwise); on_file(file_path, name, sha256) is called for each
+    stored file, before the commit.
+    """
+    def handler(store, name_key):
+        def run(case_id, payload, result):
+            source = store(conn, case_id, payload, result, resolver(case_id) if resolver else None)
+            if on_file:
+                name = payload[name_key] if name_key else os.path.basename(payload['file_path'])
+                on_file(payload['file_path'], name, payload['sha256'])
+            return source
+        return run
+    for kind, (extract, store, options, name_key) in KINDS.items():
+        queue.register(kind, extract, handler(store, name_key), **options)
+
+
+def classify(file_path):
+    if os.path.splitext(file_path)[1].lower() in VIDEO_EXTS:
+        return 'video'
+    return bulk_import.classify(file_path)
+
+
+def file_payload(file_path, kind=None, name=None, date=None, category=None):
+    """The ingest payload for a file; the date defaults to the one bulk import would infer."""
+    file_path = os.path.abspath(file_path)
+    kind = kind or classify(file_path)
+    if kind not in KINDS:
+        raise ValueError(f'Unsupported file type: {os.path.basename(file_path)}')
+    if not os.path.isfile(file_path):
+        raise ValueError(f'No such file: {file_path}')
+    date = date or bulk_import.infer_date(file_path, kind)
+    name = name or os.path.basename(file_path)
+    if kind == 'document':
+        payload = {'doc_name': name, 'doc_date': date, 'category': category or 'Imported'}
+    elif kind == 'audio':
+        payload = {'audio_name': name, 'audio_date': date}
+    elif kind == 'video':
+        payload = {'video_name': name, 'video_date': date}
+    else:
+        payload = {'date': date}
+    return kind, dict(payload, file_path=file_path)
+
+
+def job(conn, job_id):
+    """(job_id, case_id, kind, status, error) of an ingest job, or None."""
+    c = conn.cursor()
+    c.execute('SELECT job_id, case_id, kind, status, error FROM ingest_jobs WHERE job_id=?', (job_id,))
+    return c.fetchone()
+
+
+def timeline_report(conn, case_id, path=None):
+    path = path or reports.report_path(case_id, reports.TIMELINE_PDF)
+    return reports.render(path, 'Case Timeline', reports.timeline_sections(conn, case_id))
+
+
+def custom_report(conn, case_id, report_type, path=None):
+    path = path or reports.report_path(case_id, reports.CUSTOM_REPORT_PDF)
+    return reports.render(path, f"Custom Report: {report_type}", reports.custom_sections(conn, case_id, report_type))
+
+
+class CaseService:
+    """Thread-safe case operations over connection pools.
+
+    Writes (new rows, contact resolution, ingest bookkeeping) are serialized
+    on a pool's writer; searches, paged lists, records and reports each
+    borrow a reader, so they don't wait for an import in progress. Cases
+    with their own database file get their own pool and ingest queue, opened
+    on first use; the rest share the main database's. Ingest queues are
+    started on first use and write through their pool.
+    """
+
+    def __init__(self, password, path=db.DB_PATH, readers=db.READERS, on_file=None):
+        self.password = password
+        self.path = path
+        self.readers = readers
+        self.pool = db.ConnectionPool(password, path, readers)
+        with self.pool.write() as conn:
+            db.init_schema(conn)
+        self.on_file = on_file
+        # Pools by database file, and by case once its file is known.
+        self.pools = {path: self.pool}
+        self.case_pools = {}
+        self.pools_lock = threading.Lock()
+        self.resolvers = {}
+        self.ingests = {}
+        # (database file, job id): (status, error)
+        self.finished = {}
+        self.jobs_changed = threading.Condition()
+
+    def close(self):
+        for queue in self.ingests.values():
+            queue.shutdown()
+        for pool in self.pools.values():
+            pool.close()
+
+    def _pool(self, case_id):
+        """The pool of the database holding the case; the main one for a case that doesn't exist."""
+        with self.pools_lock:
+            if case_id in self.case_pools:
+                return self.case_pools[case_id]
+            with self.pool.read() as conn:
+                case = get_case(conn, case_id)
+            if not case:
+                return self.pool
+            path = case_db(self.path, case)
+            if path not in self.pools:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                pool = db.ConnectionPool(self.password, path, self.readers)
+                with pool.write() as conn:
+                    init_case_db(conn, *case[:3])
+                self.pools[path] = pool
+            self.case_pools[case_id] = self.pools[path]
+            return self.case_pools[case_id]
+
+    def _resolver(self, case_id):
+        # Only used under the case's write lock, with its writer connection.
+        if case_id not in self.resolvers:
+            self.resolvers[case_id] = contacts.ContactResolver(self._pool(case_id).writer, case_id)
+        return self.resolvers[case_id]
+
+    def _write(self, fn, case_id, *args, **kwargs):
+        with self._pool(case_id).write() as conn:
+            try:
+                return fn(conn, case_id, *args, **kwargs)
+            except Exception:
+                # New contacts the resolver learned are rolled back with the rows.
+                self.resolvers.pop(case_id, None)
+                raise
+
+    def cases(self):
+        with self.pool.read() as conn:
+            return list_cases(conn)
+
+    def create_case(self, case_name, state, separate=False):
+        with self.pool.write() as conn:
+            case_id = create_case(conn, case_name, state, separate)
+        if separate:
+            # Creates the file now, so it exists to back up or archive.
+            self._pool(case_id)
+        return case_id
+
+    def add_contact(self, case_id, name, email='', phone='', role=''):
+        return self._write(lambda conn, case_id: add_contact(conn, case_id, name, email, phone, role,
+                                                             self._resolver(case_id)), case_id)
+
+    def add_text_message(self, case_id, msg_date, sender, recipient, content):
+        return self._write(lambda conn, case_id: add_text_message(conn, case_id, msg_date, sender, recipient,
+                                                                  content, self._resolver(case_id)), case_id)
+
+    def add_email(self, case_id, email_date, sender, recipient, subject, content):
+        return self._write(lambda conn, case_id: add_email(conn, case_id, email_date, sender, recipient, subject,
+                                                           content, self._resolver(case_id)), case_id)
+
+    def add_event(self, case_id, event_date, description, event_type):
+        return self._write(add_event, case_id, event_date, description, event_type)
+
+    def add_calendar_event(self, case_id, event_date, title, description):
+        return self._write(add_calendar_event, case_id, event_date, title, description)
+
+    def add_pre_case_context(self, case_id, context_date, description):
+        return self._write(add_pre_case_context, case_id, context_date, description)
+
+    def search(self, case_id, query, offset=None, limit=pages.PAGE_SIZE):
+        """(hits, next offset); raises db.sqlcipher.OperationalError for invalid query syntax."""
+        with self._pool(case_id).read() as conn:
+            return pages.search_page(conn, case_id, query, offset, limit)
+
+    def timeline(self, case_id, after=None, limit=pages.PAGE_SIZE):
+        with self._pool(case_id).read() as conn:
+            return pages.timeline_page(conn, case_id, after, limit)
+
+    def calendar(self, case_id, after=None, limit=pages.PAGE_SIZE):
+        with self._pool(case_id).read() as conn:
+            return pages.calendar_page(conn, case_id, after, limit)
+
+    def record(self, case_id, source, source_id):
+        """A search hit or event of the case, or None if there's no such row in it."""
+        # Saved legal resources are kept in the main database for every case.
+        pool = self.pool if source in search_index.CASE_IDS else self._pool(case_id)
+        with pool.read() as conn:
+            return pages.source_record(conn, case_id, source, source_id)
+
+    def attachment(self, case_id, source, source_id):
+        """(attachments.Reader, original path) of the file a row was imported from, or None if it isn't stored."""
+        with self._pool(case_id).read() as conn:
+            found = attachments.source_file(conn, case_id, source, source_id)
+            return (attachments.reader(conn, found[0]), found[1]) if found else None
+
+    def timeline_report(self, case_id, path=None):
+        with self._pool(case_id).read() as conn:
+            return timeline_report(conn, case_id, path)
+
+    def custom_report(self, case_id, report_type, path=None):
+        with self._pool(case_id).read() as conn:
+            return custom_report(conn, case_id, report_type, path)
+
+    def start_ingest(self, case_id=None, cpu_workers=None):
+        """The ingest queue of the case's database (the main one without case_id), started if need be."""
+        # Jobs a previous session left unfinished are resumed by the app, not here.
+        pool = self.pool if case_id is None else self._pool(case_id)
+        with pool.write() as conn:
+            if pool.path not in self.ingests:
+                queue = ingest.IngestQueue(conn, schedule=pool.run_write,
+                                           on_update=functools.partial(self._on_job_update, pool.path),
+                                           cpu_workers=cpu_workers)
+                register_handlers(queue, conn, self._resolver, self.on_file)
+                self.ingests[pool.path] = queue
+            return self.ingests[pool.path]
+
+    def submit(self, case_id, file_path, kind=None, name=None, date=None, category=None):
+        """Queue a file for import; returns its job id."""
+        return self.submit_payload(case_id, *file_payload(file_path, kind, name, date, category))
+
+    def submit_payload(self, case_id, kind, payload):
+        queue = self.start_ingest(case_id)
+        with self._pool(case_id).write():
+            return queue.submit(case_id, kind, payload)
+
+    def job(self, job_id, case_id=None):
+        """Job ids are per database, like record ids."""
+        pool = self.pool if case_id is None else self._pool(case_id)
+        with pool.read() as conn:
+            return job(conn, job_id)
+
+    def job_counts(self, case_id=None):
+        pool = self.pool if case_id is None else self._pool(case_id)
+        with pool.read() as conn:
+            return ingest.counts(conn, case_id)
+
+    def cancel_case(self, case_id):
+        pool = self._pool(case_id)
+        queue = self.ingests.get(pool.path)
+        if not queue:
+            return 0
+        with pool.write():
+            return queue.cancel_case(case_id)
+
+    def wait(self, job_ids, timeout=None, case_id=None):
+        """Block until the jobs finish; returns {job_id: (status, error)} of those that did."""
+        path = (self.pool if case_id is None else self._pool(case_id)).path
+        keys = {(path, job_id) for job_id in job_ids}
+        with self.jobs_changed:
+            self.jobs_changed.wait_for(lambda: keys <= self.finished.keys(), timeout)
+            return {job_id: self.finished[path, job_id] for _, job_id in keys if (path, job_id) in self.finished}
+
+    def _on_job_update(self, path, job_id, status, error):
+        if status in FINISHED:
+            with self.jobs_changed:
+                self.finished[path, job_id] = (status, error)
+                self.jobs_changed.notify_all()
+
+
+def _plain_snippet(snippet):
+    # The terminal has no highlighting; matched terms are shown as [term].
+    return (snippet or '').replace(search_index.HIGHLIGHT_START, '[').replace(search_index.HIGHLIGHT_END, ']')
+
+
+def _print_rows(rows):
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Work with a case database without the app.')
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('cases', help='list cases')
+    command = commands.add_parser('new-case', help='create a case')
+    command.add_argument('case_name')
+    command.add_argument('state')
+    command.add_argument('--separate', action='store_true', help=f'keep its records in a file of its own, '
+                                                                 f'under {db.CASE_DIR}/ next to --db')
+    command = commands.add_parser('add-event', help='add a timeline event')
+    command.add_argument('case_id', type=int)
+    command.add_argument('date')
+    command.add_argument('event_type')
+    command.add_argument('description')
+    command = commands.add_parser('add-message', help='add a text message')
+    command.add_argument('case_id', type=int)
+    command.add_argument('date')
+    command.add_argument('sender')
+    command.add_argument('recipient')
+    command.add_argument('content')
+    command = commands.add_parser('search', help='search a case')
+    command.add_argument('case_id', type=int)
+    command.add_argument('query')
+    command.add_argument('--limit', type=int, default=20)
+    command = commands.add_parser('timeline', help="print a case's timeline")
+    command.add_argument('case_id', type=int)
+    command = commands.add_parser('report', help='write a timeline or custom PDF report')
+    command.add_argument('case_id', type=int)
+    command.add_argument('report', choices=('timeline', 'custom'))
+    command.add_argument('--type', default='documents, text messages, emails',
+                         help='sections of a custom report, as typed in the app')
+    command.add_argument('--out', help='default: reports/case_<id>_timeline.pdf or _custom_report.pdf')
+    command = commands.add_parser('import', help='import files and wait for them to finish')
+    command.add_argument('case_id', type=int)
+    command.add_argument('files', nargs='+')
+    command.add_argument('--kind', choices=sorted(KINDS))
+    command.add_argument('--name', help='default: the file name')
+    command.add_argument('--date', help='default: from the file, as in bulk import')
+    command.add_argument('--category', help='of documents (default: Imported)')
+    command = commands.add_parser('serve', help='serve the local HTTP API (see api.py)')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8765)
+    command.add_argument('--token', help='default: CASE_MANAGER_API_TOKEN, or a new random token')
+    command.add_argument('--readers', type=int, default=db.READERS)
+    args = parser.parse_args(argv)
+    password = os.environ.get('CASE_MANAGER_PASSWORD') or getpass.getpass('Database password: ')
+    service = CaseService(password, args.db, readers=getattr(args, 'readers', db.READERS))
+    try:
+        result = run(service, args)
+    except ValueError as e:
+        sys.exit(f'Error: {e}')
+    finally:
+        service.close()
+    if args.json:
+        print(json.dumps(result, indent=2, default=str))
+    elif isinstance(result, list):
+        _print_rows(result)
+    elif result is not None:
+        print(result)
+    if args.command == 'import' and any(status == ingest.FAILED for _, status, _ in result):
+        sys.exit(1)
+
+
+def run(service, args):
+    if args.command == 'cases':
+        return service.cases()
+    if args.command == 'new-case':
+        return service.create_case(args.case_name, args.state, args.separate)
+    if args.command == 'add-event':
+        return service.add_event(args.case_id, args.date, args.description, args.event_type)
+    if args.command == 'add-message':
+        return service.add_text_message(args.case_id, args.date, args.sender, args.recipient, args.content)
+    if args.command == 'search':
+        hits, _ = service.search(args.case_id, args.query, limit=args.limit)
+        hits = [hit._replace(snippet=_plain_snippet(hit.snippet)) for hit in hits]
+        return [hit._asdict() for hit in hits] if args.json else \
+            [(hit.source, hit.source_id, hit.date, hit.title, hit.snippet) for hit in hits]
+    if args.command == 'timeline':
+        rows, after = [], None
+        while True:
+            page, after = service.timeline(args.case_id, after)
+            rows += page
+            if after is None:
+                return rows
+    if args.command == 'report':
+        if args.report == 'timeline':
+            path = args.out or reports.report_path(args.case_id, reports.TIMELINE_PDF)
+            rendered = service.timeline_report(args.case_id, path)
+        else:
+            path = args.out or reports.report_path(args.case_id, reports.CUSTOM_REPORT_PDF)
+            rendered = service.custom_report(args.case_id, args.type, path)
+        if args.json:
+            return dict(rendered._asdict(), path=os.path.abspath(path))
+        return f'{path}: {rendered.pages} pages, {rendered.lines} lines'
+    if args.command == 'import':
+        # Every file is checked before any is queued.
+        payloads = [file_payload(file_path, args.kind, args.name, args.date, args.category)
+                    for file_path in args.files]
+        job_ids = {service.submit_payload(args.case_id, kind, payload): path
+                   for path, (kind, payload) in zip(args.files, payloads)}
+        finished = service.wait(job_ids, case_id=args.case_id)
+        return [(job_ids[job_id], status, error) for job_id, (status, error) in sorted(finished.items())]
+    if args.command == 'serve':
+        import api
+
+        api.serve(service, args.host, args.port, args.token)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import diagnostics
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_MS = 30
+FRAME_BYTES = SAMPLE_RATE * SAMPLE_WIDTH * FRAME_MS // 1000
+
+# Chunks are cut at the first quiet frame after MIN_CHUNK_S and forced at
+# MAX_CHUNK_S, which keeps each request under the free Google API limit.
+MIN_CHUNK_S = 8
+MAX_CHUNK_S = 30
+SILENCE_RMS = 300
+
+ENGINE_ENV = 'CASE_MANAGER_STT_ENGINE'
+DEFAULT_ENGINE = 'google'
+
+Chunk = namedtuple('Chunk', 'index start end pcm')
+Segment = namedtuple('Segment', 'start end text')
+
+
+class GoogleEngine:
+    # Free web API through speech_recognition; needs network access.
+    def __init__(self, language='en-US'):
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = sr.Recognizer()
+        self.language = language
+
+    def transcribe(self, pcm):
+        audio = self.sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio, language=self.language)
+        except self.sr.UnknownValueError:
+            return ''
+
+
+class SphinxEngine:
+    # Offline, via pocketsphinx; lowest accuracy but no model download.
+    def __init__(self, language='en-US'):
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = sr.Recognizer()
+        self.language = language
+
+    def transcribe(self, pcm):
+        audio = self.sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_sphinx(audio, language=self.language)
+        except self.sr.UnknownValueError:
+            return ''
+
+
+class VoskEngine:
+    # Offline; model_path points at an unpacked model from alphacephei.com/vosk/models.
+    _models = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_path=None):
+        import vosk
+        self.vosk = vosk
+        model_path = model_path or os.environ.get('CASE_MANAGER_VOSK_MODEL', 'vosk-model-small-en-us')
+        with self._lock:
+            if model_path not in self._models:
+                self._models[model_path] = vosk.Model(model_path)
+        self.model = self._models[model_path]
+
+    def transcribe(self, pcm):
+        recognizer = self.vosk.KaldiRecognizer(self.model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get('text', '')
+
+
+class WhisperEngine:
+    # Offline on CPU via faster-whisper (int8); model is downloaded on first use.
+    def __init__(self, model_size=None):
+        from faster_whisper import WhisperModel
+        model_size = model_size or os.environ.get('CASE_MANAGER_WHISPER_MODEL', 'base')
+        self.model = WhisperModel(model_size, device='cpu', compute_type='int8', cpu_threads=1)
+
+    def transcribe(self, pcm):
+        import numpy as np
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(samples, beam_size=1)
+        return ' '.join(s.text.strip() for s in segments)
+
+
+ENGINES = {
+    'google': GoogleEngine,
+    'sphinx': SphinxEngine,
+    'vosk': VoskEngine,
+    'whisper': WhisperEngine,
+}
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS audio_segments (
+        segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        audio_id INTEGER,
+        start_time REAL,
+        end_time REAL,
+        text TEXT,
+        FOREIGN KEY(audio_id) REFERENCES audio_recordings(audio_id)
+    )''')
+
+
+def store_segments(conn, audio_id, segments):
+    conn.cursor().executemany('INSERT INTO audio_segments VALUES (NULL, ?, ?, ?, ?)',
+                              [(audio_id, start, end, text) for start, end, text in segments])
+
+
+def engine_name():
+    return os.environ.get(ENGINE_ENV, DEFAULT_ENGINE)
+
+
+def decode(file_path, read_size=FRAME_BYTES * 100, start=None, length=None):
+    """Yield 16 kHz mono s16le PCM from any format ffmpeg understands.
+
+    start and length (seconds) read part of the file; the input is seeked,
+    not decoded up to start. Video streams are never decoded.
+    """
+    import ffmpeg
+
+    window = {key: value for key, value in (('ss', start), ('t', length)) if value is not None}
+    process = (ffmpeg.input(file_path, **window)
+               .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=SAMPLE_RATE, vn=None)
+               .global_args('-nostdin', '-loglevel', 'error')
+               .run_async(pipe_stdout=True))
+    try:
+        while True:
+            data = process.stdout.read(read_size)
+            if not data:
+                break
+            yield data
+        if process.wait() != 0:
+            raise RuntimeError(f'ffmpeg could not decode {file_path}')
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def split_on_silence(pcm_stream, min_chunk_s=MIN_CHUNK_S, max_chunk_s=MAX_CHUNK_S, silence_rms=SILENCE_RMS):
+    import numpy as np
+
+    min_frames = min_chunk_s * 1000 // FRAME_MS
+    max_frames = max_chunk_s * 1000 // FRAME_MS
+    buf = bytearray()
+    chunk = bytearray()
+    frames = 0
+    start_frame = 0
+    index = 0
+    for data in pcm_stream:
+        buf += data
+        usable = len(buf) - len(buf) % FRAME_BYTES
+        if not usable:
+            continue
+        samples = np.frombuffer(bytes(buf[:usable]), dtype=np.int16).astype(np.float32)
+        rms = np.sqrt((samples.reshape(-1, FRAME_BYTES // SAMPLE_WIDTH) ** 2).mean(axis=1))
+        for i, level in enumerate(rms):
+            chunk += buf[i * FRAME_BYTES:(i + 1) * FRAME_BYTES]
+            frames += 1
+            if frames >= max_frames or (frames >= min_frames and level < silence_rms):
+                yield Chunk(index, start_frame * FRAME_MS / 1000, (start_frame + frames) * FRAME_MS / 1000,
+                            bytes(chunk))
+                index += 1
+                start_frame += frames
+                chunk = bytearray()
+                frames = 0
+        del buf[:usable]
+    chunk += buf
+    if chunk:
+        end = start_frame * FRAME_MS / 1000 + len(chunk) / (SAMPLE_RATE * SAMPLE_WIDTH)
+        yield Chunk(index, start_frame * FRAME_MS / 1000, end, bytes(chunk))
+
+
+def transcribe_stream(pcm_stream, engine=None, workers=None, engine_options=None):
+    """Transcribe a PCM stream chunk by chunk on a bounded thread pool.
+
+    Each worker thread builds its own engine instance. At most ``workers * 2``
+    chunks are decoded ahead of the recognizer, so memory use does not grow
+    with the length of the recording. Returns Segments in time order.
+    """
+    engine_cls = ENGINES[engine or engine_name()]
+    engine_options = engine_options or {}
+    workers = workers or min(8, os.cpu_count() or 1)
+    local = threading.local()
+
+    def run(chunk):
+        if not hasattr(local, 'engine'):
+            local.engine = engine_cls(**engine_options)
+        start = time.perf_counter()
+        text = local.engine.transcribe(chunk.pcm).strip()
+        return Segment(chunk.start, chunk.end, text), (time.perf_counter() - start) * 1000
+
+    def collect(index, future):
+        # Recognizer time is summed over the workers, next to the wall time of the operation.
+        segment, elapsed = future.result()
+        diagnostics.count('stt_ms', round(elapsed))
+        diagnostics.count('audio_s', round(segment.end - segment.start, 2))
+        segments[index] = segment
+
+    segments = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stt') as pool:
+        pending = {}
+        for chunk in split_on_silence(pcm_stream):
+            pending[pool.submit(run, chunk)] = chunk.index
+            if len(pending) >= workers * 2:
+                with diagnostics.span('stt.wait'):
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(pending.pop(future), future)
+        with diagnostics.span('stt.wait'):
+            for future in pending:
+                collect(pending[future], future)
+    return [segments[i] for i in sorted(segments)]
+
+
+def transcribe_file(file_path, engine=None, workers=None, engine_options=None):
+    return transcribe_stream(decode(file_path), engine, workers, engine_options)
+
+
+def join_segments(segments):
+    return ' '.join(s.text for s in segments if s.text)
@@ -0,0 +1,170 @@
+import io
+import math
+
+import attachments
+import transcription
+
+# Long recordings are worked through this many seconds at a time, each with
+# its own short ffmpeg run, checking for cancellation in between.
+SEGMENT_S = 600
+# One preview frame per interval, spread wider on long videos so there are
+# never more than MAX_THUMBNAILS however long the recording is.
+THUMBNAIL_INTERVAL_S = 60
+MAX_THUMBNAILS = 60
+THUMBNAIL_WIDTH = 240
+
+
+class Cancelled(Exception):
+    pass
+
+
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS videos (
+        video_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_id INTEGER,
+        video_name TEXT,
+        file_path TEXT,
+        transcription TEXT,
+        video_date TEXT,
+        duration REAL,
+        video_codec TEXT,
+        audio_codec TEXT,
+        width INTEGER,
+        height INTEGER,
+        sort_date TEXT,
+        FOREIGN KEY(case_id) REFERENCES cases(case_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS video_segments (
+        segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_id INTEGER,
+        start_time REAL,
+        end_time REAL,
+        text TEXT,
+        FOREIGN KEY(video_id) REFERENCES videos(video_id)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS video_thumbnails (
+        thumbnail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_id INTEGER,
+        time REAL,
+        image BLOB,
+        FOREIGN KEY(video_id) REFERENCES videos(video_id)
+    )''')
+
+
+def store_segments(conn, video_id, segments):
+    conn.cursor().executemany('INSERT INTO video_segments VALUES (NULL, ?, ?, ?, ?)',
+                              [(video_id, start, end, text) for start, end, text in segments])
+
+
+def save_frames(conn, frames):
+    """Put the JPEGs extract() took in the attachment store; returns [[seconds, sha256]].
+
+    Only these references go in the cached extraction and video_thumbnails,
+    so evidence_files doesn't carry a few MB of images per video. The caller
+    commits.
+    """
+    files = attachments.store(conn)
+    thumbnails = []
+    for time, image in frames:
+        sha256, size, chunk_ids = files.write_stream(io.BytesIO(image))
+        attachments.save(conn, sha256, size, chunk_ids)
+        thumbnails.append([time, sha256])
+    return thumbnails
+
+
+def store_thumbnails(conn, video_id, thumbnails):
+    conn.cursor().executemany('INSERT INTO video_thumbnails (video_id, time, sha256) VALUES (?, ?, ?)',
+                              [(video_id, time, sha256) for time, sha256 in thumbnails])
+
+
+def thumbnails(conn, video_id):
+    """[(seconds, JPEG bytes)] of a stored video in time order."""
+    c = conn.cursor()
+    c.execute('SELECT time, sha256 FROM video_thumbnails WHERE video_id=? ORDER BY time', (video_id,))
+    frames = []
+    for time, sha256 in c.fetchall():
+        with attachments.reader(conn, sha256) as image:
+            frames.append((time, image.read()))
+    return frames
+
+
+def probe(file_path):
+    """Duration in seconds (0 if unknown), codecs and frame size, from ffprobe."""
+    import ffmpeg
+
+    info = ffmpeg.probe(file_path)
+    streams = info.get('streams', [])
+    # Cover art in an audio file is a one-frame 'video' stream.
+    picture = next((s for s in streams if s.get('codec_type') == 'video'
+                    and not s.get('disposition', {}).get('attached_pic')), {})
+    sound = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    duration = info.get('format', {}).get('duration') or picture.get('duration') or sound.get('duration')
+    return {'duration': float(duration or 0), 'video_codec': picture.get('codec_name'),
+            'audio_codec': sound.get('codec_name'), 'width': picture.get('width'), 'height': picture.get('height')}
+
+
+def thumbnail(file_path, at, width=THUMBNAIL_WIDTH):
+    """JPEG of the first keyframe at or after ``at`` seconds, or None past the end.
+
+    The input is seeked rather than read up to ``at`` and only keyframes are
+    decoded, so the cost doesn't depend on where in the video the frame is.
+    """
+    import ffmpeg
+
+    image, _ = (ffmpeg.input(file_path, ss=at, skip_frame='nokey')
+                .filter('scale', width, -2)
+                .output('pipe:', vframes=1, format='image2pipe', vcodec='mjpeg', **{'q:v': 5})
+                .global_args('-nostdin', '-loglevel', 'error')
+                .run(capture_stdout=True, capture_stderr=True))
+    return image or None
+
+
+def _check(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled('Cancelled.')
+
+
+def _pcm(file_path, start, length, cancelled):
+    for data in transcription.decode(file_path, start=start, length=length):
+        _check(cancelled)
+        yield data
+
+
+def extract(file_path, cancelled=None, engine=None, workers=None):
+    """Transcribe a video and take its preview frames, one segment at a time.
+
+    Only the audio stream is decoded for transcription (ffmpeg streams it as
+    PCM; no frames reach Python), so memory stays flat for multi-hour
+    recordings. cancelled is a threading.Event; once set, Cancelled is raised
+    at the next chunk of audio or thumbnail. The frames are [seconds, JPEG
+    bytes] for save_frames().
+    """
+    info = probe(file_path)
+    duration = info['duration']
+    interval = max(THUMBNAIL_INTERVAL_S, duration / MAX_THUMBNAILS)
+    # Without a duration (a truncated recording) the audio is read to the end in one go.
+    windows = [(start, SEGMENT_S) for start in range(0, math.ceil(duration), SEGMENT_S)] if duration else [(0, None)]
+    segments, frames = [], []
+    at = 0.0
+    for start, length in windows:
+        _check(cancelled)
+        if info['audio_codec']:
+            for segment in transcription.transcribe_stream(_pcm(file_path, start, length, cancelled), engine,
+                                                           workers):
+                segments.append(transcription.Segment(round(start + segment.start, 2), round(start + segment.end, 2),
+                                                      segment.text))
+        end = start + length if length else duration
+        while info['video_codec'] and at < end:
+            _check(cancelled)
+            image = thumbnail(file_path, at)
+            if image:
+                frames.append([round(at, 2), image])
+            at += interval
+    return dict(info, transcription=transcription.join_segments(segments),
+                segments=[list(segment) for segment in segments], frames=frames)
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
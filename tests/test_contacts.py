@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import contacts  # noqa: E402
+
+
+def index(*names):
+    found = contacts.ContactIndex()
+    for contact_id, name in enumerate(names, 1):
+        found.add(contact_id, name)
+    return found
+
+
+class FuzzyMatchTest(unittest.TestCase):
+    def test_different_given_names_are_different_people(self):
+        self.assertIsNone(index('Mary Jones').match('Mark Jones'))
+        self.assertIsNone(index('Jane Smith').match('Jake Smith'))
+
+    def test_typo_in_surname(self):
+        self.assertEqual(index('Jane Smith').match('Jane Smyth'), 1)
+
+    def test_initial_for_given_name(self):
+        self.assertEqual(index('Jane Smith').match('J. Smith'), 1)
+
+    def test_initial_matching_two_contacts_matches_neither(self):
+        self.assertIsNone(index('Jane Smith', 'John Smith').match('J. Smith'))
+
+    def test_reordered_name(self):
+        self.assertEqual(index('Jane Smith').match('Smith, Jane'), 1)
+
+    def test_conflicting_phone(self):
+        found = contacts.ContactIndex()
+        found.add(1, 'Jane Smith', phone='555-123-4567')
+        self.assertIsNone(found.match('Jane Smyth', phone='555-765-4321'))
+
+
+class FindDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE contacts (contact_id INTEGER PRIMARY KEY, case_id INTEGER, name TEXT, '
+                          'email TEXT, phone TEXT, role TEXT)')
+
+    def add(self, name, role='Unknown'):
+        c = self.conn.execute('INSERT INTO contacts VALUES (NULL, 1, ?, ?, ?, ?)', (name, '', '', role))
+        return c.lastrowid
+
+    def test_similar_names_of_different_people_are_not_grouped(self):
+        for name in ('Mary Jones', 'Mark Jones', 'Jane Smith', 'Jake Smith'):
+            self.add(name)
+        self.assertEqual(contacts.find_duplicates(self.conn, 1), [])
+
+    def test_group_keeps_contact_added_by_hand(self):
+        first = self.add('Jane Smyth')
+        kept = self.add('Jane Smith', role='Caseworker')
+        self.add('Mark Jones')
+        self.assertEqual(contacts.find_duplicates(self.conn, 1), [[kept, first]])
+
+
+if __name__ == '__main__':
+    unittest.main()